@@ -1,19 +1,48 @@
-from google import generativeai as genai #type: ignore
+import asyncio
+import logging
 import os
 import io
-from typing import List
-from pydantic import BaseModel
+from typing import Annotated, List, Literal
+from pydantic import BaseModel, BeforeValidator
 from fastapi import UploadFile, File #type: ignore
-from helpers.config import api
 from PIL import Image
 from json import loads
 from helpers.file_handlers import Load, Extract
 from helpers.prompts import vehicle_details_extract_prompt as prompt
+from AI_ML.llm_cache import cached_acall, request_key
+from AI_ML.gemini import gemini
+from AI_ML.preprocess import jpeg_bytes, normalize_images
+from AI_ML.resilience import CircuitBreaker, RateLimited, TokenBucket, call_with_retries, is_transient
+from helpers.cache import Uncached
+from helpers.config import (gemini_rate_per_minute, gemini_burst, gemini_rate_max_wait, gemini_retries,
+                            gemini_retry_base, gemini_retry_max, gemini_breaker_failures, gemini_breaker_reset,
+                            llm_fallback_enabled, ollama_model, ollama_timeout)
+from dataclasses import dataclass
+from starlette.concurrency import run_in_threadpool #type: ignore
 import ollama #type: ignore
 
-def gemini_ai(prompt: str, *args : Image.Image):
-    genai.configure(api_key = api)
-    model = genai.GenerativeModel("gemini-2.5-flash")
+logger = logging.getLogger(__name__)
+
+
+class LLMUnavailable(Exception):
+    """Neither Gemini nor the local fallback model produced an answer."""
+
+
+@dataclass
+class LLMAnswer:
+    text: str
+    model: str
+    fallback: bool = False
+
+
+gemini_breaker = CircuitBreaker(gemini_breaker_failures, gemini_breaker_reset)
+gemini_bucket = TokenBucket(gemini_rate_per_minute / 60, gemini_burst)
+ollama_client = ollama.Client(timeout=ollama_timeout)
+llm_metrics = {"calls": 0, "gemini_answers": 0, "retries": 0, "fallbacks": 0, "fallback_failures": 0,
+               "fallback_reasons": {"circuit_open": 0, "rate_limited": 0, "error": 0}}
+
+
+async def gemini_ai(prompt: str, *args : Image.Image):
     contents = []
     for img in args:
         if isinstance(img, Image.Image):
@@ -23,15 +52,97 @@ def gemini_ai(prompt: str, *args : Image.Image):
 
     contents.append({"text": prompt})
 
-    try:
+    # errors propagate, llm_ai decides between retrying, falling back and failing
+    response = await gemini.generate(contents, stream=False)
+    return response.text
+
+
+async def gemini_stream_ai(prompt: str, *images: Image.Image, on_chunk):
+    """``gemini_ai`` streamed: ``on_chunk`` gets each piece of the answer as it arrives."""
+    contents: list = [img for img in images if isinstance(img, Image.Image)]
+    contents.append({"text": prompt})
+    parts = []
+    async for text in gemini.stream(contents):
+        parts.append(text)
+        on_chunk(text)
+    return "".join(parts)
 
-        response = model.generate_content(contents=contents, stream=False)
 
-        return response.text
+async def llm_ai(prompt: str, *images: Image.Image, on_chunk=None) -> LLMAnswer:
+    """
+    Gemini behind the rate limiter, retries and circuit breaker, with the local
+    Ollama model answering when Gemini is refused or keeps failing. Errors that
+    are not transient (a rejected request, a blocked answer) are raised as is.
+
+    With ``on_chunk`` Gemini's answer is streamed to it as it arrives, and it
+    gets ``None`` when a retry or the fallback model starts the answer over.
+    """
+    llm_metrics["calls"] += 1
+    reason = "circuit_open"
+    streamed = []
+
+    def forward(text):
+        streamed.append(text)
+        on_chunk(text)
+
+    def start_over():
+        if streamed:
+            streamed.clear()
+            on_chunk(None)
+
+    if gemini_breaker.allow():
+        async def attempt():
+            await gemini_bucket.acquire(gemini_rate_max_wait)
+            if on_chunk is None:
+                return await gemini_ai(prompt, *images)
+            start_over()
+            return await gemini_stream_ai(prompt, *images, on_chunk=forward)
+
+        def count_retry(error):
+            llm_metrics["retries"] += 1
+            logger.warning("Retrying Gemini after %r", error)
 
+        try:
+            text = await call_with_retries(attempt, gemini_retries, gemini_retry_base, gemini_retry_max, count_retry)
+        except RateLimited:
+            # our own quota guard, says nothing about Gemini's health
+            gemini_breaker.release()
+            reason = "rate_limited"
+        except Exception as e:
+            if not is_transient(e):
+                gemini_breaker.release()
+                raise
+            gemini_breaker.record_failure()
+            logger.warning("Gemini inference failed: %r", e)
+            reason = "error"
+        else:
+            gemini_breaker.record_success()
+            llm_metrics["gemini_answers"] += 1
+            return LLMAnswer(text, gemini.model_name)
+
+    if not llm_fallback_enabled:
+        raise LLMUnavailable(f"Gemini is unavailable ({reason.replace('_', ' ')}), try again later")
+    llm_metrics["fallbacks"] += 1
+    llm_metrics["fallback_reasons"][reason] += 1
+    start_over()
+    try:
+        text = await run_in_threadpool(llava_ai, prompt, *images)
     except Exception as e:
-        print(f"Error during Gemini inference: {e}")
-        return None
+        llm_metrics["fallback_failures"] += 1
+        raise LLMUnavailable(f"Gemini is unavailable ({reason.replace('_', ' ')}) and the local model failed: {e}") from e
+    return LLMAnswer(text, ollama_model, fallback=True)
+
+
+def resilience_snapshot() -> dict:
+    calls = llm_metrics["calls"]
+    return {
+        "breaker": gemini_breaker.snapshot(),
+        "rate_limit": gemini_bucket.snapshot(),
+        **llm_metrics,
+        "fallback_rate": round(llm_metrics["fallbacks"] / calls, 4) if calls else 0.0,
+    }
+
+
 class vehicle_validation_request(BaseModel):
     front_img: UploadFile 
     back_img: UploadFile 
@@ -42,21 +153,30 @@ class vehicle_validation_request(BaseModel):
     type: str
     year: int
 
-def verify_vehicle_images(front:UploadFile,
-                            back:UploadFile,
-                            left:UploadFile, 
-                            right:UploadFile, 
-                            make:str, model:str, type:str, year:int):
-    front= Image.open(front.file)  
-    back = Image.open(back.file)
-    left = Image.open(left.file)
-    right = Image.open(right.file)
+async def verify_vehicle_images(front:UploadFile | str,
+                            back:UploadFile | str,
+                            left:UploadFile | str, 
+                            right:UploadFile | str, 
+                            make:str, model:str, type:str, year:int,
+                            use_cache: bool = True):
+    """
+    ``[valid, details, cached]``; ``cached`` tells whether Gemini's answer for
+    these four photos came from the LLM cache.
+    """
+    # upright, scaled down and re-encoded: a fraction of the bytes to decode, hash and send
+    front, back, left, right = await normalize_images([front, back, left, right])
     ex=Extract()
-  # Replace with the appropriate response value
-    response = gemini_ai(prompt,front, back, left, right )
-    print("response", response)
-    rectify = ex.extract_code(response) 
-    result = loads(rectify)
+
+    async def extract():
+        answer = await llm_ai(prompt,front, back, left, right )
+        result = loads(ex.extract_code(answer.text))
+        # the fallback model's answer serves this request but isn't kept as Gemini's
+        return Uncached(result) if answer.fallback else result
+
+    # decoding the photos for the key is CPU work, keep it off the event loop
+    key = await run_in_threadpool(request_key, gemini.model_name, "vehicle_details_extract_prompt", prompt,
+                                  [front, back, left, right])
+    result, cached = await cached_acall(key, extract, use_cache)
     year_range = list(map(int,result['Manufacturing_year_range'].split('-')))
     year_validity = year_range[0] <= int(year)
 
@@ -64,24 +184,46 @@ def verify_vehicle_images(front:UploadFile,
         and result['model'].lower() == model.lower() 
         and result['vehicle_type'].lower()==type.lower() 
         and year_validity):
-        return [True, result]
+        return [True, result, cached]
     else:
         result = "Vehicle details are not valid!"
-        # print("result['make'].lower() == make.lower()", result['make'].lower(), make.lower())
-        # print("result['model'].lower() == model.lower()", result['model'].lower(), model.lower())
-        # print("result['vehicle_type'].lower() == type.lower()", result['vehicle_type'].lower(), type.lower())
-        # print("year_validity", year_validity, year_range, year)
-        return [False,result]
+        return [False,result, cached]
     
 
-def claims_damage_report(
+def _percentage(value):
+    # the prompt asks for a number, models still answer "35%" now and then
+    return value.strip().rstrip("%").strip() if isinstance(value, str) else value
+
+
+def _severity(value):
+    return value.strip().capitalize() if isinstance(value, str) else value
+
+
+class ClaimDamageReport(BaseModel):
+    """The JSON ``claims_damage_report_and_analysis`` asks the model for."""
+    damage_analysis: str
+    damage_percentage: Annotated[float, BeforeValidator(_percentage)]
+    severity_level: Annotated[Literal["Low", "Moderate", "High", "Critical"], BeforeValidator(_severity)]
+    approvable_amount: float
+    reason_for_approval: str
+    remarks: str
+
+
+async def claims_damage_report(
     damage_description: str,
     requested_amount: float,
     claimable_amount: float,
-    images: List[Image.Image]   # Now accepts already-opened PIL Images
+    images: List[Image.Image],   # Now accepts already-opened PIL Images
+    use_cache: bool = True,
+    on_chunk=None,
+    schema: type[BaseModel] | None = None
 ):
     """
     Validate a claim based on damage description and associated images.
+    ``cached`` in the result tells whether the analysis came from the LLM cache.
+    ``on_chunk`` streams the model's answer as in ``llm_ai``; with ``schema``
+    the details are validated against it (raising ``ValidationError``) and an
+    answer that doesn't fit is not cached.
     """
     if not images:
         raise ValueError("At least one image must be provided")
@@ -91,35 +233,89 @@ def claims_damage_report(
 
     prompt = claims_report(damage_description, requested_amount, claimable_amount)
 
-    response = gemini_ai(prompt, images)   # Pass images to your AI #type: ignore
-    rectify = ex.extract_code(response)
-    result = loads(rectify)
+    async def analyse():
+        answer = await llm_ai(prompt, *images, on_chunk=on_chunk)
+        result = loads(ex.extract_code(answer.text))
+        if schema is not None:
+            schema.model_validate(result)
+        return Uncached(result) if answer.fallback else result
+
+    key = await run_in_threadpool(request_key, gemini.model_name, "claims_damage_report_and_analysis", prompt, images)
+    result, cached = await cached_acall(key, analyse, use_cache)
+    if result and schema is not None:
+        result = schema.model_validate(result).model_dump()
 
-    if response:
-        return {"valid": True, "details": result}
+    if result:
+        return {"valid": True, "details": result, "cached": cached}
     else:
-        return {"valid": False, "details": "Failed to validate claim."}
+        return {"valid": False, "details": "Failed to validate claim.", "cached": cached}
 
-from typing import List
-from PIL import Image
+async def stream_claims_damage_report(
+    damage_description: str,
+    requested_amount: float,
+    claimable_amount: float,
+    images: List[Image.Image],
+    use_cache: bool = True,
+    keepalive: float = 15.0
+):
+    """
+    ``(event, data)`` pairs for the streamed claim validation: ``chunk`` with
+    Gemini's text as it arrives, ``reset`` when a retry or the fallback model
+    starts the answer over, ``keepalive`` after ``keepalive`` quiet seconds,
+    then ``result`` with the details validated against ``ClaimDamageReport``.
+    A cached or fallback answer arrives as the ``result`` alone.
+    """
+    events: asyncio.Queue = asyncio.Queue()
 
+    def on_chunk(text):
+        events.put_nowait(("reset", {}) if text is None else ("chunk", {"text": text}))
 
-def llava_ai(prompt: str, *image_paths: str):
-    if not image_paths:
+    task = asyncio.create_task(claims_damage_report(damage_description, requested_amount, claimable_amount,
+                                                    images, use_cache, on_chunk=on_chunk, schema=ClaimDamageReport))
+    task.add_done_callback(lambda _: events.put_nowait(None))
+    try:
+        while True:
+            try:
+                event = await asyncio.wait_for(events.get(), keepalive)
+            except TimeoutError:
+                yield "keepalive", {}
+                continue
+            if event is None:
+                break
+            yield event
+        result = task.result()
+    finally:
+        # the client went away mid-answer
+        task.cancel()
+    yield "result", result
+
+
+def llava_ai(prompt: str, *images):
+    """Ask the local Ollama model; ``images`` are file paths, raw bytes or PIL images."""
+    if not images:
         raise ValueError("At least one image path must be provided")
 
-    res = ollama.chat(
-        model="cogito:8b",
+    res = ollama_client.chat(
+        model=ollama_model,
         messages=[
             {
                 'role': 'user',
                 'content': prompt,
-                'images': list(image_paths)  # pass the image file paths
+                'images': [_image_bytes(image) if isinstance(image, Image.Image) else image for image in images]
             }
         ]
     )
 
     return res['message']['content']
+
+
+def _image_bytes(image: Image.Image) -> bytes:
+    encoded = jpeg_bytes(image)
+    if encoded is not None:
+        return encoded
+    buffer = io.BytesIO()
+    image.convert("RGB").save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
     
 
 if __name__ == "__main__":
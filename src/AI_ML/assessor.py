@@ -0,0 +1,168 @@
+"""
+Tiered claim assessment. Most claims are a scratch or a dent for a small
+amount, and Gemini's multi-second analysis adds little to them. The local
+tier runs cheap rules and the local damage classifier first and settles a
+claim itself only when all of these hold:
+
+- the requested amount is at most ``ASSESS_MAX_LOCAL_AMOUNT`` and within the
+  policy's claimable amount,
+- the description mentions none of ``ASSESS_ESCALATE_TERMS``,
+- no photo was uploaded twice,
+- the classifier sees one of ``ASSESS_LOCAL_LABELS`` on every photo with at
+  least ``ASSESS_MIN_CONFIDENCE`` probability.
+
+Everything else escalates to ``claims_damage_report``. The result says which
+tier decided (``tier``) and, when Gemini did, why (``escalation``).
+"""
+import threading
+
+from PIL import Image
+from starlette.concurrency import run_in_threadpool #type: ignore
+
+from AI_ML.agents import ClaimDamageReport, claims_damage_report, stream_claims_damage_report
+from AI_ML.batching import BatcherFull
+from AI_ML.damage_predictor import ClassifierUnavailable, damage_batcher, damage_classifier
+from AI_ML.llm_cache import image_digest
+from helpers.config import (assess_tiered, assess_min_confidence, assess_max_local_amount, assess_local_labels,
+                            assess_escalate_terms)
+
+LOCAL, GEMINI = "local", "gemini"
+
+# rough share of the vehicle a single damage of each kind covers
+DAMAGE_PERCENTAGE = {"scratch": 5.0, "dent": 10.0, "crack": 15.0, "lamp broken": 10.0, "tire flat": 5.0,
+                     "glass shatter": 20.0}
+
+ESCALATIONS = ("disabled", "amount", "exceeds_policy", "description", "duplicate_photos", "classifier_unavailable",
+               "classifier_busy", "classifier_error", "damage_type", "low_confidence")
+
+_lock = threading.Lock()
+assessor_metrics = {"claims": 0, LOCAL: 0, GEMINI: 0, "escalations": dict.fromkeys(ESCALATIONS, 0)}
+
+
+class Triage:
+    """The local tier's verdict: a report when it settled the claim, otherwise why it escalates."""
+
+    def __init__(self, report: dict | None = None, escalation: list[str] | None = None,
+                 predictions: list[dict] | None = None):
+        self.report = report
+        self.escalation = escalation or []
+        self.predictions = predictions
+
+    @property
+    def tier(self) -> str:
+        return LOCAL if self.report is not None else GEMINI
+
+
+def rule_escalations(damage_description: str, requested_amount: float, claimable_amount: float) -> list[str]:
+    """The rules that send a claim to Gemini whatever the photos show."""
+    reasons = []
+    if requested_amount > assess_max_local_amount:
+        reasons.append("amount")
+    if requested_amount > claimable_amount:
+        reasons.append("exceeds_policy")
+    description = damage_description.lower()
+    if any(term in description for term in assess_escalate_terms):
+        reasons.append("description")
+    return reasons
+
+
+def local_report(predictions: list[dict], requested_amount: float, claimable_amount: float) -> dict:
+    """A report in the shape Gemini's has, for photos the classifier is sure show minor damage."""
+    labels = sorted({prediction["label"] for prediction in predictions})
+    confidence = min(prediction["score"] for prediction in predictions)
+    report = ClaimDamageReport(
+        damage_analysis=f"Minor damage ({', '.join(labels)}) on {len(predictions)} photo(s), "
+                        f"identified by {damage_classifier.model_name}.",
+        damage_percentage=max(DAMAGE_PERCENTAGE.get(label.lower(), 10.0) for label in labels),
+        severity_level="Low",
+        approvable_amount=min(requested_amount, claimable_amount),
+        reason_for_approval=f"The requested amount is within the policy and the automatic settlement limit "
+                            f"of {assess_max_local_amount:g} for minor damage.",
+        remarks=f"Assessed by the local classifier without an LLM review, lowest photo confidence {confidence:.2f}.",
+    )
+    return report.model_dump()
+
+
+async def triage(damage_description: str, requested_amount: float, claimable_amount: float,
+                 images: list[Image.Image]) -> Triage:
+    """Run the local tier; cheap rules first so a claim they escalate never waits for the classifier."""
+    if not assess_tiered:
+        return Triage(escalation=["disabled"])
+    reasons = rule_escalations(damage_description, requested_amount, claimable_amount)
+    if reasons:
+        return Triage(escalation=reasons)
+    digests = await run_in_threadpool(lambda: [image_digest(image) for image in images])
+    if len(set(digests)) < len(digests):
+        return Triage(escalation=["duplicate_photos"])
+    try:
+        predictions = await damage_batcher.submit(images)
+    except ClassifierUnavailable:
+        return Triage(escalation=["classifier_unavailable"])
+    except BatcherFull:
+        return Triage(escalation=["classifier_busy"])
+    except Exception:
+        # the local tier is an optimisation, Gemini can still answer
+        return Triage(escalation=["classifier_error"])
+    if any(prediction["label"].lower() not in assess_local_labels for prediction in predictions):
+        reasons.append("damage_type")
+    if any(prediction["score"] < assess_min_confidence for prediction in predictions):
+        reasons.append("low_confidence")
+    if reasons:
+        return Triage(escalation=reasons, predictions=predictions)
+    return Triage(local_report(predictions, requested_amount, claimable_amount), predictions=predictions)
+
+
+def _record(verdict: Triage):
+    with _lock:
+        assessor_metrics["claims"] += 1
+        assessor_metrics[verdict.tier] += 1
+        for reason in verdict.escalation:
+            assessor_metrics["escalations"][reason] += 1
+
+
+def _tiered(result: dict, verdict: Triage) -> dict:
+    return {**result, "tier": verdict.tier, "escalation": verdict.escalation, "local_predictions": verdict.predictions}
+
+
+async def assess_claim(damage_description: str, requested_amount: float, claimable_amount: float,
+                       images: list[Image.Image], use_cache: bool = True) -> dict:
+    """``claims_damage_report``'s result, from the local tier when it can settle the claim."""
+    if not images:
+        raise ValueError("At least one image must be provided")
+    verdict = await triage(damage_description, requested_amount, claimable_amount, images)
+    _record(verdict)
+    if verdict.report is not None:
+        return _tiered({"valid": True, "details": verdict.report, "cached": False}, verdict)
+    result = await claims_damage_report(damage_description, requested_amount, claimable_amount, images, use_cache)
+    return _tiered(result, verdict)
+
+
+async def stream_assess_claim(damage_description: str, requested_amount: float, claimable_amount: float,
+                              images: list[Image.Image], use_cache: bool = True):
+    """``stream_claims_damage_report``'s events; a claim the local tier settles is a ``result`` alone."""
+    if not images:
+        raise ValueError("At least one image must be provided")
+    verdict = await triage(damage_description, requested_amount, claimable_amount, images)
+    _record(verdict)
+    if verdict.report is not None:
+        yield "result", _tiered({"valid": True, "details": verdict.report, "cached": False}, verdict)
+        return
+    async for event, data in stream_claims_damage_report(damage_description, requested_amount, claimable_amount,
+                                                         images, use_cache):
+        yield event, _tiered(data, verdict) if event == "result" else data
+
+
+def assessor_snapshot() -> dict:
+    with _lock:
+        claims = assessor_metrics["claims"]
+        return {
+            "tiered": assess_tiered,
+            "min_confidence": assess_min_confidence,
+            "max_local_amount": assess_max_local_amount,
+            "local_labels": assess_local_labels,
+            "claims": claims,
+            LOCAL: assessor_metrics[LOCAL],
+            GEMINI: assessor_metrics[GEMINI],
+            "local_share": round(assessor_metrics[LOCAL] / claims, 3) if claims else 0.0,
+            "escalations": dict(assessor_metrics["escalations"]),
+        }
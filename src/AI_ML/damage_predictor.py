@@ -1,22 +1,212 @@
-import numpy as np 
-from PIL import Image
-from transformers import AutoImageProcessor, AutoModelForImageClassification
-
-# Load the model and image processor
-processor = AutoImageProcessor.from_pretrained("beingamit99/car_damage_detection")
-model = AutoModelForImageClassification.from_pretrained("beingamit99/car_damage_detection")
-
-# Load and process the image
-image = Image.open(r"C:\practice\challenge\damage\image75.jpg")
-inputs = processor(images=image, return_tensors="pt")
-
-# Make predictions
-outputs = model(**inputs)
-logits = outputs.logits.detach().cpu().numpy()
-predicted_class_id = np.argmax(logits)
-predicted_proba = np.max(logits)
-label_map = model.config.id2label
-predicted_class_name = label_map[predicted_class_id]
-
-# Print the results
-print(f"Predicted class: {predicted_class_name} (probability: {predicted_proba:.4f}")
+"""
+Local car-damage classifier (``beingamit99/car_damage_detection`` by default)
+giving a cheap damage signal next to the Gemini analysis.
+
+The processor and model are loaded once, on first use. ``classify`` runs the
+images through them in batches of ``batch_size``, one batch at a time per
+process; ``damage_batcher`` gathers the photos of concurrent requests into
+those batches (see ``AI_ML.batching``). ``backend="onnx"`` exports the model
+to ONNX on first use, quantizes its weights to int8 and runs it with
+onnxruntime on the CPU, which is smaller and usually faster than eager PyTorch.
+
+transformers is an optional dependency, with torch for the default backend
+or onnxruntime for the ONNX one (exporting once needs torch and onnx too).
+Without them ``classify`` raises ``ClassifierUnavailable``.
+"""
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from AI_ML.batching import MicroBatcher
+from helpers.config import (damage_model, damage_backend, damage_batch_size, damage_batch_wait_ms, damage_queue_depth,
+                            damage_threads, damage_onnx_path)
+
+BACKENDS = ("torch", "onnx")
+
+
+class ClassifierUnavailable(Exception):
+    """The model or a library it needs could not be loaded."""
+
+
+def softmax(logits: np.ndarray) -> np.ndarray:
+    shifted = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return shifted / shifted.sum(axis=-1, keepdims=True)
+
+
+class TorchRunner:
+    def __init__(self, model, threads: int = 0):
+        import torch
+        if threads:
+            torch.set_num_threads(threads)
+        self.torch = torch
+        self.model = model.eval()
+
+    def __call__(self, pixel_values: np.ndarray) -> np.ndarray:
+        with self.torch.inference_mode():
+            return self.model(pixel_values=self.torch.from_numpy(pixel_values)).logits.numpy()
+
+
+class OnnxRunner:
+    def __init__(self, path: Path, threads: int = 0):
+        import onnxruntime #type: ignore
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.source_model = self.session.get_modelmeta().custom_metadata_map.get("source_model")
+
+    def __call__(self, pixel_values: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: pixel_values})[0]
+
+
+def export_onnx(model, path: Path, source_model: str, quantize: bool = True):
+    """Export ``model`` with a dynamic batch axis to ``path``, with int8 weights when ``quantize``."""
+    import onnx #type: ignore
+    import torch
+
+    class Logits(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model.eval()
+
+        def forward(self, pixel_values):
+            return self.model(pixel_values=pixel_values).logits
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    size = getattr(model.config, "image_size", 224)
+    exported = path.with_name(path.stem + ".fp32.onnx")
+    torch.onnx.export(Logits(), (torch.zeros(1, 3, size, size),), str(exported), input_names=["pixel_values"],
+                      output_names=["logits"], dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}},
+                      opset_version=17)
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic #type: ignore
+        quantize_dynamic(str(exported), str(path), weight_type=QuantType.QInt8)
+        exported.unlink()
+    else:
+        exported.replace(path)
+    # remembered so a changed DAMAGE_MODEL re-exports instead of using the old weights
+    graph = onnx.load(str(path))
+    onnx.helper.set_model_props(graph, {"source_model": source_model})
+    onnx.save(graph, str(path))
+
+
+class DamageClassifier:
+    """Image classification with ``model_name`` on the CPU, loaded on first use."""
+
+    def __init__(self, model_name: str, backend: str = "torch", batch_size: int = 8, onnx_path: Path | None = None,
+                 quantize: bool = True, threads: int = 0):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown damage classifier backend '{backend}', expected one of {BACKENDS}")
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+        self.onnx_path = onnx_path
+        self.quantize = quantize
+        self.threads = threads
+        self.labels: dict[int, str] = {}
+        self._processor = None
+        self._runner = None
+        self._load_lock = threading.Lock()
+        # one batch at a time, the runtimes already spread a batch over the cores
+        self._run_lock = threading.Lock()
+        self.load_seconds: float | None = None
+        self.metrics = dict.fromkeys(("calls", "images", "batches"), 0)
+        self.metrics["seconds"] = 0.0
+
+    @property
+    def loaded(self) -> bool:
+        return self._runner is not None
+
+    def load(self):
+        """Load the processor and model unless that already happened; raises ``ClassifierUnavailable``."""
+        if self._runner is not None:
+            return
+        with self._load_lock:
+            if self._runner is not None:
+                return
+            start = time.perf_counter()
+            try:
+                from transformers import AutoConfig, AutoImageProcessor, AutoModelForImageClassification #type: ignore
+                processor = AutoImageProcessor.from_pretrained(self.model_name)
+                config = AutoConfig.from_pretrained(self.model_name)
+                if self.backend == "onnx":
+                    runner = self._onnx_runner(AutoModelForImageClassification)
+                else:
+                    runner = TorchRunner(AutoModelForImageClassification.from_pretrained(self.model_name),
+                                         self.threads)
+            except ImportError as e:
+                raise ClassifierUnavailable(f"The {self.backend} damage classifier needs {e.name}, "
+                                            f"which is not installed") from e
+            except OSError as e:
+                raise ClassifierUnavailable(f"Could not load {self.model_name}: {e}") from e
+            self.labels = {int(index): label for index, label in config.id2label.items()}
+            self._processor = processor
+            self._runner = runner
+            self.load_seconds = time.perf_counter() - start
+
+    def _onnx_runner(self, model_class) -> OnnxRunner:
+        if self.onnx_path.exists():
+            runner = OnnxRunner(self.onnx_path, self.threads)
+            if runner.source_model == self.model_name:
+                return runner
+        export_onnx(model_class.from_pretrained(self.model_name), self.onnx_path, self.model_name, self.quantize)
+        return OnnxRunner(self.onnx_path, self.threads)
+
+    def _prediction(self, probabilities: np.ndarray) -> dict:
+        best = int(probabilities.argmax())
+        return {
+            "label": self.labels[best],
+            "score": round(float(probabilities[best]), 4),
+            "scores": {self.labels[index]: round(float(p), 4) for index, p in enumerate(probabilities)},
+        }
+
+    def classify(self, images: list[Image.Image]) -> list[dict]:
+        """The most likely label of each image, its probability and the probability of every label."""
+        self.load()
+        # as the photo was taken, the same way image_digest sees it
+        upright = [ImageOps.exif_transpose(image).convert("RGB") for image in images]
+        predictions = []
+        start = time.perf_counter()
+        with self._run_lock:
+            for offset in range(0, len(upright), self.batch_size):
+                batch = upright[offset:offset + self.batch_size]
+                pixels = self._processor(images=batch, return_tensors="np")["pixel_values"].astype(np.float32)
+                predictions.extend(self._prediction(row) for row in softmax(self._runner(pixels)))
+                self.metrics["batches"] += 1
+            self.metrics["calls"] += 1
+            self.metrics["images"] += len(upright)
+            self.metrics["seconds"] += time.perf_counter() - start
+        return predictions
+
+    def snapshot(self) -> dict:
+        images = self.metrics["images"]
+        return {
+            "model": self.model_name,
+            "backend": self.backend,
+            "batch_size": self.batch_size,
+            "loaded": self.loaded,
+            "load_seconds": round(self.load_seconds, 2) if self.load_seconds is not None else None,
+            **self.metrics,
+            "seconds": round(self.metrics["seconds"], 3),
+            "mean_ms_per_image": round(1000 * self.metrics["seconds"] / images, 2) if images else 0.0,
+        }
+
+
+damage_classifier = DamageClassifier(damage_model, damage_backend, batch_size=damage_batch_size,
+                                     onnx_path=damage_onnx_path, threads=damage_threads)
+
+# the photos of concurrent requests go through the model together
+damage_batcher = MicroBatcher(damage_classifier.classify, max_batch_size=damage_batch_size,
+                              max_wait=damage_batch_wait_ms / 1000, max_queue=damage_queue_depth)
+
+
+if __name__ == "__main__":
+    # python -m AI_ML.damage_predictor photo.jpg [photo.jpg ...]
+    photos = [Image.open(path) for path in sys.argv[1:]]
+    for path, prediction in zip(sys.argv[1:], damage_classifier.classify(photos)):
+        print(f"{path}: {prediction['label']} (probability: {prediction['score']:.4f})")
@@ -0,0 +1,134 @@
+"""
+Process-wide Gemini client.
+
+``genai.configure`` and ``GenerativeModel`` run once (at startup, or on first
+use from a script). Calls go through ``generate_content_async`` so waiting on
+Gemini never blocks the event loop, behind a semaphore that caps how many run
+at once per worker, and each one is bounded by a timeout; ``stream`` yields
+the answer's text as Gemini produces it. PIL images are encoded to request
+blobs on a worker thread, the SDK would otherwise encode them (lossless WebP)
+on the event loop; images from ``AI_ML.preprocess`` go as their JPEG bytes.
+"""
+import asyncio
+import time
+import weakref
+from contextlib import asynccontextmanager
+
+from google import generativeai as genai #type: ignore
+from google.generativeai.types import content_types #type: ignore
+from PIL import Image
+from starlette.concurrency import run_in_threadpool #type: ignore
+
+from AI_ML.preprocess import jpeg_bytes
+from helpers.config import api, gemini_model, gemini_max_concurrency, gemini_timeout
+
+
+class GeminiClient:
+    """One configured model, at most ``max_concurrency`` calls in flight, each cut off after ``timeout`` seconds."""
+
+    def __init__(self, api_key: str, model_name: str, max_concurrency: int = 4, timeout: float = 60.0):
+        self.api_key = api_key
+        self.model_name = model_name
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._model = None
+        # asyncio primitives belong to one loop, scripts and tests may run several
+        self._semaphores: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self.in_flight = 0
+        self.waiting = 0
+        self.metrics = dict.fromkeys(("calls", "timeouts", "errors"), 0)
+        self.metrics["seconds"] = 0.0
+
+    def start(self):
+        if self._model is None:
+            genai.configure(api_key=self.api_key)
+            self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    @property
+    def model(self):
+        return self._model or self.start()
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    @staticmethod
+    def _encode(contents: list) -> list:
+        return [GeminiClient._blob(part) if isinstance(part, Image.Image) else part for part in contents]
+
+    @staticmethod
+    def _blob(image: Image.Image):
+        # a normalized upload already is a compact JPEG, lossless WebP of its pixels would be several times larger
+        encoded = jpeg_bytes(image)
+        if encoded is not None:
+            return content_types.protos.Blob(mime_type="image/jpeg", data=encoded)
+        return content_types.image_to_blob(image)
+
+    @asynccontextmanager
+    async def _slot(self):
+        semaphore = self._semaphore()
+        self.waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            yield
+        except TimeoutError:
+            self.metrics["timeouts"] += 1
+            raise
+        except Exception:
+            self.metrics["errors"] += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            semaphore.release()
+            self.metrics["calls"] += 1
+            self.metrics["seconds"] += time.perf_counter() - start
+
+    async def generate(self, contents: list, **kwargs):
+        """``generate_content`` without blocking the loop; raises ``TimeoutError`` past ``timeout``."""
+        contents = await run_in_threadpool(self._encode, contents)
+        # the timeout covers Gemini only, not the wait for a free slot
+        async with self._slot():
+            return await asyncio.wait_for(self.model.generate_content_async(contents, **kwargs), self.timeout)
+
+    async def stream(self, contents: list, **kwargs):
+        """
+        The text of ``generate_content(stream=True)`` as it arrives. ``timeout``
+        bounds the wait for each chunk rather than the whole answer.
+        """
+        contents = await run_in_threadpool(self._encode, contents)
+        async with self._slot():
+            response = await asyncio.wait_for(self.model.generate_content_async(contents, stream=True, **kwargs),
+                                              self.timeout)
+            chunks = aiter(response)
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(anext(chunks), self.timeout)
+                except StopAsyncIteration:
+                    break
+                if chunk.parts:
+                    yield chunk.text
+
+    def snapshot(self) -> dict:
+        calls = self.metrics["calls"]
+        return {
+            "model": self.model_name,
+            "max_concurrency": self.max_concurrency,
+            "timeout_s": self.timeout,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            **self.metrics,
+            "seconds": round(self.metrics["seconds"], 3),
+            "mean_seconds": round(self.metrics["seconds"] / calls, 3) if calls else 0.0,
+        }
+
+
+gemini = GeminiClient(api, gemini_model, max_concurrency=gemini_max_concurrency, timeout=gemini_timeout)
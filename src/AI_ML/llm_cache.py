@@ -0,0 +1,106 @@
+"""
+Content-addressed cache of LLM answers.
+
+The key is a digest of everything that decides the answer: the model, the
+prompt template and its version from ``helpers.prompts.PROMPT_VERSIONS``, the
+rendered prompt (which carries the request parameters) and the decoded,
+orientation-corrected pixels of every image. Re-encoding or re-uploading the
+same photos therefore hits, while a changed prompt or model misses. The same
+key also coalesces identical calls in flight (``llm_flights``), which saves
+the duplicates of a double submit even when the cache is bypassed.
+
+Answers live in a SQLite file (see ``DiskBackend``) so they survive restarts
+and are shared by the workers of a host; concurrent identical calls wait for
+the first one instead of all paying for the model.
+"""
+import hashlib
+
+from PIL import Image, ImageOps
+
+from helpers.cache import Cache, DiskBackend, Uncached
+from helpers.config import llm_cache_enabled, llm_cache_path, llm_cache_max_bytes, llm_cache_ttl
+from helpers.prompts import PROMPT_VERSIONS
+from helpers.singleflight import SingleFlight
+
+
+def image_digest(image: Image.Image) -> str:
+    """Digest of the pixels as the model sees them, independent of file format and EXIF rotation."""
+    normalized = ImageOps.exif_transpose(image).convert("RGB")
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{normalized.size}".encode())
+    digest.update(normalized.tobytes())
+    return digest.hexdigest()
+
+
+def request_key(model: str, template: str, prompt: str, images=()) -> str:
+    digest = hashlib.sha256()
+    for part in (model, template, str(PROMPT_VERSIONS[template]), prompt, *(image_digest(i) for i in images)):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _unwrap(answer):
+    return answer.value if isinstance(answer, Uncached) else answer
+
+
+def cached_call(key: str, compute, use_cache: bool = True):
+    """
+    ``(answer, cached)`` for ``key``: the stored answer, or ``compute()`` stored
+    for next time. ``use_cache=False`` always computes and replaces the stored
+    answer. Only answers ``compute`` returns are kept, an exception or an
+    answer wrapped in ``Uncached`` is not.
+    """
+    computed = []
+
+    def run():
+        computed.append(True)
+        return compute()
+
+    if not llm_cache_enabled:
+        return _unwrap(run()), False
+    if not use_cache:
+        answer = run()
+        if not isinstance(answer, Uncached):
+            llm_results.set(key, answer)
+        return _unwrap(answer), False
+    answer = llm_results.get_or_compute(key, run)
+    return answer, not computed
+
+
+async def cached_acall(key: str, compute, use_cache: bool = True):
+    """
+    ``cached_call`` for a coroutine function ``compute``. Identical calls made
+    while one is running share its answer, cache or no cache.
+    """
+    computed = []
+
+    async def run():
+        computed.append(True)
+        answer, _ = await llm_flights.do(key, compute)
+        return answer
+
+    if not llm_cache_enabled:
+        return _unwrap(await run()), False
+    if not use_cache:
+        answer = await run()
+        if not isinstance(answer, Uncached):
+            await llm_results.aset(key, answer)
+        return _unwrap(answer), False
+    answer = await llm_results.aget_or_compute(key, run)
+    return answer, not computed
+
+
+llm_cache = Cache(DiskBackend(llm_cache_path, max_bytes=llm_cache_max_bytes), prefix="llm")
+
+llm_results = llm_cache.namespace("results", ttl=llm_cache_ttl)
+
+# one model call per request fingerprint at a time in this worker
+llm_flights = SingleFlight()
+
+
+def single_flight_snapshot() -> dict:
+    flights = llm_flights.snapshot()
+    # duplicates the results namespace coalesced before they reached llm_flights
+    coalesced = llm_results.snapshot()["coalesced"]
+    return {**flights, "cache_coalesced": coalesced, "saved_calls": flights["shared"] + coalesced}
@@ -0,0 +1,102 @@
+"""
+Photo normalization before any model sees an upload.
+
+Phone photos arrive at 12 MP or more, far beyond what Gemini or the local
+classifier look at. ``normalize_image`` asks the JPEG decoder for a reduced
+scale (draft mode decodes at 1/2, 1/4 or 1/8 size for a fraction of the
+work), turns the photo upright from its EXIF orientation, scales it down to
+``IMAGE_MAX_SIDE`` and re-encodes it as a JPEG of ``IMAGE_QUALITY``. The
+result is an ordinary PIL image that also carries those JPEG bytes, which
+``AI_ML.gemini`` sends as they are instead of re-encoding the pixels.
+
+PIL releases the GIL while decoding, resizing and encoding, so
+``normalize_images`` runs the photos in parallel on the thread pool.
+"""
+import asyncio
+import io
+import math
+import threading
+import time
+
+from PIL import Image, ImageOps
+from starlette.concurrency import run_in_threadpool #type: ignore
+from starlette.datastructures import UploadFile #type: ignore
+
+from helpers.config import image_max_side, image_quality
+
+_lock = threading.Lock()
+image_metrics = dict.fromkeys(("images", "bytes_in", "bytes_out"), 0)
+image_metrics["seconds"] = 0.0
+
+
+def jpeg_bytes(image: Image.Image) -> bytes | None:
+    """The encoded JPEG of a normalized image; None for any other image, including copies of one."""
+    return getattr(image, "normalized_jpeg", None)
+
+
+def _source(image):
+    """A readable file at its start for an upload, a path or a file object, and whether we opened it."""
+    if isinstance(image, UploadFile):
+        image = image.file
+    if hasattr(image, "read"):
+        image.seek(0)
+        return image, False
+    return open(image, "rb"), True
+
+
+def normalize_image(image, max_side: int | None = None, quality: int | None = None) -> Image.Image:
+    """
+    ``image`` (an upload, a path or a file object) decoded, upright, at most
+    ``max_side`` pixels on its longest side and re-encoded as a JPEG. Raises
+    ``UnidentifiedImageError`` when it isn't an image.
+    """
+    max_side = max_side or image_max_side
+    quality = quality or image_quality
+    start = time.perf_counter()
+    source, opened_here = _source(image)
+    try:
+        size_in = source.seek(0, io.SEEK_END)
+        source.seek(0)
+        opened = Image.open(source)
+        width, height = opened.size
+        longest = max(width, height)
+        if opened.format == "JPEG" and longest > max_side:
+            # the decoder skips detail we'd throw away, never going below the size asked for
+            opened.draft("RGB", (math.ceil(width * max_side / longest), math.ceil(height * max_side / longest)))
+        upright = ImageOps.exif_transpose(opened).convert("RGB")
+    finally:
+        if opened_here:
+            source.close()
+    upright.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    upright.save(buffer, format="JPEG", quality=quality, optimize=True)
+    encoded = buffer.getvalue()
+    normalized = Image.open(io.BytesIO(encoded))
+    normalized.load()
+    normalized.normalized_jpeg = encoded
+    with _lock:
+        image_metrics["images"] += 1
+        image_metrics["bytes_in"] += size_in
+        image_metrics["bytes_out"] += len(encoded)
+        image_metrics["seconds"] += time.perf_counter() - start
+    return normalized
+
+
+async def normalize_images(images: list, max_side: int | None = None, quality: int | None = None) -> list:
+    """``normalize_image`` for each of ``images`` on the thread pool, in order."""
+    return list(await asyncio.gather(*(run_in_threadpool(normalize_image, image, max_side, quality)
+                                       for image in images)))
+
+
+def image_snapshot() -> dict:
+    with _lock:
+        metrics = dict(image_metrics)
+    images = metrics["images"]
+    return {
+        "max_side": image_max_side,
+        "quality": image_quality,
+        **metrics,
+        "seconds": round(metrics["seconds"], 3),
+        "mean_ms_per_image": round(1000 * metrics["seconds"] / images, 2) if images else 0.0,
+        "reduction": round(metrics["bytes_in"] / metrics["bytes_out"], 1) if metrics["bytes_out"] else 0.0,
+    }
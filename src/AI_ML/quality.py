@@ -0,0 +1,164 @@
+"""
+Photo quality gate. Blurry, dark or tiny photos and the same photo uploaded
+for two sides only show up as a useless answer after a multi-second Gemini
+call; these checks find them in milliseconds, before any model call, and
+say how to retake the photo.
+
+Every photo is decoded at a reduced scale (JPEG draft mode) to grayscale at
+most ``ANALYSIS_SIDE`` pixels on its longest side. Then, with NumPy:
+
+- sharpness is the variance of the Laplacian, low when edges are smeared,
+- exposure comes from the luminance histogram: its mean and the share of
+  pixels crushed to black or blown out to white,
+- a 64-bit difference hash per photo finds near-duplicates across the angles.
+
+The resolution check uses the photo's real size.
+"""
+import asyncio
+import threading
+from itertools import combinations
+
+import numpy as np
+from PIL import ExifTags, Image, ImageOps, UnidentifiedImageError
+from starlette.concurrency import run_in_threadpool #type: ignore
+from starlette.datastructures import UploadFile #type: ignore
+
+from helpers.config import (quality_gate_enabled, quality_min_side, quality_min_sharpness, quality_min_brightness,
+                            quality_max_brightness, quality_max_clipped, quality_duplicate_distance)
+
+# sharpness is measured at this size so the threshold doesn't depend on the camera's resolution
+ANALYSIS_SIDE = 512
+
+CHECKS = ("unreadable", "resolution", "blur", "underexposed", "overexposed", "duplicate")
+
+_lock = threading.Lock()
+quality_metrics = {"photos": 0, "submissions": 0, "rejected": 0, "problems": dict.fromkeys(CHECKS, 0)}
+
+
+def laplacian_variance(gray: np.ndarray) -> float:
+    """Variance of the 4-neighbour Laplacian of a 2-D luminance array."""
+    gray = gray.astype(np.float32)
+    laplacian = (gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:]) - 4 * gray[1:-1, 1:-1]
+    return float(laplacian.var())
+
+
+def difference_hash(gray: Image.Image) -> int:
+    """64-bit hash of where brightness falls from left to right on a 9x8 thumbnail."""
+    pixels = np.asarray(gray.resize((9, 8), Image.Resampling.BOX), dtype=np.int16)
+    bits = (pixels[:, 1:] < pixels[:, :-1]).ravel()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def inspect_photo(image) -> dict:
+    """Size, sharpness, exposure and difference hash of an upload, a path or a file object."""
+    source = image.file if isinstance(image, UploadFile) else image
+    if hasattr(source, "seek"):
+        source.seek(0)
+    try:
+        with Image.open(source) as opened:
+            width, height = opened.size
+            if opened.getexif().get(ExifTags.Base.Orientation) in (5, 6, 7, 8):
+                width, height = height, width
+            # the decoder skips the detail we don't look at
+            opened.draft("L", (ANALYSIS_SIDE, ANALYSIS_SIDE))
+            gray = ImageOps.exif_transpose(opened).convert("L")
+    finally:
+        # the upload is read again to be saved or queued
+        if hasattr(source, "seek"):
+            source.seek(0)
+    gray.thumbnail((ANALYSIS_SIDE, ANALYSIS_SIDE), Image.Resampling.BILINEAR)
+    pixels = np.asarray(gray)
+    histogram = np.bincount(pixels.ravel(), minlength=256) / pixels.size
+    return {
+        "width": width,
+        "height": height,
+        "sharpness": laplacian_variance(pixels),
+        "brightness": float(histogram @ np.arange(256)),
+        "dark": float(histogram[:16].sum()),
+        "bright": float(histogram[240:].sum()),
+        "hash": difference_hash(gray),
+    }
+
+
+def _problem(check: str, photos: list[str], detail: str) -> dict:
+    return {"check": check, "photos": photos, "detail": detail}
+
+
+def photo_problems(name: str, stats: dict) -> list[dict]:
+    """What is wrong with one photo, with how to retake it."""
+    problems = []
+    if min(stats["width"], stats["height"]) < quality_min_side:
+        problems.append(_problem("resolution", [name],
+                                 f"The {name} photo is only {stats['width']}x{stats['height']} pixels. Upload one at "
+                                 f"least {quality_min_side} pixels on its shorter side, straight from the camera "
+                                 f"rather than a screenshot or a thumbnail."))
+    if stats["sharpness"] < quality_min_sharpness:
+        problems.append(_problem("blur", [name],
+                                 f"The {name} photo is blurry (sharpness {stats['sharpness']:.0f}, at least "
+                                 f"{quality_min_sharpness:g} needed). Hold the phone still, tap the vehicle to focus "
+                                 f"and retake it."))
+    if stats["brightness"] < quality_min_brightness or stats["dark"] > quality_max_clipped:
+        problems.append(_problem("underexposed", [name],
+                                 f"The {name} photo is too dark (mean brightness {stats['brightness']:.0f} of 255). "
+                                 f"Retake it in daylight or a well-lit place."))
+    elif stats["brightness"] > quality_max_brightness or stats["bright"] > quality_max_clipped:
+        problems.append(_problem("overexposed", [name],
+                                 f"The {name} photo is washed out (mean brightness {stats['brightness']:.0f} of 255). "
+                                 f"Avoid direct sunlight and flash glare on the paintwork and retake it."))
+    return problems
+
+
+def _inspect(image) -> dict | None:
+    try:
+        return inspect_photo(image)
+    # a decompression bomb or a corrupt header is as unusable as a file that isn't an image
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError):
+        return None
+
+
+def _problems(inspected: dict) -> list[dict]:
+    problems, hashes = [], {}
+    for name, stats in inspected.items():
+        if stats is None:
+            problems.append(_problem("unreadable", [name],
+                                     f"The {name} photo could not be read as an image. Upload a JPEG or PNG photo."))
+            continue
+        problems.extend(photo_problems(name, stats))
+        hashes[name] = stats["hash"]
+    for (first, first_hash), (second, second_hash) in combinations(hashes.items(), 2):
+        if (first_hash ^ second_hash).bit_count() <= quality_duplicate_distance:
+            problems.append(_problem("duplicate", [first, second],
+                                     f"The {first} and {second} photos look the same. Take each photo from its own "
+                                     f"side of the vehicle."))
+    _record(len(inspected), problems)
+    return problems
+
+
+def check_photos(photos: dict) -> list[dict]:
+    """Every problem with ``photos`` (name to upload, path or file object); empty when they are usable."""
+    return _problems({name: _inspect(image) for name, image in photos.items()})
+
+
+def _record(photos: int, problems: list[dict]):
+    with _lock:
+        quality_metrics["photos"] += photos
+        quality_metrics["submissions"] += 1
+        quality_metrics["rejected"] += bool(problems)
+        for problem in problems:
+            quality_metrics["problems"][problem["check"]] += 1
+
+
+async def photo_quality_problems(photos: dict) -> list[dict]:
+    """
+    ``check_photos`` with the photos decoded in parallel on the thread pool;
+    nothing to report while ``QUALITY_GATE_ENABLED`` is false.
+    """
+    if not quality_gate_enabled:
+        return []
+    stats = await asyncio.gather(*(run_in_threadpool(_inspect, image) for image in photos.values()))
+    return _problems(dict(zip(photos, stats)))
+
+
+def quality_snapshot() -> dict:
+    with _lock:
+        return {"enabled": quality_gate_enabled, **quality_metrics, "problems": dict(quality_metrics["problems"])}
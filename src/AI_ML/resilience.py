@@ -0,0 +1,162 @@
+"""
+Guards for calls to a remote model: retries with jittered backoff, a token
+bucket that keeps us under the provider's quota and a circuit breaker that
+stops calling a provider that keeps failing. All three are per worker.
+"""
+import asyncio
+import random
+import threading
+import time
+
+from google.api_core import exceptions as google_exceptions #type: ignore
+
+# worth another attempt: the provider was busy, slow or briefly unreachable
+TRANSIENT_ERRORS = (
+    TimeoutError,
+    ConnectionError,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.BadGateway,
+    google_exceptions.GatewayTimeout,
+)
+
+
+def is_transient(error: BaseException) -> bool:
+    return isinstance(error, TRANSIENT_ERRORS)
+
+
+class RateLimited(Exception):
+    """The token bucket would have made the call wait longer than allowed."""
+
+
+class TokenBucket:
+    """
+    ``rate`` calls per second on average with bursts of up to ``burst``.
+    Callers reserve a token and sleep until it is due, so waiting never holds
+    a lock or the event loop.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waits = 0
+        self.rejected = 0
+
+    def _reserve(self, max_wait: float) -> float | None:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if wait > max_wait:
+                self.rejected += 1
+                return None
+            # may go negative: the reservation is paid back by the refill the caller waits for
+            self._tokens -= 1
+            if wait:
+                self.waits += 1
+            return wait
+
+    async def acquire(self, max_wait: float = float("inf")):
+        """Wait for a token, or raise ``RateLimited`` if that would take more than ``max_wait`` seconds."""
+        wait = self._reserve(max_wait)
+        if wait is None:
+            raise RateLimited(f"rate limit of {self.rate * 60:g}/min reached")
+        if wait:
+            await asyncio.sleep(wait)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            tokens = min(self.burst, self._tokens + (time.monotonic() - self._updated) * self.rate)
+        return {"rate_per_min": self.rate * 60, "burst": self.burst, "tokens": round(tokens, 2),
+                "waits": self.waits, "rejected": self.rejected}
+
+
+class CircuitBreaker:
+    """
+    Opens after ``failure_threshold`` consecutive failures and refuses calls
+    for ``reset_timeout`` seconds. Then it lets a single probe through
+    (half-open): success closes it, failure opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.metrics = dict.fromkeys(("opened", "refused", "successes", "failures"), 0)
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.metrics["refused"] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.metrics["successes"] += 1
+            self._failures = 0
+            self._probing = False
+            self.state = self.CLOSED
+
+    def release(self):
+        """The allowed call ended without saying anything about the provider's health."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.metrics["failures"] += 1
+            self._failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.metrics["opened"] += 1
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            retry_in = (max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+                        if self.state == self.OPEN else 0.0)
+            return {"state": self.state, "consecutive_failures": self._failures,
+                    "retry_in_s": round(retry_in, 1), **self.metrics}
+
+
+def backoff(attempt: int, base: float, cap: float) -> float:
+    """Full jitter: uniform in [0, min(cap, base * 2**attempt)], so retrying workers spread out."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+async def call_with_retries(call, retries: int, base: float, cap: float, on_retry=None):
+    """
+    Await ``call()`` and retry it up to ``retries`` more times while it fails
+    with a transient error, sleeping a jittered backoff in between.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return await call()
+        except Exception as e:
+            if attempt == retries or not is_transient(e):
+                raise
+            if on_retry is not None:
+                on_retry(e)
+            await asyncio.sleep(backoff(attempt, base, cap))
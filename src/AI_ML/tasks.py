@@ -0,0 +1,73 @@
+"""
+Job handlers for the model calls and document conversions the API queues
+(see ``helpers.jobs``). Each one gets the job payload, with the uploaded
+files as spool paths under ``files``, and returns what the synchronous
+endpoint used to answer.
+"""
+from contextlib import contextmanager
+from json import JSONDecodeError
+
+from PIL import Image, UnidentifiedImageError
+from pydantic import ValidationError
+
+from AI_ML.agents import verify_vehicle_images, LLMUnavailable
+from AI_ML.assessor import assess_claim
+from AI_ML.preprocess import normalize_images
+from helpers.file_handlers import Transform
+from helpers.jobs import JobError, handler
+
+EXTRACT_VEHICLE_DETAILS = "llm.extract_vehicle_details"
+CLAIM_VALIDATION = "llm.claim_validation"
+DOCUMENT_TEXT = "documents.file_to_text"
+
+
+@contextmanager
+def job_errors():
+    try:
+        yield
+    except LLMUnavailable as e:
+        raise JobError(str(e), status_code=503, retryable=True)
+    except (JSONDecodeError, KeyError):
+        # a fresh call may well be readable, the unreadable one wasn't cached
+        raise JobError("The model's answer could not be read", status_code=502, retryable=True)
+    except ValidationError as e:
+        raise JobError(f"The model's answer does not match the report format: {e.error_count()} errors",
+                       status_code=502, retryable=True)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        # not an image, a decompression bomb, or a truncated or corrupt file: retrying won't help
+        raise JobError(f"Not a readable image: {e}", status_code=422)
+    except ValueError as e:
+        raise JobError(str(e), status_code=422)
+
+
+@handler(EXTRACT_VEHICLE_DETAILS)
+async def extract_vehicle_details(payload: dict) -> dict:
+    with job_errors():
+        valid, details, cached = await verify_vehicle_images(
+            *payload["files"], payload["make"], payload["model"], payload["type"], payload["year"],
+            payload.get("use_cache", True)
+        )
+    return {"valid": valid, "details": details, "cached": cached}
+
+
+@handler(CLAIM_VALIDATION)
+async def claim_validation(payload: dict) -> dict:
+    with job_errors():
+        images = await normalize_images(payload["files"])
+        # the local tier settles clear minor claims, the rest go to Gemini
+        return await assess_claim(payload["damage_description"], payload["requested_amount"],
+                                  payload["claimable_amount"], images, payload.get("use_cache", True))
+
+
+@handler(DOCUMENT_TEXT)
+def document_text(payload: dict) -> dict:
+    # OCR and PDF parsing are CPU bound, the worker runs sync handlers in its thread pool
+    path = payload["files"][0]
+    try:
+        content = Transform().file_to_text(path)
+    except ValueError as e:
+        raise JobError(str(e), status_code=422)
+    if isinstance(content, list):
+        details, attachments = content
+        return {"filename": payload.get("filename"), "message": details, "attachments": attachments}
+    return {"filename": payload.get("filename"), "text": content}
@@ -1,11 +1,17 @@
 from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncAttrs, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 from fastapi import Depends #type: ignore
 from typing import Annotated
 from sqlalchemy.orm import Session
 import urllib.parse
 # import database.model as model
-from helpers.config import SQLALCHEMY_DATABASE_URL_LITE, SQLALCHEMY_DATABASE_URL_MASTER as master_str, SQLALCHEMY_DATABASE_URL_POLICY as policy_str, Cloud_db
+from database.pool import InstrumentedQueuePool, InstrumentedAsyncAdaptedQueuePool
+from helpers.config import SQLALCHEMY_DATABASE_URL_LITE, SQLALCHEMY_DATABASE_URL_MASTER as master_str, SQLALCHEMY_DATABASE_URL_POLICY as policy_str, Cloud_db, Cloud_db_async
+from helpers.config import db_pool_size, db_max_overflow, db_pool_pre_ping, db_pool_recycle, db_pool_timeout, db_echo
+from helpers.config import db_slow_query_ms, db_slow_query_log, db_slow_query_log_bytes, db_slow_query_log_backups
+from database.slow_query import SlowQueryLog
 
 # --- Step 1: Connect to master to create 'policy' DB if missing ---
 
@@ -30,19 +36,65 @@ from helpers.config import SQLALCHEMY_DATABASE_URL_LITE, SQLALCHEMY_DATABASE_URL
 
 # policy_url = f"mssql+pyodbc:///?odbc_connect={urllib.parse.quote_plus(policy_str)}"
 
+# "debug" also logs result rows, anything else but "true" keeps SQL out of stdout
+ECHO_LEVELS = {"false": False, "true": True, "info": True, "debug": "debug"}
+
+pool_settings = {
+    "pool_size": db_pool_size,
+    "max_overflow": db_max_overflow,
+    "pool_pre_ping": db_pool_pre_ping,
+    "pool_recycle": db_pool_recycle,
+    "pool_timeout": db_pool_timeout,
+    "echo": ECHO_LEVELS.get(db_echo, False),
+}
+
 engine = create_engine(
-    Cloud_db,
-    echo=True
+    Cloud_db, #type: ignore
+    poolclass=InstrumentedQueuePool,
+    **pool_settings
 )
 # engine = create_engine(
 #     SQLALCHEMY_DATABASE_URL_LITE,
 #     connect_args={"check_same_thread": False}
 # )
 
+# asyncio drivers used when no explicit async URL is configured
+ASYNC_DRIVERS = {
+    "postgresql": "asyncpg",
+    "mssql": "aioodbc",
+    "mysql": "aiomysql",
+    "sqlite": "aiosqlite",
+}
+
+def async_url(url: str) -> str:
+    """Return ``url`` with its DBAPI driver swapped for the asyncio equivalent."""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No asyncio driver known for '{backend}', set cloud_db_async explicitly")
+    return parsed.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(hide_password=False)
+
+async_engine = create_async_engine(
+    Cloud_db_async or async_url(Cloud_db), #type: ignore
+    poolclass=InstrumentedAsyncAdaptedQueuePool,
+    **pool_settings
+)
+
+# slow statements with their plans, in place of echoing every statement
+slow_query_log = None
+if db_slow_query_ms >= 0:
+    slow_query_log = SlowQueryLog(db_slow_query_log, db_slow_query_ms,
+                                  max_bytes=db_slow_query_log_bytes, backups=db_slow_query_log_backups)
+    slow_query_log.attach(engine)
+    slow_query_log.attach_async(async_engine)
+
 # --- Step 3: Create session and Base ---
+# sync sessions are kept for init_admin and scripts, the routers use the async ones
 sessionlocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-class Base(DeclarativeBase):
+async_sessionlocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+class Base(AsyncAttrs, DeclarativeBase):
     pass
        
 # --- Step 4: FastAPI dependency ---
@@ -54,3 +106,9 @@ def get_db():
         db.close()
 
 db_dependency = Annotated[Session, Depends(get_db)]
+
+async def get_async_db():
+    async with async_sessionlocal() as db:
+        yield db
+
+async_db_dependency = Annotated[AsyncSession, Depends(get_async_db)]
@@ -1,8 +1,15 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Dict
 from database.database import Base
-from sqlalchemy import ARRAY, JSON, Column, Integer, String, Date, ForeignKey, Float, CheckConstraint, DateTime
-from sqlalchemy.orm import relationship
+from sqlalchemy import ARRAY, JSON, Column, Integer, String, Date, ForeignKey, Float, CheckConstraint, DateTime, Index, func
+from sqlalchemy.orm import relationship, Session, deferred, object_session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.exc import IntegrityError
+
+
+def utcnow() -> datetime:
+    # naive UTC, which is what DateTime columns hold on every backend
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 
 class User(Base):
@@ -21,6 +28,11 @@ class User(Base):
     profile_pic = Column(String(255), nullable=True)
     status = Column(String(20), nullable=False, default='active')
     address = Column(String(400), nullable=True)
+    # bumped on every UPDATE by bump_version, response ETags are derived from it
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    # set on every INSERT and UPDATE, the availability filters sync changed users by it
+    updated_at = Column(DateTime, nullable=False, default=utcnow, onupdate=utcnow,
+                        server_default=func.current_timestamp(), index=True)
 
     policies = relationship("Policy", back_populates="user")
 
@@ -34,7 +46,58 @@ class User(Base):
             return self.dateofbirth.strftime("%Y-%m-%d")
         return None
 
-from sqlalchemy import event, select, func
+from sqlalchemy import event, select, func, update, insert, inspect
+
+
+class NumberSequence(Base):
+    """Per-day counters behind policy and claim numbers, one row per prefix and day (e.g. ``POL-20250101``)."""
+    __tablename__ = "number_sequences"
+
+    name = Column(String(30), primary_key=True)
+    last_value = Column(Integer, nullable=False, default=0)
+
+
+def _highest_issued(connection, column, prefix: str) -> int:
+    # only runs when a day's counter row is first created, so numbers issued
+    # before the counter existed (or by older app versions) are never reused
+    issued = connection.execute(select(column).where(column.like(f"{prefix}%"))).scalars()
+    suffixes = (number[len(prefix):] for number in issued)
+    return max((int(suffix) for suffix in suffixes if suffix.isdigit()), default=0)
+
+
+def reserve_numbers(connection, column, prefix: str, count: int = 1) -> int:
+    """
+    Atomically reserve ``count`` consecutive numbers for ``prefix`` and return the first one.
+
+    The counter row is incremented in the caller's transaction, so concurrent
+    writers queue on its row lock instead of racing a COUNT(*), and a rolled
+    back transaction hands its block back.
+    """
+    bump = (
+        update(NumberSequence)
+        .where(NumberSequence.name == prefix)
+        .values(last_value=NumberSequence.last_value + count)
+    )
+    current = select(NumberSequence.last_value).where(NumberSequence.name == prefix)
+
+    def increment():
+        if connection.dialect.update_returning:
+            return connection.execute(bump.returning(NumberSequence.last_value)).scalar()
+        if connection.execute(bump).rowcount:
+            return connection.execute(current).scalar()
+        return None
+
+    last = increment()
+    if last is None:
+        start = _highest_issued(connection, column, prefix)
+        try:
+            with connection.begin_nested():
+                connection.execute(insert(NumberSequence).values(name=prefix, last_value=start + count))
+            last = start + count
+        except IntegrityError:
+            # another transaction created today's row first
+            last = increment()
+    return last - count + 1
 
 
 
@@ -44,12 +107,16 @@ class Policy(Base):
     policy_id = Column(Integer, primary_key=True, autoincrement=True)
     policy_number = Column(String(50), unique=True, nullable=False)
     # policy_holder = Column(String, nullable=False)
+    # denormalized "first middle last" of the owning user, kept in sync by the listeners below
+    holder_name = Column(String(152), nullable=True)
     user_id = Column(Integer, ForeignKey("users.user_id", ondelete="CASCADE"))
     start_date = Column(Date, nullable=False)
     end_date = Column(Date, nullable=False)
     premium = Column(Float, nullable=False)
     coverage_amount = Column(Float, nullable=False)
-    status = Column(String(20), nullable=False, default = 'under-review')
+    status = Column(String(20), nullable=False, default = 'under-review', index=True)
+    # bumped on every UPDATE by bump_version, response ETags are derived from it
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     user = relationship("User", back_populates="policies")
     insurables = relationship("Insurable", back_populates="policy", cascade="all, delete")
@@ -61,39 +128,72 @@ class Policy(Base):
 
     __table_args__ = (
         CheckConstraint("status IN ('active', 'inactive', 'expired', 'under-review')", name="policy_status_check"),
+        # also serves plain user_id lookups
+        Index("ix_policies_user_id_status", "user_id", "status"),
     )
     @property
     def policy_holder(self):
-        # Safely handle missing middle name
-        parts = [self.user.firstname, self.user.middlename, self.user.lastname]
-        return " ".join(filter(None, parts))
+        # the stored copy saves loading User for every policy in a listing
+        if self.holder_name is not None:
+            return self.holder_name
+        if self.user is None:
+            return ""
+        return full_name(self.user.firstname, self.user.middlename, self.user.lastname)
 
-@event.listens_for(Policy, "before_insert")
-def generate_policy_number(mapper, connection, target):
-    today_str = datetime.now().strftime("%Y%m%d")
 
-    # Count policies created today efficiently
-    result = connection.execute(
-        select(func.count()).where(Policy.policy_number.like(f"POL-{today_str}%"))
+def full_name(firstname, middlename, lastname) -> str:
+    # Safely handle missing middle name
+    return " ".join(filter(None, [firstname, middlename, lastname]))
+
+
+@event.listens_for(Policy, "before_insert")
+@event.listens_for(Policy, "before_update")
+def sync_holder_name(mapper, connection, target):
+    if target.holder_name is not None and not inspect(target).attrs.user_id.history.has_changes():
+        return
+    if target.user_id is None:
+        target.holder_name = None
+        return
+    names = connection.execute(
+        select(User.firstname, User.middlename, User.lastname).where(User.user_id == target.user_id)
+    ).first()
+    # "" rather than None for a dangling user_id, so policy_holder never falls back to a lazy load
+    target.holder_name = full_name(*names) if names else ""
+
+
+@event.listens_for(User, "after_update")
+def propagate_holder_name(mapper, connection, target):
+    state = inspect(target)
+    if not any(state.attrs[name].history.has_changes() for name in ("firstname", "middlename", "lastname")):
+        return
+    connection.execute(
+        update(Policy)
+        .where(Policy.user_id == target.user_id)
+        .values(holder_name=full_name(target.firstname, target.middlename, target.lastname), version=Policy.version + 1)
     )
-    count_today = result.scalar_one()
 
-    target.policy_number = f"POL-{today_str}{count_today + 1:03d}"
+@event.listens_for(Policy, "before_insert")
+def generate_policy_number(mapper, connection, target):
+    # normally assigned in bulk by assign_document_numbers, this covers inserts that skip the flush hook
+    if target.policy_number:
+        return
+    prefix = f"POL-{datetime.now().strftime('%Y%m%d')}"
+    target.policy_number = f"{prefix}{reserve_numbers(connection, Policy.policy_number, prefix):03d}"
 
 class Insurable(Base):
     __tablename__ = "insurable"
     id = Column(Integer, primary_key=True, autoincrement=True)
     type = Column(String(20), nullable=False)  # e.g., 'vehicle', 'health', 'property'
-    policy_id = Column(Integer, ForeignKey("policies.policy_id", ondelete="CASCADE"), nullable=False)
-
-    
+    policy_id = Column(Integer, ForeignKey("policies.policy_id", ondelete="CASCADE"), nullable=False, index=True)
+    # bumped on every UPDATE by bump_version, response ETags are derived from it
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     policy = relationship("Policy", back_populates="insurables")
     claims = relationship("Claims", back_populates="subject")
 
     __mapper_args__ = {
         "polymorphic_identity": "insurable",
-        "polymorphic_on": type
+        "polymorphic_on": type,
     }
 
 class Vehicle(Insurable):
@@ -105,8 +205,8 @@ class Vehicle(Insurable):
     model = Column(String(50), nullable=False)
     year_of_purchase = Column(Integer, nullable=False)
     vin = Column(String(100), nullable=False, unique=True)
-    image_path = Column(String(500), nullable=True)  # Changed to JSON type
-    vehicle_no = Column(String(100), nullable=False)
+    image_path = Column(JSON, nullable=True)  # {"main_folder": ..., "front": ..., ...}
+    vehicle_no = Column(String(100), nullable=False, index=True)
     damage_report = Column(String(3000))
 
     __mapper_args__ = {
@@ -119,25 +219,28 @@ class Claims(Base):
     __tablename__ = "claims"
 
     claim_id = Column(Integer, primary_key=True, autoincrement=True)
-    policy_id = Column(Integer, ForeignKey("policies.policy_id"), nullable=False)
-    subject_id = Column(Integer, ForeignKey("insurable.id"), nullable=False)
+    policy_id = Column(Integer, ForeignKey("policies.policy_id"), nullable=False, index=True)
+    subject_id = Column(Integer, ForeignKey("insurable.id"), nullable=False, index=True)
     claim_number = Column(String(50), unique=True, nullable=False)
-    damage_description_user = Column(String(3000), nullable=False)
-    damage_description_llm = Column(String(3000), nullable=False)
+    # the long free-text columns are only loaded with undefer_group("claim_text"), list views skip them
+    damage_description_user = deferred(Column(String(3000), nullable=False), group="claim_text")
+    damage_description_llm = deferred(Column(String(3000), nullable=False), group="claim_text")
     severity_level = Column(String(20), nullable=False)
     damage_percentage = Column(Float, nullable=False)
-    damage_image_path = Column(String(500), nullable=False)
+    damage_image_path = Column(JSON, nullable=False)
     date_of_incident = Column(Date, nullable=False)
     location_of_incident = Column(String(100), nullable=False)
-    documents_path = Column(String(1000))
+    documents_path = Column(JSON)
     fir_no = Column(String(100), nullable=True) 
     claim_date = Column(Date, nullable=True)
-    remarks = Column(String(3000),nullable=True)
-    approvable_reason = Column(String(3000), nullable=True)
+    remarks = deferred(Column(String(3000),nullable=True), group="claim_text")
+    approvable_reason = deferred(Column(String(3000), nullable=True), group="claim_text")
     requested_amount = Column(Float, nullable=False)
     approvable_amount = Column(Float, nullable=True)
     approved_amount = Column(Float, nullable=True)
     claim_status = Column(String(20), nullable=False,default='in-review')
+    # bumped on every UPDATE by bump_version, response ETags are derived from it
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     policy = relationship("Policy", back_populates="claims")
     subject = relationship("Insurable", back_populates="claims")
@@ -145,17 +248,89 @@ class Claims(Base):
     __table_args__ = (
         CheckConstraint("claim_status IN ('in-review', 'accepted', 'rejected')", name="claim_status_check"),
         CheckConstraint("severity_level IN ('Low', 'Moderate', 'High', 'Critical')", name="severity_level_check"),
+        # first page of claims in a given status, in claim_id order
+        Index("ix_claims_claim_status_claim_id", "claim_status", "claim_id"),
     )
+
+
 @event.listens_for(Claims, "before_insert")
 def generate_claim_number(mapper, connection, target):
-    today_str = datetime.now().strftime("%Y%m%d")
+    # normally assigned in bulk by assign_document_numbers, this covers inserts that skip the flush hook
+    if target.claim_number:
+        return
+    prefix = f"CLAIM-{datetime.now().strftime('%Y%m%d')}"
+    target.claim_number = f"{prefix}{reserve_numbers(connection, Claims.claim_number, prefix):03d}"
 
-    # Count claims created today efficiently
-    result = connection.execute(
-        select(func.count()).where(Claims.claim_number.like(f"CLAIM-{today_str}%"))
-    )
-    count_today = result.scalar_one()
 
-    target.claim_number = f"CLAIM-{today_str}{count_today + 1:03d}"
+def bump_version(mapper, connection, target):
+    # in SQL, so concurrent writers never hand out the same version; not a version_id_col, which
+    # would also turn on optimistic locking and fail the second of two overlapping writes
+    if object_session(target).is_modified(target, include_collections=False):
+        target.version = mapper.class_.version + 1
 
 
+def load_version(mapper, connection, target):
+    # the UPDATE leaves the SQL expression's result unloaded, and async sessions can't lazy-load it later
+    state = inspect(target)
+    if "version" in state.expired_attributes:
+        key = [column == value for column, value in zip(mapper.primary_key, state.identity)]
+        set_committed_value(target, "version", connection.scalar(select(mapper.class_.version).where(*key)))
+
+
+for versioned in (User, Policy, Insurable, Claims):
+    # propagate: a vehicle-only change bumps the version on the insurable table too
+    event.listen(versioned, "before_update", bump_version, propagate=True)
+    event.listen(versioned, "after_update", load_version, propagate=True)
+
+
+@event.listens_for(Session, "before_flush")
+def assign_document_numbers(session, flush_context, instances):
+    """Number every pending policy and claim of a flush with one counter update per type."""
+    today_str = datetime.now().strftime("%Y%m%d")
+    for model, column, prefix in (
+        (Policy, "policy_number", f"POL-{today_str}"),
+        (Claims, "claim_number", f"CLAIM-{today_str}"),
+    ):
+        pending = [obj for obj in session.new if isinstance(obj, model) and not getattr(obj, column)]
+        if not pending:
+            continue
+        first = reserve_numbers(session.connection(), getattr(model, column), prefix, len(pending))
+        for offset, obj in enumerate(pending):
+            setattr(obj, column, f"{prefix}{first + offset:03d}")
+
+
+
+
+class Job(Base):
+    """
+    Background work (LLM calls, document text extraction) queued by the API
+    and run by ``helpers.jobs.JobWorker``. A worker leases a job until
+    ``lease_expires_at`` and keeps extending it while the job runs; a job whose
+    lease ran out belongs to a worker that died and is picked up again.
+    """
+    __tablename__ = "jobs"
+
+    # random, the LLM endpoints have no login so the id is what guards the result
+    job_id = Column(String(32), primary_key=True)
+    kind = Column(String(50), nullable=False)
+    status = Column(String(20), nullable=False, default="queued")
+    payload = Column(JSON, nullable=False)
+    result = Column(JSON, nullable=True)
+    error = Column(String(3000), nullable=True)
+    # HTTP status the failure would have had as a direct response
+    error_status = Column(Integer, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    # not leased before this, pushed back between attempts
+    run_after = Column(DateTime, nullable=False)
+    lease_expires_at = Column(DateTime, nullable=True)
+    worker_id = Column(String(100), nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        CheckConstraint("status IN ('queued', 'running', 'succeeded', 'failed')", name="job_status_check"),
+        # the worker's claim query: due queued jobs and expired leases
+        Index("ix_jobs_status_run_after", "status", "run_after"),
+    )
@@ -0,0 +1,95 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+QUERY_COUNT_HEADER = "X-DB-Queries"
+
+_current: ContextVar["RequestQueryStats | None"] = ContextVar("request_query_stats", default=None)
+
+# "IN (?, ?, ?)" and multi-row VALUES differ only in arity, count them as one shape
+_PLACEHOLDER_RUN = re.compile(r"(\?|%s|%\(\w+\)s|:\w+)(\s*,\s*(\?|%s|%\(\w+\)s|:\w+))+")
+
+
+def statement_shape(statement: str) -> str:
+    return _PLACEHOLDER_RUN.sub("?, ...", " ".join(statement.split()))
+
+
+class RequestQueryStats:
+    """Statements run and time spent in the database while serving one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def record(self, statement: str, duration: float):
+        self.count += 1
+        self.duration += duration
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated(self, threshold: int) -> list:
+        return [(shape, n) for shape, n in self.shapes.most_common() if n > threshold]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _current.get() is not None:
+        context._query_stats_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    start = getattr(context, "_query_stats_start", None)
+    if stats is not None and start is not None:
+        stats.record(statement, time.perf_counter() - start)
+
+
+def install(*engines):
+    """Listen on the given sync engines (pass ``async_engine.sync_engine`` for an async one)."""
+    for engine in engines:
+        if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+            event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class QueryStatsMiddleware:
+    """
+    Counts the SQL statements each HTTP request runs and reports them in the
+    Server-Timing and X-DB-Queries response headers. Logs a warning when one
+    statement shape runs more than ``n_plus_one_threshold`` times, the usual
+    sign of a lazy load inside a loop. Only added to the app when enabled, so
+    it costs nothing when off.
+    """
+
+    def __init__(self, app, n_plus_one_threshold: int = 10):
+        self.app = app
+        self.n_plus_one_threshold = n_plus_one_threshold
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestQueryStats()
+        token = _current.set(stats)
+
+        async def send_with_stats(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} queries"'.encode()))
+                headers.append((QUERY_COUNT_HEADER.lower().encode(), str(stats.count).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            _current.reset(token)
+            for shape, n in stats.repeated(self.n_plus_one_threshold):
+                logger.warning("Possible N+1: %s %s ran the same statement %d times: %s",
+                               scope.get("method"), scope.get("path"), n, shape)
@@ -0,0 +1,40 @@
+from pathlib import Path
+
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+
+ALEMBIC_INI = Path(__file__).resolve().parent.parent / "alembic.ini"
+
+
+def alembic_config() -> Config:
+    config = Config(str(ALEMBIC_INI))
+    # leave the application's logging setup alone when migrating from code
+    config.attributes["configure_logger"] = False
+    return config
+
+
+def head_revision() -> str | None:
+    """Latest revision shipped in migrations/versions."""
+    return ScriptDirectory.from_config(alembic_config()).get_current_head()
+
+
+def current_revision(engine) -> str | None:
+    """Revision recorded in the database's alembic_version table."""
+    with engine.connect() as conn:
+        return MigrationContext.configure(conn).get_current_revision()
+
+
+def check_schema_version(engine):
+    """
+    Refuse to start against a database that is behind (or ahead of) the code.
+
+    Only reads alembic_version, no table reflection or DDL.
+    """
+    current, head = current_revision(engine), head_revision()
+    if current != head:
+        raise RuntimeError(
+            f"Database schema is at revision {current}, this build expects {head}. "
+            "Run `alembic upgrade head` from src/ (use `alembic stamp 0001` first on "
+            "databases created before migrations existed)."
+        )
@@ -0,0 +1,283 @@
+"""
+Slow-query log.
+
+Statements slower than a threshold are written as JSON lines to a rotating
+log, one entry per execution, with the statement fingerprint, the shapes of
+its bound parameters, the route that issued it and its EXPLAIN plan. Plans
+are captured off the request path: on a worker thread for the sync engine,
+as a background task for the async one, and at most once a minute per
+fingerprint.
+
+Aggregate a log by fingerprint with::
+
+    python -m database.slow_query logs/slow_queries.jsonl --top 20
+"""
+import argparse
+import asyncio
+import atexit
+import hashlib
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from pathlib import Path
+
+from sqlalchemy import event
+
+from database.query_stats import statement_shape
+
+_scope: ContextVar["dict | None"] = ContextVar("slow_query_scope", default=None)
+
+EXPLAIN_PREFIXES = {
+    "sqlite": "EXPLAIN QUERY PLAN ",
+    "postgresql": "EXPLAIN ",
+    "mysql": "EXPLAIN ",
+    "mariadb": "EXPLAIN ",
+}
+
+EXPLAINABLE = ("select", "with", "insert", "update", "delete")
+
+PLAN_TTL = 60.0  # seconds a captured plan is reused for the same fingerprint
+
+# literals an ORM statement rarely has, but text() and hand-written SQL do
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(\.\d+)?\b")
+
+
+def normalize(statement: str) -> str:
+    """The statement with literals replaced by ``?`` and placeholder lists collapsed."""
+    statement = _NUMBER_LITERAL.sub("?", _STRING_LITERAL.sub("?", statement))
+    return statement_shape(statement)
+
+
+def fingerprint(normalized: str) -> str:
+    return hashlib.sha1(normalized.encode()).hexdigest()[:12]
+
+
+def parameter_shape(parameters):
+    """Type names of the bound values, never the values themselves."""
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+def _route(scope) -> str | None:
+    if scope is None:
+        return None
+    route = scope.get("route")
+    path = getattr(route, "path", None) or scope.get("path")
+    return f"{scope.get('method')} {path}"
+
+
+class SlowQueryLog:
+    """Engine listeners that record statements slower than ``threshold_ms``."""
+
+    def __init__(self, path, threshold_ms: float, max_bytes: int = 10_000_000, backups: int = 5):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.threshold = threshold_ms / 1000
+        self._plans: dict[str, tuple[float, object]] = {}
+        self._plans_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query-explain")
+        self._tasks: set = set()
+        self._closed = False
+
+        # the request thread only enqueues, the file is written and rotated by the listener thread.
+        # records skip the logger hierarchy so logging config can't silence the log
+        self._records: queue.SimpleQueue = queue.SimpleQueue()
+        handler = logging.handlers.RotatingFileHandler(self.path, maxBytes=max_bytes, backupCount=backups,
+                                                       encoding="utf-8")
+        self._listener = logging.handlers.QueueListener(self._records, handler)
+        self._listener.start()
+        atexit.register(self.close)
+
+    def attach(self, engine):
+        """Log slow statements of a sync engine, EXPLAINing them on a worker thread."""
+        self._listen(engine, explain=lambda entry, statement, parameters:
+                     self._executor.submit(self._explain_sync, engine, entry, statement, parameters))
+
+    def attach_async(self, async_engine):
+        """Log slow statements of an AsyncEngine, EXPLAINing them in a background task."""
+        def explain(entry, statement, parameters):
+            task = asyncio.get_running_loop().create_task(
+                self._explain_async(async_engine, entry, statement, parameters))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        self._listen(async_engine.sync_engine, explain)
+
+    def _listen(self, engine, explain):
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if context is not None:
+                context._slow_query_start = time.perf_counter()
+
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            start = getattr(context, "_slow_query_start", None)
+            if start is None:
+                return
+            duration = time.perf_counter() - start
+            if duration < self.threshold or not context.execution_options.get("slow_query_log", True):
+                return
+            normalized = normalize(statement)
+            entry = {
+                "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+                "fingerprint": fingerprint(normalized),
+                "sql": normalized,
+                "params": parameter_shape(parameters[0] if executemany and parameters else parameters),
+                "executemany": len(parameters) if executemany else None,
+                "duration_ms": round(duration * 1000, 3),
+                "route": _route(_scope.get()),
+                "dialect": engine.dialect.name,
+                "plan": None,
+            }
+            if self._cached_plan(entry) or not self._explainable(engine, statement):
+                self._write(entry)
+            else:
+                explain(entry, statement, parameters[0] if executemany else parameters)
+
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+    @staticmethod
+    def _explainable(engine, statement) -> bool:
+        return engine.dialect.name in EXPLAIN_PREFIXES and statement.lstrip().lower().startswith(EXPLAINABLE)
+
+    def _cached_plan(self, entry) -> bool:
+        with self._plans_lock:
+            cached = self._plans.get(entry["fingerprint"])
+        if cached is not None and time.monotonic() - cached[0] < PLAN_TTL:
+            entry["plan"] = cached[1]
+            return True
+        return False
+
+    def _store_plan(self, entry, rows):
+        entry["plan"] = [list(row) for row in rows]
+        with self._plans_lock:
+            self._plans[entry["fingerprint"]] = (time.monotonic(), entry["plan"])
+
+    def _explain_sync(self, engine, entry, statement, parameters):
+        try:
+            with engine.connect() as conn:
+                conn = conn.execution_options(slow_query_log=False)
+                self._store_plan(entry, conn.exec_driver_sql(EXPLAIN_PREFIXES[engine.dialect.name] + statement,
+                                                             parameters).all())
+        except Exception as e:
+            entry["plan"] = {"error": str(e)}
+        self._write(entry)
+
+    async def _explain_async(self, async_engine, entry, statement, parameters):
+        try:
+            async with async_engine.connect() as conn:
+                conn = await conn.execution_options(slow_query_log=False)
+                result = await conn.exec_driver_sql(EXPLAIN_PREFIXES[async_engine.dialect.name] + statement,
+                                                    parameters)
+                self._store_plan(entry, result.all())
+        except Exception as e:
+            entry["plan"] = {"error": str(e)}
+        self._write(entry)
+
+    def _write(self, entry):
+        self._records.put(logging.makeLogRecord({"msg": json.dumps(entry, default=str), "levelno": logging.INFO}))
+
+    def close(self):
+        """Finish pending EXPLAINs and flush the log."""
+        if self._closed:
+            return
+        self._closed = True
+        self._executor.shutdown(wait=True)
+        self._listener.stop()
+        for handler in self._listener.handlers:
+            handler.close()
+
+
+class RequestScopeMiddleware:
+    """Makes the current request visible to the slow-query log so entries carry their route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = _scope.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _scope.reset(token)
+
+
+def read_entries(path):
+    """Entries from ``path`` and its rotated backups, oldest file first."""
+    path = Path(path)
+    files = sorted(path.parent.glob(path.name + ".*"), key=lambda p: -int(p.suffix[1:]) if p.suffix[1:].isdigit() else 0)
+    for file in [*files, path]:
+        if not file.exists():
+            continue
+        with open(file, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def aggregate(entries) -> list:
+    """Group entries by fingerprint with count, total/mean/p95/max duration, routes and the latest plan."""
+    groups: dict[str, dict] = {}
+    for entry in entries:
+        group = groups.setdefault(entry["fingerprint"], {
+            "fingerprint": entry["fingerprint"], "sql": entry["sql"], "durations": [], "routes": set(), "plan": None,
+        })
+        group["durations"].append(entry["duration_ms"])
+        if entry.get("route"):
+            group["routes"].add(entry["route"])
+        if entry.get("plan") is not None:
+            group["plan"] = entry["plan"]
+
+    summary = []
+    for group in groups.values():
+        durations = sorted(group.pop("durations"))
+        summary.append({
+            **group,
+            "count": len(durations),
+            "total_ms": round(sum(durations), 3),
+            "mean_ms": round(sum(durations) / len(durations), 3),
+            "p95_ms": durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+            "max_ms": durations[-1],
+            "routes": sorted(group["routes"]),
+        })
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m database.slow_query",
+                                     description="Summarise a slow-query log by statement fingerprint.")
+    parser.add_argument("log", help="path to the JSONL log, rotated backups next to it are included")
+    parser.add_argument("--top", type=int, default=20, help="number of fingerprints to show")
+    parser.add_argument("--sort", choices=["total_ms", "count", "mean_ms", "p95_ms", "max_ms"], default="total_ms")
+    parser.add_argument("--plans", action="store_true", help="print the latest EXPLAIN plan of each fingerprint")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args(argv)
+
+    summary = sorted(aggregate(read_entries(args.log)), key=lambda g: g[args.sort], reverse=True)[:args.top]
+    if args.json:
+        print(json.dumps(summary, indent=2, default=str))
+        return
+    print(f"{'fingerprint':<12} {'count':>7} {'total ms':>11} {'mean ms':>9} {'p95 ms':>9} {'max ms':>9}  sql")
+    for group in summary:
+        print(f"{group['fingerprint']:<12} {group['count']:>7} {group['total_ms']:>11.1f} {group['mean_ms']:>9.1f} "
+              f"{group['p95_ms']:>9.1f} {group['max_ms']:>9.1f}  {group['sql'][:120]}")
+        if group["routes"]:
+            print(f"{'':<12} routes: {', '.join(group['routes'])}")
+        if args.plans and group["plan"] is not None:
+            print(f"{'':<12} plan: {json.dumps(group['plan'], default=str)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import asyncio
+import time
+from datetime import timedelta
+from itertools import chain
+
+from sqlalchemy import event, exists, inspect, select
+from sqlalchemy.orm import Session
+
+from database.database import async_sessionlocal
+from database.model import User, utcnow
+from helpers.bloom import BloomFilter
+from helpers.config import (user_availability_capacity, user_availability_error_rate,
+                            user_availability_sync, user_availability_overlap, user_availability_rebuild)
+
+FIELDS = ("username", "email", "phone")
+
+
+class UserAvailability:
+    """
+    Whether a username, email or phone number is taken, answered from Bloom
+    filters of the values in ``users`` where possible.
+
+    A value the filter has never seen is free without a query; a possible hit
+    falls through to one indexed ``EXISTS`` for all of them. Commits of this
+    worker are added as they happen, users other workers created or changed are
+    picked up by an incremental sync on ``users.updated_at`` every
+    ``sync_interval`` seconds, and the filters are rebuilt every
+    ``rebuild_interval`` seconds (or sooner after many deletes) to drop values
+    that were freed. The answer is advisory, the unique constraints still
+    decide at registration.
+    """
+
+    def __init__(self, session_factory, capacity: int = 100_000, error_rate: float = 0.01,
+                 sync_interval: float = 5.0, sync_overlap: float = 60.0, rebuild_interval: float = 900.0):
+        self.session_factory = session_factory
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.sync_overlap = sync_overlap
+        self.rebuild_interval = rebuild_interval
+        self._filters: dict[str, BloomFilter] | None = None
+        # wall-clock UTC the last build or sync started reading at, compared with users.updated_at
+        self._changed_since = None
+        self._built_at = self._synced_at = 0.0
+        self._removed = 0
+        # values committed while a rebuild reads the table, replayed into the new filters
+        self._during_rebuild: list | None = None
+        self._task: asyncio.Task | None = None
+        self.metrics = dict.fromkeys(("checks", "definitely_free", "db_checks", "false_positives", "rebuilds"), 0)
+
+    def add(self, values: dict):
+        if self._during_rebuild is not None:
+            self._during_rebuild.append(values)
+        if self._filters is None:
+            return
+        for field, value in values.items():
+            if value is not None:
+                self._filters[field].add(value)
+
+    def removed(self, count: int = 1):
+        """Deleted users stay in the filters (as false positives) until the next rebuild."""
+        self._removed += count
+        if self._filters is not None and self._removed > 0.1 * max(1, self._filters["username"].count):
+            self._built_at = 0.0
+
+    async def refresh(self):
+        """Rebuild the filters from the table."""
+        self._during_rebuild = []
+        started = utcnow()
+        try:
+            async with self.session_factory() as db:
+                rows = (await db.execute(select(*(getattr(User, field) for field in FIELDS)))).all()
+            capacity = max(self.capacity, 2 * len(rows))
+            filters = {field: BloomFilter(capacity, self.error_rate) for field in FIELDS}
+            for row in rows:
+                for field in FIELDS:
+                    value = getattr(row, field)
+                    if value is not None:
+                        filters[field].add(value)
+            for values in self._during_rebuild:
+                for field, value in values.items():
+                    if value is not None:
+                        filters[field].add(value)
+            self._filters = filters
+        finally:
+            self._during_rebuild = None
+        self._changed_since = started
+        self._removed = 0
+        self._built_at = self._synced_at = time.monotonic()
+        self.metrics["rebuilds"] += 1
+
+    async def _sync(self):
+        """Add users created or changed since the last build or sync, by any worker."""
+        started = utcnow()
+        # re-reading a little before the last sync catches clock skew between the workers and
+        # commits that landed after it with an earlier updated_at; adding a value twice is harmless
+        since = self._changed_since - timedelta(seconds=self.sync_overlap)
+        async with self.session_factory() as db:
+            rows = (await db.execute(select(*(getattr(User, field) for field in FIELDS))
+                                     .where(User.updated_at >= since))).all()
+        for row in rows:
+            self.add({field: getattr(row, field) for field in FIELDS})
+        self._changed_since = started
+        self._synced_at = time.monotonic()
+
+    async def _ensure_fresh(self):
+        if self._filters is None:
+            await self.refresh()
+            return
+        if self._task is not None and not self._task.done():
+            return
+        now = time.monotonic()
+        if now - self._built_at > self.rebuild_interval:
+            self._task = asyncio.get_running_loop().create_task(self.refresh())
+        elif now - self._synced_at > self.sync_interval:
+            # a user another worker created or renamed in the meantime is missed for at most this long
+            await self._sync()
+
+    async def exists(self, db, **values) -> dict:
+        """``{field: taken}`` for the given username/email/phone values."""
+        await self._ensure_fresh()
+        self.metrics["checks"] += 1
+        taken, possible = {}, {}
+        for field, value in values.items():
+            if value in self._filters[field]: # type: ignore
+                possible[field] = value
+            else:
+                taken[field] = False
+                self.metrics["definitely_free"] += 1
+        if possible:
+            self.metrics["db_checks"] += 1
+            row = (await db.execute(select(*(exists().where(getattr(User, field) == value).label(field)
+                                             for field, value in possible.items())))).one()
+            for field in possible:
+                taken[field] = bool(row._mapping[field])
+                self.metrics["false_positives"] += not taken[field]
+        return {field: taken[field] for field in values}
+
+    def snapshot(self) -> dict:
+        return {
+            **self.metrics,
+            "removed_since_rebuild": self._removed,
+            "filters": {field: bloom.snapshot() for field, bloom in (self._filters or {}).items()},
+        }
+
+
+def install(session_class, availability: UserAvailability):
+    """Feed ``availability`` the users each session commits."""
+    info_key = ("user_availability", id(availability))
+
+    @event.listens_for(session_class, "after_flush")
+    def collect_users(session, flush_context):
+        pending = session.info.setdefault(info_key, {"added": [], "removed": 0})
+        for obj in chain(session.new, session.dirty):
+            if isinstance(obj, User):
+                # loaded state only, an attribute that isn't loaded wasn't changed either
+                loaded = inspect(obj).dict
+                pending["added"].append({field: loaded[field] for field in FIELDS if field in loaded})
+        pending["removed"] += sum(isinstance(obj, User) for obj in session.deleted)
+
+    @event.listens_for(session_class, "after_commit")
+    def apply_committed(session):
+        pending = session.info.pop(info_key, None)
+        if pending:
+            for values in pending["added"]:
+                availability.add(values)
+            if pending["removed"]:
+                availability.removed(pending["removed"])
+
+    @event.listens_for(session_class, "after_rollback")
+    def forget_rolled_back(session):
+        session.info.pop(info_key, None)
+
+
+# usernames, emails and phones in use, filled at startup and kept current by commits
+user_availability = UserAvailability(async_sessionlocal, capacity=user_availability_capacity,
+                                     error_rate=user_availability_error_rate,
+                                     sync_interval=user_availability_sync,
+                                     sync_overlap=user_availability_overlap,
+                                     rebuild_interval=user_availability_rebuild)
+install(Session, user_availability)
@@ -0,0 +1,51 @@
+import hashlib
+import math
+import threading
+
+
+class BloomFilter:
+    """
+    Set membership with no false negatives: ``value in bloom`` is False only
+    for values never added, True for added ones and for about ``error_rate``
+    of the rest once ``capacity`` values are in. Values cannot be removed.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        capacity = max(1, capacity)
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.capacity = capacity
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+        self._lock = threading.Lock()
+
+    def _positions(self, value: str):
+        # two 64-bit halves of one digest stand in for k independent hashes (Kirsch-Mitzenmacher)
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, value: str):
+        positions = self._positions(value)
+        with self._lock:
+            for position in positions:
+                self._bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def __contains__(self, value: str) -> bool:
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+    def fill_ratio(self) -> float:
+        return int.from_bytes(self._bits, "little").bit_count() / self.size
+
+    def snapshot(self) -> dict:
+        fill = self.fill_ratio()
+        return {
+            "items": self.count,
+            "capacity": self.capacity,
+            "bits": self.size,
+            "hashes": self.hashes,
+            "fill_ratio": round(fill, 4),
+            "estimated_false_positive_rate": round(fill ** self.hashes, 6),
+        }
@@ -0,0 +1,770 @@
+"""
+Shared cache.
+
+One ``Cache`` per process over a pluggable backend: ``MemoryBackend`` keeps
+entries in this worker (LRU, TTL and a byte budget), ``RedisBackend`` speaks
+the Redis protocol so every worker sees the same entries, ``DiskBackend``
+keeps them in a SQLite file that outlives the process. Callers work with
+namespaces, each with its own TTL and metrics::
+
+    llm = cache.namespace("llm", ttl=3600)
+    result = await llm.aget_or_compute(digest, lambda: call_model(...))
+
+Invalidation never scans keys. Every namespace, and every tag an entry was
+stored with, has a generation token in the backend; entries remember the
+tokens they were written under and a lookup that finds a newer token treats
+them as gone. ``invalidate()`` replaces the namespace token,
+``invalidate(tags)`` only those tags'. A token that was evicted is recreated
+fresh, which invalidates rather than revives what was stored under it.
+
+``get_or_compute`` lets one caller per key compute while concurrent callers
+wait for its result: threads and tasks of this process on a local lock or
+future, other workers on a short-lived lock key in a shared backend.
+
+The backend API is synchronous, for threads and the (sync) model helpers.
+Async code uses the ``a``-prefixed namespace methods (``aget``, ``aset``,
+``aget_or_compute``...), which run the socket and SQLite round trips of a
+``blocking`` backend on the thread pool so they never stall the event loop.
+A backend that is down makes every lookup a miss, it never fails the request.
+
+Values are stored as JSON, never pickled: anything that can read the shared
+backend could otherwise make every worker run code of its choosing. A value
+has to be JSON-serializable and comes back as JSON types (a tuple as a list).
+
+Without a Redis server at hand, run the bundled stand-in from ``src/``::
+
+    python -m helpers.cache serve --port 6379
+"""
+import argparse
+import asyncio
+import json
+import logging
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+
+from starlette.concurrency import run_in_threadpool #type: ignore
+
+from helpers.config import (cache_backend, cache_url, cache_timeout, cache_max_entries, cache_max_bytes,
+                            cache_prefix, cache_lock_ttl)
+from helpers.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+LOCK_POLL = 0.05  # seconds between checks while another worker computes the same key
+
+
+class CacheBackendError(Exception):
+    """The backend could not be reached or answered with an error."""
+
+
+class MemoryBackend:
+    """
+    LRU of byte strings with per-entry TTL, bounded by entry count and by the
+    total size of keys and values. Private to this process.
+    """
+
+    shared = False
+    blocking = False
+
+    def __init__(self, max_entries: int = 20_000, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, tuple[float | None, bytes]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get_many(self, keys) -> list:
+        now = time.monotonic()
+        values = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] is not None and entry[0] <= now:
+                    self._remove(key)
+                    entry = None
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                values.append(None if entry is None else entry[1])
+        return values
+
+    def set(self, key: str, value: bytes, ttl: float | None = None, only_if_absent: bool = False) -> bool:
+        size = len(key) + len(value)
+        if size > self.max_bytes:
+            return False
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            if key in self._entries:
+                current = self._entries[key]
+                if only_if_absent and (current[0] is None or current[0] > time.monotonic()):
+                    return False
+                self._remove(key)
+            self._entries[key] = (expires_at, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return True
+
+    def set_many(self, mapping: dict):
+        for key, value in mapping.items():
+            self.set(key, value)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._remove(key)
+
+    def _remove(self, key):
+        _, value = self._entries.pop(key)
+        self._bytes -= len(key) + len(value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def describe(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+            }
+
+
+class DiskBackend:
+    """
+    SQLite file of byte strings with per-entry TTL, evicting the least recently
+    read entries once the values exceed ``max_bytes``. Survives restarts and is
+    shared by the workers of one host, for results that are slow or costly to
+    recompute.
+    """
+
+    shared = True
+    blocking = True
+
+    def __init__(self, path, max_bytes: int = 256 * 1024 * 1024):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._local = threading.local()
+        with self._transaction() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                       "size INTEGER NOT NULL, expires_at REAL, accessed_at REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS ix_entries_accessed_at ON entries (accessed_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections can't cross threads, keep one per thread
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        try:
+            db = self._connection()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+        except sqlite3.Error as e:
+            raise CacheBackendError(f"{self.path}: {e}") from e
+
+    def get_many(self, keys) -> list:
+        if not keys:
+            return []
+        now = time.time()
+        with self._transaction() as db:
+            placeholders = ",".join("?" * len(keys))
+            rows = {key: value for key, value in db.execute(
+                f"SELECT key, value FROM entries WHERE key IN ({placeholders}) "
+                f"AND (expires_at IS NULL OR expires_at > ?)", [*keys, now])}
+            if rows:
+                db.execute(f"UPDATE entries SET accessed_at = ? WHERE key IN ({','.join('?' * len(rows))})",
+                           [now, *rows])
+        return [rows.get(key) for key in keys]
+
+    def set(self, key: str, value: bytes, ttl: float | None = None, only_if_absent: bool = False) -> bool:
+        if len(value) > self.max_bytes:
+            return False
+        now = time.time()
+        expires_at = None if ttl is None else now + ttl
+        with self._transaction() as db:
+            if only_if_absent:
+                stored = db.execute(
+                    "INSERT INTO entries VALUES (?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+                    "value = excluded.value, size = excluded.size, expires_at = excluded.expires_at, "
+                    "accessed_at = excluded.accessed_at WHERE entries.expires_at <= ?",
+                    (key, value, len(value), expires_at, now, now)).rowcount > 0
+            else:
+                db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                           (key, value, len(value), expires_at, now))
+                stored = True
+            if stored:
+                self._evict(db, now)
+        return stored
+
+    def _evict(self, db, now):
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        total -= db.execute("SELECT COALESCE(SUM(size), 0) FROM entries WHERE expires_at <= ?", (now,)).fetchone()[0]
+        db.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+        # down to 90% so the next writes don't each pay for an eviction
+        for key, size in db.execute("SELECT key, size FROM entries ORDER BY accessed_at").fetchall():
+            if total <= self.max_bytes * 0.9:
+                break
+            db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def set_many(self, mapping: dict):
+        for key, value in mapping.items():
+            self.set(key, value)
+
+    def delete(self, *keys):
+        if keys:
+            with self._transaction() as db:
+                db.execute(f"DELETE FROM entries WHERE key IN ({','.join('?' * len(keys))})", keys)
+
+    def describe(self) -> dict:
+        with self._transaction() as db:
+            entries, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {
+            "backend": "disk",
+            "path": str(self.path),
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+        }
+
+
+def _encode_command(args) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+def _read_reply(stream):
+    line = stream.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("connection closed by the cache server")
+    kind, payload = line[:1], line[1:-2]
+    if kind == b"+":
+        return payload.decode()
+    if kind == b"-":
+        raise CacheBackendError(payload.decode())
+    if kind == b":":
+        return int(payload)
+    if kind == b"$":
+        length = int(payload)
+        if length < 0:
+            return None
+        data = stream.read(length + 2)
+        if len(data) != length + 2:
+            raise ConnectionError("connection closed by the cache server")
+        return data[:-2]
+    if kind == b"*":
+        length = int(payload)
+        return None if length < 0 else [_read_reply(stream) for _ in range(length)]
+    raise CacheBackendError(f"unexpected reply {line!r}")
+
+
+class RedisBackend:
+    """
+    Minimal Redis (RESP2) client for the handful of commands the cache needs,
+    over a small pool of blocking sockets. Works against Redis, Valkey, KeyDB
+    and the stand-in from ``serve``.
+    """
+
+    shared = True
+    blocking = True
+
+    def __init__(self, url: str = "redis://localhost:6379/0", timeout: float = 0.25, max_idle: int = 8):
+        parsed = urlparse(url)
+        if parsed.scheme not in ("redis", ""):
+            raise ValueError(f"Unsupported cache URL {url!r}, expected redis://[:password@]host:port/db")
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._idle: list = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = (sock, sock.makefile("rb"))
+        if self.password is not None:
+            self._roundtrip(conn, ["AUTH", *([self.username] if self.username else []), self.password])
+        if self.db:
+            self._roundtrip(conn, ["SELECT", self.db])
+        return conn
+
+    @staticmethod
+    def _roundtrip(conn, args):
+        sock, stream = conn
+        sock.sendall(_encode_command(args))
+        return _read_reply(stream)
+
+    def execute(self, *args):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        try:
+            if conn is None:
+                conn = self._connect()
+            reply = self._roundtrip(conn, args)
+        except CacheBackendError:
+            # an error reply leaves the connection usable
+            if conn is not None:
+                self._release(conn)
+            raise
+        except (OSError, ValueError) as e:
+            if conn is not None:
+                self._close(conn)
+            raise CacheBackendError(f"{self.host}:{self.port}: {e}") from e
+        self._release(conn)
+        return reply
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        sock, stream = conn
+        stream.close()
+        sock.close()
+
+    def get_many(self, keys) -> list:
+        return self.execute("MGET", *keys) if keys else []
+
+    def set(self, key: str, value: bytes, ttl: float | None = None, only_if_absent: bool = False) -> bool:
+        args = ["SET", key, value]
+        if ttl is not None:
+            args += ["PX", max(1, int(ttl * 1000))]
+        if only_if_absent:
+            args.append("NX")
+        return self.execute(*args) is not None
+
+    def set_many(self, mapping: dict):
+        if mapping:
+            self.execute("MSET", *(part for item in mapping.items() for part in item))
+
+    def delete(self, *keys):
+        if keys:
+            self.execute("DEL", *keys)
+
+    def describe(self) -> dict:
+        return {"backend": "redis", "host": self.host, "port": self.port, "db": self.db}
+
+
+class Uncached:
+    """Wraps a value ``compute`` returns to hand it to the caller without storing it, e.g. a degraded answer."""
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Namespace:
+    """A named slice of a ``Cache`` with its own default TTL, generation and metrics."""
+
+    def __init__(self, cache: "Cache", name: str, ttl: float | None = None):
+        self.cache = cache
+        self.name = name
+        self.ttl = ttl
+        self._base = f"{cache.prefix}:{name}:"
+        self._flights: dict = {}
+        self._async_flights = SingleFlight()
+        self._flights_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._last_error_log = 0.0
+        self.metrics = dict.fromkeys(
+            ("hits", "misses", "sets", "computes", "coalesced", "invalidations", "errors"), 0)
+        self.metrics["compute_seconds"] = 0.0
+
+    def _count(self, metric: str, amount=1):
+        with self._metrics_lock:
+            self.metrics[metric] += amount
+
+    def _key(self, key) -> str:
+        if isinstance(key, tuple):
+            key = ":".join(map(str, key))
+        return f"{self._base}k:{key}"
+
+    def _tag_key(self, tag: str) -> str:
+        return f"{self._base}tag:{tag}"
+
+    def _backend(self, operation, *args, default=None):
+        try:
+            return operation(*args)
+        except CacheBackendError as e:
+            self._count("errors")
+            now = time.monotonic()
+            if now - self._last_error_log > 60:
+                self._last_error_log = now
+                logger.warning("Cache backend unavailable for namespace %s, serving without cache: %s",
+                               self.name, e)
+            return default
+
+    def _generations(self, tags=()) -> tuple | None:
+        """Current generation tokens of the namespace and of ``tags``, created where missing."""
+        backend = self.cache.backend
+        keys = [f"{self._base}gen", *(self._tag_key(tag) for tag in tags)]
+        values = self._backend(backend.get_many, keys)
+        if values is None:
+            return None
+        for i, value in enumerate(values):
+            if value is None:
+                # first writer wins, everyone re-reads the winner's token
+                self._backend(backend.set, keys[i], uuid.uuid4().hex.encode(), None, True)
+                values[i] = (self._backend(backend.get_many, [keys[i]]) or [None])[0]
+                if values[i] is None:
+                    return None
+        tokens = [value.decode() for value in values]
+        return tokens[0], dict(zip(tags, tokens[1:]))
+
+    def _lookup(self, key):
+        backend = self.cache.backend
+        values = self._backend(backend.get_many, [f"{self._base}gen", self._key(key)])
+        if values is None or values[0] is None or values[1] is None:
+            return False, None
+        try:
+            generation, tag_generations, value = json.loads(values[1])
+        except Exception:
+            # written by an incompatible version of the code, recompute
+            return False, None
+        if generation != values[0].decode():
+            return False, None
+        if tag_generations:
+            current = self._backend(backend.get_many, [self._tag_key(tag) for tag in tag_generations])
+            if current is None or list(tag_generations.values()) != [token and token.decode() for token in current]:
+                return False, None
+        return True, value
+
+    def get(self, key, default=None):
+        found, value = self._lookup(key)
+        self._count("hits" if found else "misses")
+        return value if found else default
+
+    def set(self, key, value, ttl: float | None = None, tags=(), generations=None):
+        """
+        Store ``value`` under ``key``. It is dropped by ``invalidate()`` and by
+        ``invalidate`` of any of ``tags``.
+        """
+        tags = tuple(sorted(set(tags)))
+        generations = generations or self._generations(tags)
+        if generations is None:
+            return
+        payload = json.dumps([generations[0], generations[1], value], separators=(",", ":")).encode()
+        ttl = self.ttl if ttl is None else ttl
+        if self._backend(self.cache.backend.set, self._key(key), payload, ttl):
+            self._count("sets")
+
+    def delete(self, key):
+        self._backend(self.cache.backend.delete, self._key(key))
+
+    def invalidate(self, tags=None):
+        """Drop every entry of the namespace, or with ``tags`` only the entries stored with one of them."""
+        keys = [f"{self._base}gen"] if tags is None else [self._tag_key(tag) for tag in set(tags)]
+        if not keys:
+            return
+        if self._backend(self.cache.backend.set_many, {key: uuid.uuid4().hex.encode() for key in keys},
+                         default=False) is not False:
+            self._count("invalidations", len(keys))
+
+    def _compute(self, key, compute, ttl, tags):
+        # generations are read before computing, so an invalidation racing the computation wins
+        generations = self._generations(tuple(sorted(set(tags))))
+        start = time.perf_counter()
+        value = compute()
+        self._count("computes")
+        self._count("compute_seconds", time.perf_counter() - start)
+        if isinstance(value, Uncached):
+            return value.value
+        self.set(key, value, ttl, tags, generations)
+        return value
+
+    def _try_lock(self, key) -> bool:
+        backend = self.cache.backend
+        if not backend.shared:
+            return True
+        # an unreachable backend lets everyone compute rather than wait
+        return self._backend(backend.set, self._key(key) + ":lock", b"1", self.cache.lock_ttl, True,
+                             default=True)
+
+    def _unlock(self, key):
+        if self.cache.backend.shared:
+            self._backend(self.cache.backend.delete, self._key(key) + ":lock")
+
+    def _locked(self, key) -> bool:
+        values = self._backend(self.cache.backend.get_many, [self._key(key) + ":lock"])
+        return bool(values) and values[0] is not None
+
+    @contextmanager
+    def _flight(self, key):
+        with self._flights_lock:
+            lock, waiters = self._flights.get(key, (threading.Lock(), 0))
+            self._flights[key] = (lock, waiters + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._flights_lock:
+                lock, waiters = self._flights[key]
+                if waiters == 1:
+                    del self._flights[key]
+                else:
+                    self._flights[key] = (lock, waiters - 1)
+
+    def get_or_compute(self, key, compute, ttl: float | None = None, tags=()):
+        """
+        The cached value of ``key``, or ``compute()`` stored under it (unless it
+        returns ``Uncached``). Concurrent callers for the same key wait for the
+        one computing instead of repeating it.
+        """
+        found, value = self._lookup(key)
+        if found:
+            self._count("hits")
+            return value
+        self._count("misses")
+        with self._flight(key):
+            found, value = self._lookup(key)
+            if found:
+                self._count("coalesced")
+                return value
+            deadline = time.monotonic() + self.cache.lock_ttl
+            while not self._try_lock(key):
+                time.sleep(LOCK_POLL)
+                found, value = self._lookup(key)
+                if found:
+                    self._count("coalesced")
+                    return value
+                if time.monotonic() > deadline or not self._locked(key):
+                    break
+            try:
+                return self._compute(key, compute, ttl, tags)
+            finally:
+                self._unlock(key)
+
+    async def _offload(self, operation, *args):
+        # a blocking backend's round trips run on the thread pool, the memory backend's lookups stay inline
+        if self.cache.backend.blocking:
+            return await run_in_threadpool(operation, *args)
+        return operation(*args)
+
+    async def aget(self, key, default=None):
+        return await self._offload(self.get, key, default)
+
+    async def aset(self, key, value, ttl: float | None = None, tags=(), generations=None):
+        await self._offload(self.set, key, value, ttl, tags, generations)
+
+    async def adelete(self, key):
+        await self._offload(self.delete, key)
+
+    async def ainvalidate(self, tags=None):
+        await self._offload(self.invalidate, tags)
+
+    async def aget_or_compute(self, key, compute, ttl: float | None = None, tags=()):
+        """``get_or_compute`` for a coroutine function ``compute``, waiting without blocking the loop."""
+        found, value = await self._offload(self._lookup, key)
+        if found:
+            self._count("hits")
+            return value
+        self._count("misses")
+        value, shared = await self._async_flights.do(key, lambda: self._acompute(key, compute, ttl, tags))
+        if shared:
+            self._count("coalesced")
+        return value
+
+    async def _acompute(self, key, compute, ttl, tags):
+        deadline = time.monotonic() + self.cache.lock_ttl
+        while not await self._offload(self._try_lock, key):
+            await asyncio.sleep(LOCK_POLL)
+            found, value = await self._offload(self._lookup, key)
+            if found:
+                self._count("coalesced")
+                return value
+            if time.monotonic() > deadline or not await self._offload(self._locked, key):
+                break
+        try:
+            generations = await self._offload(self._generations, tuple(sorted(set(tags))))
+            start = time.perf_counter()
+            value = await compute()
+            self._count("computes")
+            self._count("compute_seconds", time.perf_counter() - start)
+            if isinstance(value, Uncached):
+                return value.value
+            await self.aset(key, value, ttl, tags, generations)
+            return value
+        finally:
+            await self._offload(self._unlock, key)
+
+    def snapshot(self) -> dict:
+        with self._metrics_lock:
+            metrics = dict(self.metrics)
+        lookups = metrics["hits"] + metrics["misses"]
+        metrics["compute_seconds"] = round(metrics["compute_seconds"], 3)
+        metrics["hit_ratio"] = round(metrics["hits"] / lookups, 4) if lookups else 0.0
+        metrics["ttl_s"] = self.ttl
+        return metrics
+
+
+class Cache:
+    """Namespaces over one backend, with every key under ``prefix``."""
+
+    def __init__(self, backend, prefix: str = "fnol", lock_ttl: float = 30.0):
+        self.backend = backend
+        self.prefix = prefix
+        self.lock_ttl = lock_ttl  # longest a worker waits on another one computing the same key
+        self._namespaces: dict[str, Namespace] = {}
+        self._lock = threading.Lock()
+
+    def namespace(self, name: str, ttl: float | None = None) -> Namespace:
+        """The namespace ``name``, created with default ``ttl`` on first use."""
+        with self._lock:
+            namespace = self._namespaces.get(name)
+            if namespace is None:
+                namespace = self._namespaces[name] = Namespace(self, name, ttl)
+            return namespace
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            namespaces = dict(self._namespaces)
+        try:
+            backend = self.backend.describe()
+        except CacheBackendError as e:
+            backend = {"error": str(e)}
+        return {"backend": backend, "namespaces": {name: ns.snapshot() for name, ns in namespaces.items()}}
+
+
+def backend_from_config():
+    if cache_backend == "memory":
+        return MemoryBackend(max_entries=cache_max_entries, max_bytes=cache_max_bytes)
+    if cache_backend == "redis":
+        return RedisBackend(cache_url, timeout=cache_timeout)
+    raise ValueError(f"Unknown CACHE_BACKEND {cache_backend!r}, expected memory or redis")
+
+
+# the process-wide cache, shared between workers when CACHE_BACKEND=redis
+cache = Cache(backend_from_config(), prefix=cache_prefix, lock_ttl=cache_lock_ttl)
+
+
+class _StandInHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        while True:
+            try:
+                command = _read_reply(self.rfile)
+            except (ConnectionError, OSError):
+                return
+            if not isinstance(command, list) or not command:
+                self.wfile.write(b"-ERR expected a command array\r\n")
+                continue
+            try:
+                self.wfile.write(self.server.dispatch(command[0].decode().upper(), command[1:]))
+            except (ValueError, IndexError):
+                self.wfile.write(b"-ERR syntax error\r\n")
+
+
+class StandInServer(socketserver.ThreadingTCPServer):
+    """
+    A Redis-protocol server backed by a ``MemoryBackend``, for development and
+    tests: enough of GET/MGET/SET/MSET/DEL to share the cache between local
+    workers without installing Redis. Not meant for production.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=("127.0.0.1", 6379), max_entries: int = 100_000,
+                 max_bytes: int = 256 * 1024 * 1024):
+        super().__init__(address, _StandInHandler)
+        self.store = MemoryBackend(max_entries=max_entries, max_bytes=max_bytes)
+
+    def dispatch(self, name: str, args: list) -> bytes:
+        # latin-1 maps any byte string to a str and back, values stay bytes
+        keys = [arg.decode("latin-1") for arg in args]
+        if name in ("PING", "SELECT", "AUTH"):
+            return b"+PONG\r\n" if name == "PING" else b"+OK\r\n"
+        if name == "GET":
+            return self._bulk(self.store.get_many(keys[:1])[0])
+        if name == "MGET":
+            return b"*%d\r\n" % len(keys) + b"".join(self._bulk(value) for value in self.store.get_many(keys))
+        if name == "SET":
+            ttl, only_if_absent, options = None, False, [key.upper() for key in keys[2:]]
+            for i, option in enumerate(options):
+                if option in ("PX", "EX"):
+                    ttl = float(options[i + 1]) / (1000 if option == "PX" else 1)
+                only_if_absent |= option == "NX"
+            stored = self.store.set(keys[0], args[1], ttl, only_if_absent)
+            return b"+OK\r\n" if stored else b"$-1\r\n"
+        if name == "MSET":
+            self.store.set_many({keys[i]: args[i + 1] for i in range(0, len(args), 2)})
+            return b"+OK\r\n"
+        if name == "DEL":
+            present = sum(value is not None for value in self.store.get_many(keys))
+            self.store.delete(*keys)
+            return b":%d\r\n" % present
+        if name == "FLUSHDB":
+            self.store.clear()
+            return b"+OK\r\n"
+        return f"-ERR unknown command '{name}'\r\n".encode()
+
+    @staticmethod
+    def _bulk(value) -> bytes:
+        return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m helpers.cache",
+                                     description="Shared cache tools.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="run a local Redis-protocol stand-in")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=6379)
+    serve.add_argument("--max-entries", type=int, default=100_000)
+    serve.add_argument("--max-bytes", type=int, default=256 * 1024 * 1024)
+    args = parser.parse_args(argv)
+
+    with StandInServer((args.host, args.port), args.max_entries, args.max_bytes) as server:
+        print(f"Cache stand-in listening on {args.host}:{server.server_address[1]}, "
+              f"set CACHE_BACKEND=redis CACHE_URL=redis://{args.host}:{server.server_address[1]}/0")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -29,6 +29,36 @@ SQLALCHEMY_DATABASE_URL_POLICY = (
 
 Cloud_db = os.getenv("cloud_db")
 
+# optional, derived from cloud_db by swapping in the asyncio driver when unset
+Cloud_db_async = os.getenv("cloud_db_async")
+
+# connection pool, shared by the sync and async engines (each gets its own pool)
+db_pool_size = int(os.getenv("DB_POOL_SIZE", "5"))
+
+db_max_overflow = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+db_pool_pre_ping = os.getenv("DB_POOL_PRE_PING", "true").strip().lower() == "true"
+
+db_pool_recycle = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds, -1 disables
+
+db_pool_timeout = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # seconds to wait for a free connection
+
+db_echo = os.getenv("DB_ECHO", "false").strip().lower()  # false | true | debug
+
+# per-request statement counts in Server-Timing / X-DB-Queries, meant for dev and staging
+db_query_stats = os.getenv("DB_QUERY_STATS", "false").strip().lower() == "true"
+
+db_n_plus_one_threshold = int(os.getenv("DB_N_PLUS_ONE_THRESHOLD", "10"))  # same statement more often than this warns
+
+# statements slower than this go to the slow-query log with their EXPLAIN plan, -1 disables
+db_slow_query_ms = float(os.getenv("DB_SLOW_QUERY_MS", "500"))
+
+db_slow_query_log = Path(os.getenv("DB_SLOW_QUERY_LOG", "logs/slow_queries.jsonl"))
+
+db_slow_query_log_bytes = int(os.getenv("DB_SLOW_QUERY_LOG_BYTES", "10000000"))  # rotate at this size
+
+db_slow_query_log_backups = int(os.getenv("DB_SLOW_QUERY_LOG_BACKUPS", "5"))
+
 
 
 origins = [
@@ -47,6 +77,145 @@ admin_username = os.getenv("DEFAULT_ADMIN_USERNAME")
 
 admin_password = os.getenv("DEFAULT_ADMIN_PASSWORD") 
 
+# shared cache behind the token, response and LLM caches: "memory" keeps it per worker, "redis" shares it
+cache_backend = os.getenv("CACHE_BACKEND", "memory").strip().lower()
+
+cache_url = os.getenv("CACHE_URL", "redis://localhost:6379/0")
+
+cache_timeout = float(os.getenv("CACHE_TIMEOUT", "0.25"))  # seconds per round trip before serving uncached
+
+cache_prefix = os.getenv("CACHE_PREFIX", "fnol")  # keeps several deployments apart on one server
+
+cache_lock_ttl = float(os.getenv("CACHE_LOCK_TTL", "30"))  # longest a worker waits on another computing a key
+
+cache_max_entries = int(os.getenv("CACHE_MAX_ENTRIES", "20000"))  # memory backend only
+
+cache_max_bytes = int(os.getenv("CACHE_MAX_BYTES", "67108864"))  # memory backend only
+
+# verified token claims are trusted until the token expires, at most this many seconds
+token_cache_ttl = float(os.getenv("TOKEN_CACHE_TTL", "300"))
+
+# serialized policy/claim/user/vehicle detail responses, dropped on commit of a row they show
+response_cache_ttl = float(os.getenv("RESPONSE_CACHE_TTL", "30"))  # bounds staleness across workers
+
+# one Gemini model per worker, called asynchronously
+gemini_model = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+
+gemini_max_concurrency = int(os.getenv("GEMINI_MAX_CONCURRENCY", "4"))  # calls in flight per worker, others queue
+
+gemini_timeout = float(os.getenv("GEMINI_TIMEOUT", "60"))  # seconds per call
+
+# per worker, so split the account quota between the workers
+gemini_rate_per_minute = float(os.getenv("GEMINI_RATE_PER_MINUTE", "60"))
+
+gemini_burst = int(os.getenv("GEMINI_BURST", "5"))
+
+gemini_rate_max_wait = float(os.getenv("GEMINI_RATE_MAX_WAIT", "10"))  # seconds, beyond that use the fallback model
+
+gemini_retries = int(os.getenv("GEMINI_RETRIES", "2"))  # extra attempts after a transient error
+
+gemini_retry_base = float(os.getenv("GEMINI_RETRY_BASE", "0.5"))  # seconds, doubled per attempt, fully jittered
+
+gemini_retry_max = float(os.getenv("GEMINI_RETRY_MAX", "8"))
+
+gemini_breaker_failures = int(os.getenv("GEMINI_BREAKER_FAILURES", "5"))  # consecutive failures that open the breaker
+
+gemini_breaker_reset = float(os.getenv("GEMINI_BREAKER_RESET", "30"))  # seconds open before one probe call
+
+# local Ollama model answering while Gemini is unavailable
+llm_fallback_enabled = os.getenv("LLM_FALLBACK_ENABLED", "true").strip().lower() == "true"
+
+ollama_model = os.getenv("OLLAMA_MODEL", "cogito:8b")
+
+ollama_timeout = float(os.getenv("OLLAMA_TIMEOUT", "120"))
+
+# local damage classifier behind /llm/damage_classify, loaded on first use
+damage_model = os.getenv("DAMAGE_MODEL", "beingamit99/car_damage_detection")
+
+damage_backend = os.getenv("DAMAGE_BACKEND", "torch").strip().lower()  # torch, or onnx for the int8 CPU model
+
+damage_batch_size = int(os.getenv("DAMAGE_BATCH_SIZE", "16"))  # images per forward pass, concurrent requests share one
+
+damage_batch_wait_ms = float(os.getenv("DAMAGE_BATCH_WAIT_MS", "5"))  # how long a batch may keep filling
+
+damage_queue_depth = int(os.getenv("DAMAGE_QUEUE_DEPTH", "256"))  # images waiting before requests are turned away
+
+damage_threads = int(os.getenv("DAMAGE_THREADS", "0"))  # CPU threads for inference, 0 leaves the library default
+
+damage_onnx_path = Path(os.getenv("DAMAGE_ONNX_PATH", "cache/damage_classifier.int8.onnx"))  # exported on first use
+
+# uploads are scaled down and re-encoded before any model sees them
+image_max_side = int(os.getenv("IMAGE_MAX_SIDE", "1600"))  # pixels on the longest side
+
+image_quality = int(os.getenv("IMAGE_QUALITY", "85"))  # JPEG quality of the re-encoded photo
+
+# photo quality gate in front of vehicle uploads and the vehicle check, unusable photos get a 422 with the reasons
+quality_gate_enabled = os.getenv("QUALITY_GATE_ENABLED", "true").strip().lower() == "true"
+
+quality_min_side = int(os.getenv("QUALITY_MIN_SIDE", "480"))  # pixels on the shorter side
+
+quality_min_sharpness = float(os.getenv("QUALITY_MIN_SHARPNESS", "25"))  # variance of the Laplacian at 512 px
+
+quality_min_brightness = float(os.getenv("QUALITY_MIN_BRIGHTNESS", "40"))  # mean luminance, 0-255
+
+quality_max_brightness = float(os.getenv("QUALITY_MAX_BRIGHTNESS", "220"))
+
+quality_max_clipped = float(os.getenv("QUALITY_MAX_CLIPPED", "0.5"))  # share of pixels crushed to black or blown to white
+
+quality_duplicate_distance = int(os.getenv("QUALITY_DUPLICATE_DISTANCE", "5"))  # differing bits of 64 for a near-duplicate
+
+# tiered claim assessment: the local classifier and rules settle clear minor claims, the rest go to Gemini
+assess_tiered = os.getenv("ASSESS_TIERED", "true").strip().lower() == "true"  # false sends every claim to Gemini
+
+assess_min_confidence = float(os.getenv("ASSESS_MIN_CONFIDENCE", "0.8"))  # classifier probability every photo needs
+
+assess_max_local_amount = float(os.getenv("ASSESS_MAX_LOCAL_AMOUNT", "10000"))  # larger requested amounts go to Gemini
+
+assess_local_labels = [label.strip().lower() for label in os.getenv("ASSESS_LOCAL_LABELS", "scratch,dent").split(",")
+                       if label.strip()]  # damage types the local tier may settle
+
+# words in the damage description the classifier can't judge, such claims always go to Gemini
+assess_escalate_terms = [term.strip().lower() for term in
+                         os.getenv("ASSESS_ESCALATE_TERMS", "fire,flood,theft,stolen,total loss,engine,airbag,injur").split(",")
+                         if term.strip()]
+
+# Gemini answers keyed by image content, prompt version and parameters, kept on disk across restarts
+llm_cache_enabled = os.getenv("LLM_CACHE_ENABLED", "true").strip().lower() == "true"
+
+llm_cache_path = Path(os.getenv("LLM_CACHE_PATH", "cache/llm_results.sqlite3"))
+
+llm_cache_max_bytes = int(os.getenv("LLM_CACHE_MAX_BYTES", "268435456"))  # least recently used answers go first
+
+llm_cache_ttl = float(os.getenv("LLM_CACHE_TTL", "2592000"))  # seconds, 30 days
+
+# background jobs (LLM calls, document text): queued in the jobs table, run by leased workers
+jobs_in_process = os.getenv("JOBS_IN_PROCESS", "true").strip().lower() == "true"  # false when `python -m helpers.job_worker work` runs them
+
+jobs_concurrency = int(os.getenv("JOBS_CONCURRENCY", "2"))  # jobs one worker runs at once
+
+jobs_lease = float(os.getenv("JOBS_LEASE", "60"))  # seconds a dead worker's job stays invisible, renewed while it runs
+
+jobs_poll_interval = float(os.getenv("JOBS_POLL_INTERVAL", "1"))  # seconds between queue checks when idle
+
+jobs_max_attempts = int(os.getenv("JOBS_MAX_ATTEMPTS", "3"))
+
+jobs_retry_base = float(os.getenv("JOBS_RETRY_BASE", "5"))  # seconds before a failed attempt is retried, doubled per attempt
+
+jobs_retention = float(os.getenv("JOBS_RETENTION", "86400"))  # seconds finished jobs and their results are kept
+
+jobs_spool_path = Path(os.getenv("JOBS_SPOOL_PATH", "cache/jobs"))  # uploads waiting for their job
+
+# Bloom filters behind /users/availability, sized for this many users before they are grown at rebuild
+user_availability_capacity = int(os.getenv("USER_AVAILABILITY_CAPACITY", "100000"))
+
+user_availability_error_rate = float(os.getenv("USER_AVAILABILITY_ERROR_RATE", "0.01"))  # share of free values that still hit the DB
+
+user_availability_sync = float(os.getenv("USER_AVAILABILITY_SYNC", "5"))  # seconds, picks up users other workers created or changed
+
+user_availability_overlap = float(os.getenv("USER_AVAILABILITY_OVERLAP", "60"))  # seconds, each sync re-reads changes this much older than the last one, for clock skew and slow commits
+
+user_availability_rebuild = float(os.getenv("USER_AVAILABILITY_REBUILD", "900"))  # seconds, drops freed values
+
 secret_key = os.getenv("SECRET_KEY").strip(" ") #type: ignore
 
 algorithm = os.getenv("ALGORITHM").strip(" ") #type: ignore
@@ -0,0 +1,50 @@
+from fastapi import HTTPException, Response # type: ignore
+from fastapi.encoders import jsonable_encoder # type: ignore
+from fastapi.responses import JSONResponse # type: ignore
+from sqlalchemy.orm import load_only
+from starlette import status # type: ignore
+
+
+class FieldSet:
+    """
+    Sparse fieldsets from a ``fields=a,b,c`` query parameter.
+
+    ``selectable`` maps the names a client may ask for to the column that backs
+    them, e.g. ``policy_holder`` to ``Policy.holder_name``. The statement loads
+    only those columns and the response holds only those keys. Without
+    ``fields`` nothing changes and the endpoint returns its usual payload.
+    """
+
+    def __init__(self, fields: str | None, selectable: dict):
+        self.names = None
+        self.selectable = selectable
+        if not fields:
+            return
+        names = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+        unknown = [name for name in names if name not in selectable]
+        if unknown:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Unknown fields {unknown}, expected some of {sorted(selectable)}")
+        self.names = names
+
+    def apply(self, stmt, *required):
+        """Restrict ``stmt`` to the requested columns plus ``required`` ones (keys, sort and auth columns)."""
+        if self.names is None:
+            return stmt
+        columns = dict.fromkeys([*(self.selectable[name] for name in self.names), *required])
+        return stmt.options(load_only(*columns))
+
+    def _project(self, obj) -> dict:
+        return {name: getattr(obj, name) for name in self.names} #type: ignore
+
+    def render(self, result, response: Response):
+        """
+        The requested keys of ``result`` (an object or a list of them) as a JSONResponse,
+        bypassing the endpoint's response_model, with headers already set on ``response`` kept.
+        """
+        if self.names is None:
+            return result
+        content = [self._project(obj) for obj in result] if isinstance(result, list) else self._project(result)
+        headers = {key: value for key, value in response.headers.items()
+                   if key.lower() not in ("content-length", "content-type")}
+        return JSONResponse(jsonable_encoder(content), headers=headers)
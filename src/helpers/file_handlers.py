@@ -18,6 +18,10 @@ from independentsoft.msg import Attachment #type: ignore
 import re
 import pdfkit #type: ignore
 import io
+import ast
+import json
+from typing import Annotated
+from pydantic import BeforeValidator
 
 from helpers.config import vehicle_images_path
 
@@ -30,6 +34,32 @@ class Extract():
         return response
     
 
+def parse_path_map(value):
+    """
+    Accept a path map as a dict, or as the JSON / str(dict) text older clients send.
+    Only runs when a request is validated; stored maps are JSON and are never re-parsed.
+    """
+    if not isinstance(value, str):
+        return value
+    if value.strip() in ("", "null"):
+        return None
+    try:
+        return json.loads(value)
+    except json.JSONDecodeError:
+        try:
+            return ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            raise ValueError("expected a mapping of names to file paths")
+
+
+PathMap = Annotated[dict[str, Optional[str]], BeforeValidator(parse_path_map)]
+
+
+# what Transform.file_to_text can read
+IMAGE_TYPES = (".tif", ".tiff", ".png", ".jpg", ".jpeg", ".bmp")
+TEXT_SOURCE_TYPES = (".msg", ".pdf", ".docx", *IMAGE_TYPES)
+
+
 class Transform():
     def image_to_text(self,image_path):
         """
@@ -131,7 +161,7 @@ class Transform():
             attachment= Transform()
             return attachment.docx_to_text(file_path)
         
-        elif ext in [".tif", ".tiff", ".png", ".jpg", ".jpeg", ".bmp"]:
+        elif ext in IMAGE_TYPES:
             attachment= Transform()
             return attachment.image_to_text(file_path)
         else:
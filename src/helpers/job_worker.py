@@ -0,0 +1,41 @@
+"""
+Job worker outside the API process, from ``src/``::
+
+    python -m helpers.job_worker work [--concurrency N] [--once]
+
+A module of its own so ``helpers.jobs`` is only ever imported under its
+name: run as ``python -m helpers.jobs`` it would be loaded twice, and the
+handlers would register in the copy the worker doesn't read.
+"""
+import argparse
+import asyncio
+import logging
+
+from helpers.config import jobs_concurrency
+from helpers.jobs import job_worker
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m helpers.job_worker",
+                                     description="Background job tools.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    work = commands.add_parser("work", help="run a job worker outside the API")
+    work.add_argument("--concurrency", type=int, default=jobs_concurrency)
+    work.add_argument("--once", action="store_true", help="exit when the queue is empty")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    import AI_ML.tasks  # noqa: F401, registers the handlers
+    job_worker.concurrency = args.concurrency
+    print(f"Job worker {job_worker.worker_id} running {args.concurrency} at a time")
+    try:
+        if args.once:
+            print(f"Ran {asyncio.run(job_worker.drain())} jobs")
+        else:
+            asyncio.run(job_worker.run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,377 @@
+"""
+Background jobs kept in the ``jobs`` table.
+
+The API submits a job (saving its uploads to the spool directory) and answers
+``202 Accepted`` at once; a ``JobWorker`` leases due jobs, runs the handler
+registered for their kind and stores the result for ``GET /jobs/{job_id}``.
+The worker runs inside every API process by default, or on its own with
+``python -m helpers.job_worker work`` (set ``JOBS_IN_PROCESS=false`` for the API then).
+
+A lease is a visibility timeout: while a job runs its worker keeps pushing
+``lease_expires_at`` forward, and a job whose lease ran out (the worker died
+or hung) is leased again by the next worker that looks. Claims and
+completions are conditional updates, so two workers never both own a job and
+a worker that lost its lease can't overwrite the new owner's result. Handlers
+may therefore run more than once for a job and must be safe to repeat.
+"""
+import asyncio
+import logging
+import os
+import shutil
+import socket
+import time
+import uuid
+import weakref
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from fastapi.encoders import jsonable_encoder #type: ignore
+from sqlalchemy import and_, delete, func, or_, select, update
+from starlette.concurrency import run_in_threadpool #type: ignore
+
+from database.database import async_sessionlocal
+from database.model import Job
+from helpers.config import (jobs_concurrency, jobs_lease, jobs_poll_interval, jobs_max_attempts, jobs_retry_base,
+                            jobs_retention, jobs_spool_path)
+
+logger = logging.getLogger(__name__)
+
+HANDLERS: dict = {}
+
+FINISHED = ("succeeded", "failed")
+
+
+def handler(kind: str):
+    """Register the function running jobs of ``kind``. It gets the payload and returns a JSON-able result."""
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+    return register
+
+
+class JobError(Exception):
+    """A job failure with the HTTP status it maps to; ``retryable`` asks for another attempt."""
+
+    def __init__(self, detail: str, status_code: int = 500, retryable: bool = False):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+        self.retryable = retryable
+
+
+def utcnow() -> datetime:
+    # naive UTC, which is what DateTime columns hold on every backend
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def spool_dir(job_id: str) -> Path:
+    return jobs_spool_path / job_id
+
+
+def _spool(folder: Path, files: list) -> list[str]:
+    folder.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for index, (filename, content) in enumerate(files):
+        path = folder / f"{index}{Path(filename or '').suffix.lower() or '.bin'}"
+        path.write_bytes(content)
+        paths.append(str(path))
+    return paths
+
+
+def _discard_spool(job_id: str):
+    shutil.rmtree(spool_dir(job_id), ignore_errors=True)
+
+
+async def submit(db, kind: str, payload: dict, uploads=(), max_attempts: int = jobs_max_attempts) -> Job:
+    """
+    Queue a ``kind`` job and commit it. ``uploads`` are saved to the spool
+    directory and reach the handler as ``payload["files"]``, in order.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"No handler registered for job kind '{kind}'")
+    job_id = uuid.uuid4().hex
+    if uploads:
+        contents = [(upload.filename, await upload.read()) for upload in uploads]
+        payload = {**payload, "files": await run_in_threadpool(_spool, spool_dir(job_id), contents)}
+    now = utcnow()
+    job = Job(job_id=job_id, kind=kind, status="queued", payload=payload, attempts=0, max_attempts=max_attempts,
+              run_after=now, created_at=now)
+    db.add(job)
+    try:
+        await db.commit()
+    except Exception:
+        await run_in_threadpool(_discard_spool, job_id)
+        raise
+    # an in-process worker starts on it now instead of at its next poll
+    for worker in list(_workers):
+        worker.wake()
+    return job
+
+
+def describe(job: Job) -> dict:
+    """What ``GET /jobs/{job_id}`` reports."""
+    return {
+        "job_id": job.job_id,
+        "kind": job.kind,
+        "status": job.status,
+        "attempts": job.attempts,
+        "result": job.result,
+        "error": {"status_code": job.error_status, "detail": job.error} if job.status == "failed" else None,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
+
+
+async def queue_status(db) -> dict:
+    rows = (await db.execute(select(Job.status, func.count(), func.min(Job.created_at)).group_by(Job.status))).all()
+    counts = {status: 0 for status in ("queued", "running", *FINISHED)}
+    oldest_queued = None
+    for status, count, oldest in rows:
+        counts[status] = count
+        if status == "queued":
+            oldest_queued = oldest
+    age = (utcnow() - oldest_queued).total_seconds() if oldest_queued else 0.0
+    return {**counts, "oldest_queued_s": round(age, 1)}
+
+
+_workers: weakref.WeakSet = weakref.WeakSet()
+
+
+class JobWorker:
+    """
+    Leases up to ``concurrency`` jobs at a time and runs them on the event loop
+    (sync handlers go to the thread pool). Failed attempts are retried after
+    ``retry_base * 2**(attempt - 1)`` seconds while the job has attempts left
+    and the error is retryable.
+    """
+
+    def __init__(self, session_factory, concurrency: int = 2, lease: float = 60.0, poll_interval: float = 1.0,
+                 retry_base: float = 5.0, retention: float = 86400.0, worker_id: str | None = None):
+        self.session_factory = session_factory
+        self.concurrency = concurrency
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.retry_base = retry_base
+        self.retention = retention
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._active: dict[str, asyncio.Task] = {}
+        self._task: asyncio.Task | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._stopping = False
+        self._purged_at = self._swept_at = 0.0
+        self.metrics = dict.fromkeys(("claimed", "reclaimed", "succeeded", "failed", "retried", "lease_lost"), 0)
+
+    def _due(self, now: datetime):
+        return or_(
+            and_(Job.status == "queued", Job.run_after <= now),
+            # leased by a worker that stopped renewing it
+            and_(Job.status == "running", Job.lease_expires_at < now, Job.attempts < Job.max_attempts),
+        )
+
+    async def claim(self, limit: int) -> list[Job]:
+        """Lease up to ``limit`` due jobs for this worker."""
+        now = utcnow()
+        due = self._due(now)
+        claimed, swept = [], []
+        async with self.session_factory() as db:
+            if time.monotonic() - self._swept_at > self.lease:
+                self._swept_at = time.monotonic()
+                # a job that keeps outliving its lease is taking its workers down, stop handing it out
+                stuck = and_(Job.status == "running", Job.lease_expires_at < now, Job.attempts >= Job.max_attempts)
+                for job_id in (await db.execute(select(Job.job_id).where(stuck))).scalars().all():
+                    # a heartbeat may have renewed the lease since, only sweep jobs still stuck
+                    failed = await db.execute(
+                        update(Job)
+                        .where(Job.job_id == job_id, stuck)
+                        .values(status="failed", error="The worker running this job stopped responding",
+                                error_status=500, lease_expires_at=None, finished_at=now)
+                        .execution_options(synchronize_session=False)
+                    )
+                    if failed.rowcount:
+                        swept.append(job_id)
+            candidates = (await db.execute(
+                select(Job.job_id, Job.status).where(due).order_by(Job.run_after).limit(limit)
+            )).all()
+            for job_id, status in candidates:
+                # only one of the workers racing for a job sees it still due
+                leased = await db.execute(
+                    update(Job)
+                    .where(Job.job_id == job_id, due)
+                    .values(status="running", worker_id=self.worker_id, attempts=Job.attempts + 1, started_at=now,
+                            lease_expires_at=now + timedelta(seconds=self.lease))
+                    .execution_options(synchronize_session=False)
+                )
+                if leased.rowcount:
+                    claimed.append(job_id)
+                    self.metrics["reclaimed" if status == "running" else "claimed"] += 1
+            await db.commit()
+            for job_id in swept:
+                await run_in_threadpool(_discard_spool, job_id)
+            if not claimed:
+                return []
+            return list((await db.execute(select(Job).where(Job.job_id.in_(claimed)))).scalars())
+
+    async def _update_owned(self, job_id: str, **values) -> bool:
+        """Update a job this worker still holds the lease on."""
+        async with self.session_factory() as db:
+            result = await db.execute(
+                update(Job)
+                .where(Job.job_id == job_id, Job.worker_id == self.worker_id, Job.status == "running")
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        return bool(result.rowcount)
+
+    async def _heartbeat(self, job_id: str):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                if not await self._update_owned(job_id, lease_expires_at=utcnow() + timedelta(seconds=self.lease)):
+                    return
+            except Exception as e:
+                # the next beat may get through, the lease has room for two misses
+                logger.warning("Could not renew the lease of job %s: %r", job_id, e)
+
+    async def run_job(self, job: Job):
+        heartbeat = asyncio.create_task(self._heartbeat(job.job_id))
+        try:
+            function = HANDLERS.get(job.kind)
+            if function is None:
+                raise JobError(f"No handler registered for job kind '{job.kind}'")
+            if asyncio.iscoroutinefunction(function):
+                result = await function(job.payload)
+            else:
+                result = await run_in_threadpool(function, job.payload)
+            result = jsonable_encoder(result)
+        except Exception as e:
+            error = e if isinstance(e, JobError) else JobError(f"{type(e).__name__}: {e}", retryable=True)
+        else:
+            error = None
+        finally:
+            heartbeat.cancel()
+        if error is not None:
+            await self._failed(job, error)
+        else:
+            await self._finish(job, "succeeded", result=result, error=None, error_status=None)
+
+    async def _finish(self, job: Job, status: str, **values):
+        if await self._update_owned(job.job_id, status=status, lease_expires_at=None, finished_at=utcnow(),
+                                    **values):
+            self.metrics[status] += 1
+            await run_in_threadpool(_discard_spool, job.job_id)
+        else:
+            # another worker has it now and will record its own outcome
+            self.metrics["lease_lost"] += 1
+
+    async def _failed(self, job: Job, error: JobError):
+        logger.warning("Job %s (%s) attempt %d failed: %s", job.job_id, job.kind, job.attempts, error.detail)
+        if not error.retryable or job.attempts >= job.max_attempts:
+            await self._finish(job, "failed", error=error.detail[:3000], error_status=error.status_code)
+            return
+        delay = self.retry_base * 2 ** (job.attempts - 1)
+        if await self._update_owned(job.job_id, status="queued", worker_id=None, lease_expires_at=None,
+                                    run_after=utcnow() + timedelta(seconds=delay),
+                                    error=error.detail[:3000], error_status=error.status_code):
+            self.metrics["retried"] += 1
+        else:
+            self.metrics["lease_lost"] += 1
+
+    async def drain(self) -> int:
+        """Run due jobs until there are none left and return how many ran."""
+        ran = 0
+        while jobs := await self.claim(self.concurrency):
+            await asyncio.gather(*(self.run_job(job) for job in jobs))
+            ran += len(jobs)
+        return ran
+
+    async def purge(self) -> int:
+        """Delete finished jobs older than ``retention``."""
+        async with self.session_factory() as db:
+            result = await db.execute(
+                delete(Job)
+                .where(Job.status.in_(FINISHED), Job.finished_at < utcnow() - timedelta(seconds=self.retention))
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        return result.rowcount
+
+    def wake(self):
+        if self._loop is not None and not self._loop.is_closed() and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _started(self, job: Job):
+        task = asyncio.create_task(self.run_job(job))
+        self._active[job.job_id] = task
+
+        def done(_):
+            self._active.pop(job.job_id, None)
+            self._wakeup.set()
+        task.add_done_callback(done)
+
+    async def run(self):
+        """Lease and run jobs until ``stop()``."""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        _workers.add(self)
+        try:
+            while not self._stopping:
+                self._wakeup.clear()
+                jobs = []
+                free = self.concurrency - len(self._active)
+                if free > 0:
+                    try:
+                        jobs = await self.claim(free)
+                    except Exception as e:
+                        logger.warning("Could not read the job queue: %r", e)
+                for job in jobs:
+                    self._started(job)
+                if time.monotonic() - self._purged_at > min(3600.0, self.retention):
+                    self._purged_at = time.monotonic()
+                    try:
+                        await self.purge()
+                    except Exception as e:
+                        logger.warning("Could not purge finished jobs: %r", e)
+                if not jobs:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                    except TimeoutError:
+                        pass
+        finally:
+            _workers.discard(self)
+
+    def start(self):
+        """Run the worker as a task of the running event loop."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self, grace: float = 10.0):
+        """
+        Stop leasing, give running jobs ``grace`` seconds and cancel the rest;
+        their leases run out and another worker picks them up.
+        """
+        self._stopping = True
+        self.wake()
+        if self._active:
+            _, pending = await asyncio.wait(list(self._active.values()), timeout=grace)
+            for task in pending:
+                task.cancel()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    def snapshot(self) -> dict:
+        return {
+            "worker_id": self.worker_id,
+            "running": self._task is not None and not self._task.done(),
+            "active": len(self._active),
+            "concurrency": self.concurrency,
+            "lease_s": self.lease,
+            **self.metrics,
+        }
+
+
+job_worker = JobWorker(async_sessionlocal, concurrency=jobs_concurrency, lease=jobs_lease,
+                       poll_interval=jobs_poll_interval, retry_base=jobs_retry_base, retention=jobs_retention)
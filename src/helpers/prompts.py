@@ -1,3 +1,10 @@
+# bump a prompt's version whenever its wording changes, cached LLM answers are keyed by it
+PROMPT_VERSIONS = {
+    "vehicle_details_extract_prompt": 1,
+    "claims_damage_report_and_analysis": 1,
+}
+
+
 def vehicle_validator_prompt(vehicle_details: list) -> str:
     return f"""You are a vehicle validation expert.
 
@@ -0,0 +1,162 @@
+import hashlib
+from dataclasses import dataclass
+from itertools import chain
+
+from fastapi import Request, Response # type: ignore
+from fastapi.encoders import jsonable_encoder # type: ignore
+from fastapi.responses import JSONResponse # type: ignore
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.util.concurrency import await_, in_greenlet
+
+from database.model import Claims, Insurable, Policy, User
+from helpers.cache import Cache, MemoryBackend, cache
+from helpers.config import response_cache_ttl
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    etag: str
+    owner_id: int | None = None
+
+    def stored(self) -> dict:
+        # the cache keeps JSON, the body is JSON text already
+        return {"body": self.body.decode(), "etag": self.etag, "owner_id": self.owner_id}
+
+    @classmethod
+    def loaded(cls, stored: dict | None) -> "CachedResponse | None":
+        return None if stored is None else cls(stored["body"].encode(), stored["etag"], stored["owner_id"])
+
+
+def make_etag(*versions) -> str:
+    """Strong ETag over the (kind, id, version) tuples a response was built from."""
+    return '"' + hashlib.blake2b(repr(versions).encode(), digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # weak comparison, as RFC 9110 asks for If-None-Match
+    return any(candidate.strip().removeprefix("W/") == etag for candidate in header.split(","))
+
+
+def _headers(etag: str) -> dict:
+    # the browser may keep it but has to revalidate, which is the cheap 304 below
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+
+def conditional_response(request: Request, entry: CachedResponse) -> Response:
+    """304 when the client already has this version, the cached body otherwise."""
+    if etag_matches(request, entry.etag):
+        return Response(status_code=304, headers=_headers(entry.etag))
+    return Response(content=entry.body, media_type="application/json", headers=_headers(entry.etag))
+
+
+class ResponseCache:
+    """
+    Serialized detail responses keyed by resource, invalidated by tag.
+
+    Entries carry tags such as ``policy:7`` or ``user:3`` naming every row the
+    response was built from; a commit touching one of those rows drops them,
+    on every worker when the cache backend is shared. The TTL bounds how stale
+    an entry written by a request racing that commit can get.
+    """
+
+    def __init__(self, cache: Cache | None = None, ttl: float = 30.0):
+        self.ttl = ttl
+        self._entries = (cache or Cache(MemoryBackend())).namespace("responses", ttl)
+
+    def get(self, key: tuple) -> CachedResponse | None:
+        return CachedResponse.loaded(self._entries.get(key))
+
+    async def aget(self, key: tuple) -> CachedResponse | None:
+        return CachedResponse.loaded(await self._entries.aget(key))
+
+    def put(self, key: tuple, body: bytes, etag: str, tags, owner_id: int | None = None) -> CachedResponse:
+        entry = CachedResponse(body, etag, owner_id)
+        self._entries.set(key, entry.stored(), tags=tags)
+        return entry
+
+    async def aput(self, key: tuple, body: bytes, etag: str, tags, owner_id: int | None = None) -> CachedResponse:
+        entry = CachedResponse(body, etag, owner_id)
+        await self._entries.aset(key, entry.stored(), tags=tags)
+        return entry
+
+    async def arespond(self, request: Request, key: tuple, etag: str, content, tags,
+                       owner_id: int | None = None) -> Response:
+        """
+        Answer from freshly loaded rows: 304 if ``etag`` matches, otherwise serialize
+        ``content()`` once, keep it under ``key`` and return it.
+        """
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers=_headers(etag))
+        body = JSONResponse(jsonable_encoder(content())).body
+        return conditional_response(request, await self.aput(key, body, etag, tags, owner_id))
+
+    def invalidate(self, tags):
+        self._entries.invalidate(tags)
+
+    async def ainvalidate(self, tags):
+        await self._entries.ainvalidate(tags)
+
+    def clear(self):
+        self._entries.invalidate()
+
+    def snapshot(self) -> dict:
+        return self._entries.snapshot()
+
+
+def _values(obj, attribute) -> set:
+    # current value plus the one being replaced, so moving a claim invalidates both policies
+    history = inspect(obj).attrs[attribute].history
+    return {value for value in chain(history.added, history.unchanged, history.deleted) if value is not None}
+
+
+def cache_tags(obj) -> set:
+    """Tags of the cached responses a change to ``obj`` makes stale."""
+    if isinstance(obj, Claims):
+        return {f"claim:{obj.claim_id}", *(f"policy:{p}" for p in _values(obj, "policy_id"))}
+    if isinstance(obj, Insurable):
+        return {f"insurable:{obj.id}", *(f"policy:{p}" for p in _values(obj, "policy_id"))}
+    if isinstance(obj, Policy):
+        return {f"policy:{obj.policy_id}"}
+    if isinstance(obj, User):
+        # policy details embed their holder
+        return {f"user:{obj.user_id}"}
+    return set()
+
+
+def install(session_class, cache: ResponseCache):
+    """Invalidate ``cache`` from the rows each session commits."""
+    # one key per cache, a session can feed several of them
+    info_key = ("response_cache_tags", id(cache))
+
+    @event.listens_for(session_class, "after_flush")
+    def collect_changed(session, flush_context):
+        tags = session.info.setdefault(info_key, set())
+        for obj in chain(session.new, session.dirty, session.deleted):
+            tags.update(cache_tags(obj))
+
+    @event.listens_for(session_class, "after_commit")
+    def invalidate_committed(session):
+        tags = session.info.pop(info_key, None)
+        if not tags:
+            return
+        if in_greenlet():
+            # an AsyncSession commits on the event loop, wait for the backend off it
+            await_(cache.ainvalidate(tags))
+        else:
+            cache.invalidate(tags)
+
+    @event.listens_for(session_class, "after_rollback")
+    def forget_rolled_back(session):
+        session.info.pop(info_key, None)
+
+
+# detail responses, kept until a commit touches one of their rows
+response_cache = ResponseCache(cache, ttl=response_cache_ttl)
+install(Session, response_cache)
@@ -0,0 +1,73 @@
+"""
+Single-flight execution of coroutines.
+
+``SingleFlight.do(key, compute)`` runs ``compute()`` once per key at a time:
+callers that arrive while it runs await the same future instead of starting
+their own. Unlike a cache nothing is kept once the call finishes, so it also
+spares duplicate work the first time, and for callers that bypass a cache.
+Flights are per event loop and per process.
+"""
+import asyncio
+import threading
+
+
+class SingleFlight:
+    def __init__(self):
+        self._futures: dict = {}
+        self._lock = threading.Lock()
+        self.metrics = dict.fromkeys(("flights", "shared", "shared_failures"), 0)
+
+    def _count(self, metric: str):
+        with self._lock:
+            self.metrics[metric] += 1
+
+    async def do(self, key, compute):
+        """
+        ``(value, shared)``: the result of ``compute()`` for ``key`` and whether
+        it came from a call another caller started. The leader's exception is
+        raised to every caller; if the leader is cancelled, a waiting caller
+        takes over instead.
+        """
+        loop = asyncio.get_running_loop()
+        flight = (id(loop), key)
+        while True:
+            with self._lock:
+                future = self._futures.get(flight)
+                leader = future is None
+                if leader:
+                    future = self._futures[flight] = loop.create_future()
+            if leader:
+                break
+            try:
+                value = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if future.cancelled() and not asyncio.current_task().cancelling():
+                    continue
+                raise
+            except BaseException:
+                self._count("shared_failures")
+                raise
+            self._count("shared")
+            return value, True
+
+        self._count("flights")
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # nobody may be waiting, don't let asyncio report it as never retrieved
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            return value, False
+        finally:
+            with self._lock:
+                self._futures.pop(flight, None)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"in_flight": len(self._futures), **self.metrics}
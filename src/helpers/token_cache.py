@@ -0,0 +1,82 @@
+import asyncio
+import hashlib
+import time
+
+from helpers.cache import Cache
+
+
+def token_digest(token: str) -> str:
+    # the raw JWT never becomes a cache key, only its digest
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class TokenCache:
+    """
+    Verified JWT claims on the shared cache, keyed by token digest.
+
+    An entry lives until the token's ``exp`` (capped at ``max_ttl`` seconds) so
+    a cached token is never accepted past its expiry. ``revoke`` drops a token
+    and remembers it until it would have expired anyway, for logout. With a
+    shared backend a logout on one worker is seen by all of them; revocations
+    are evicted like any other entry, so they are best effort either way.
+
+    ``alookup`` reads a token's claims together with its revocation, so an
+    entry cached before a logout, or by a request that verified the token
+    while the logout happened, is never served for a revoked token.
+    """
+
+    def __init__(self, cache: Cache, max_ttl: float = 300.0):
+        self.max_ttl = max_ttl
+        self._claims = cache.namespace("auth.claims")
+        self._revoked = cache.namespace("auth.revoked")
+
+    def get(self, token: str) -> dict | None:
+        return self._claims.get(token_digest(token))
+
+    def put(self, token: str, claims: dict, exp: float):
+        ttl = min(exp - time.time(), self.max_ttl)
+        if ttl > 0:
+            self._claims.set(token_digest(token), claims, ttl)
+
+    def revoke(self, token: str, exp: float):
+        key = token_digest(token)
+        self._claims.delete(key)
+        ttl = exp - time.time()
+        if ttl > 0:
+            self._revoked.set(key, True, ttl)
+
+    def is_revoked(self, token: str) -> bool:
+        return self._revoked.get(token_digest(token), False)
+
+    # the same for the request handlers, without blocking the event loop on the backend
+
+    async def aget(self, token: str) -> dict | None:
+        return await self._claims.aget(token_digest(token))
+
+    async def alookup(self, token: str) -> tuple[dict | None, bool]:
+        """The cached claims of ``token`` and whether it was revoked."""
+        key = token_digest(token)
+        claims, revoked = await asyncio.gather(self._claims.aget(key), self._revoked.aget(key, False))
+        return claims, revoked
+
+    async def aput(self, token: str, claims: dict, exp: float):
+        ttl = min(exp - time.time(), self.max_ttl)
+        if ttl > 0:
+            await self._claims.aset(token_digest(token), claims, ttl)
+
+    async def arevoke(self, token: str, exp: float):
+        key = token_digest(token)
+        ttl = exp - time.time()
+        if ttl > 0:
+            await self._revoked.aset(key, True, ttl)
+        await self._claims.adelete(key)
+
+    async def ais_revoked(self, token: str) -> bool:
+        return await self._revoked.aget(token_digest(token), False)
+
+    def clear(self):
+        self._claims.invalidate()
+        self._revoked.invalidate()
+
+    def snapshot(self) -> dict:
+        return {"claims": self._claims.snapshot(), "revoked": self._revoked.snapshot()}
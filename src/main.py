@@ -1,9 +1,15 @@
 from fastapi import FastAPI   # type: ignore
 import database.model as model
-from database.database import engine,sessionlocal
-from routers import auth, policy, vehicle, user, llmRoute, claims, insurables, assets
+from database.database import engine,sessionlocal, async_engine, slow_query_log
+from database import query_stats, slow_query
+from database.schema import check_schema_version
+from routers import auth, policy, vehicle, user, llmRoute, claims, insurables, assets, internal, jobs
 from fastapi.middleware.cors import CORSMiddleware #type: ignore
-from helpers.config import origins
+from helpers.config import origins, db_query_stats, db_n_plus_one_threshold, jobs_in_process
+from helpers.pagination import NEXT_CURSOR_HEADER
+from helpers.availability import user_availability
+from AI_ML.gemini import gemini
+from helpers.jobs import job_worker
 from database.model import User
 # import os
 from helpers.config import admin_username, admin_password, PROFILE_UPLOAD_DIR
@@ -24,8 +30,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag", query_stats.QUERY_COUNT_HEADER, "Server-Timing"],
 )
 
+if db_query_stats:
+    query_stats.install(engine, async_engine.sync_engine)
+    app.add_middleware(query_stats.QueryStatsMiddleware, n_plus_one_threshold=db_n_plus_one_threshold)
+
+if slow_query_log is not None:
+    app.add_middleware(slow_query.RequestScopeMiddleware)
+
 app.include_router(user.router)
 
 app.include_router(policy.router)
@@ -40,10 +54,11 @@ app.include_router(claims.router)
 
 app.include_router(llmRoute.router)
 
-app.include_router(auth.router)
+app.include_router(jobs.router)
 
+app.include_router(auth.router)
 
-model.Base.metadata.create_all(bind=engine) # type: ignore
+app.include_router(internal.router)
 
 
 def init_admin():
@@ -79,10 +94,33 @@ def init_admin():
 # Call admin init at startup
 @app.on_event("startup")
 def on_startup():
+    # schema changes are applied with `alembic upgrade head`, never at import
+    check_schema_version(engine)
     init_admin()
+    # configured once per worker, every LLM call reuses it
+    gemini.start()
+
+
 
 
 
 
 
 
+@app.on_event("startup")
+async def warm_user_availability():
+    # the first availability check of the registration form shouldn't pay for the table scan
+    await user_availability.refresh()
+
+
+@app.on_event("startup")
+async def start_job_worker():
+    # LLM calls and document conversions queued by the endpoints, unless a separate
+    # `python -m helpers.job_worker work` process runs them
+    if jobs_in_process:
+        job_worker.start()
+
+
+@app.on_event("shutdown")
+async def stop_job_worker():
+    await job_worker.stop()
@@ -0,0 +1,124 @@
+"""baseline schema
+
+The tables as they were created by ``Base.metadata.create_all`` before
+migrations existed. Databases created that way should be stamped with
+``alembic stamp 0001`` instead of running this revision.
+
+Revision ID: 0001
+Revises:
+Create Date: 2025-10-18 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "users",
+        sa.Column("user_id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("usertype", sa.String(length=15), nullable=False),
+        sa.Column("username", sa.String(length=20), nullable=False),
+        sa.Column("firstname", sa.String(length=50), nullable=False),
+        sa.Column("middlename", sa.String(length=50), nullable=True),
+        sa.Column("lastname", sa.String(length=50), nullable=False),
+        sa.Column("hashed_password", sa.String(length=255), nullable=False),
+        sa.Column("dateofbirth", sa.Date(), nullable=False),
+        sa.Column("phone", sa.String(length=15), nullable=True),
+        sa.Column("email", sa.String(length=155), nullable=False),
+        sa.Column("profile_pic", sa.String(length=255), nullable=True),
+        sa.Column("status", sa.String(length=20), nullable=False),
+        sa.Column("address", sa.String(length=400), nullable=True),
+        sa.CheckConstraint("usertype IN ('user', 'agent', 'admin')", name="user_type_check"),
+        sa.CheckConstraint("status IN ('active', 'inactive')", name="user_status_check"),
+        sa.PrimaryKeyConstraint("user_id"),
+        sa.UniqueConstraint("email"),
+        sa.UniqueConstraint("phone"),
+        sa.UniqueConstraint("username"),
+    )
+    op.create_table(
+        "policies",
+        sa.Column("policy_id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("policy_number", sa.String(length=50), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=True),
+        sa.Column("start_date", sa.Date(), nullable=False),
+        sa.Column("end_date", sa.Date(), nullable=False),
+        sa.Column("premium", sa.Float(), nullable=False),
+        sa.Column("coverage_amount", sa.Float(), nullable=False),
+        sa.Column("status", sa.String(length=20), nullable=False),
+        sa.CheckConstraint("status IN ('active', 'inactive', 'expired', 'under-review')", name="policy_status_check"),
+        sa.ForeignKeyConstraint(["user_id"], ["users.user_id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("policy_id"),
+        sa.UniqueConstraint("policy_number"),
+    )
+    op.create_table(
+        "insurable",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("type", sa.String(length=20), nullable=False),
+        sa.Column("policy_id", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["policy_id"], ["policies.policy_id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "vehicles",
+        sa.Column("vehicle_id", sa.Integer(), nullable=False),
+        sa.Column("typeofvehicle", sa.String(length=20), nullable=False),
+        sa.Column("make", sa.String(length=50), nullable=False),
+        sa.Column("model", sa.String(length=50), nullable=False),
+        sa.Column("year_of_purchase", sa.Integer(), nullable=False),
+        sa.Column("vin", sa.String(length=100), nullable=False),
+        sa.Column("image_path", sa.String(length=500), nullable=True),
+        sa.Column("vehicle_no", sa.String(length=100), nullable=False),
+        sa.Column("damage_report", sa.String(length=3000), nullable=True),
+        sa.ForeignKeyConstraint(["vehicle_id"], ["insurable.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("vehicle_id"),
+        sa.UniqueConstraint("vin"),
+    )
+    op.create_table(
+        "claims",
+        sa.Column("claim_id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("policy_id", sa.Integer(), nullable=False),
+        sa.Column("subject_id", sa.Integer(), nullable=False),
+        sa.Column("claim_number", sa.String(length=50), nullable=False),
+        sa.Column("damage_description_user", sa.String(length=3000), nullable=False),
+        sa.Column("damage_description_llm", sa.String(length=3000), nullable=False),
+        sa.Column("severity_level", sa.String(length=20), nullable=False),
+        sa.Column("damage_percentage", sa.Float(), nullable=False),
+        sa.Column("damage_image_path", sa.String(length=500), nullable=False),
+        sa.Column("date_of_incident", sa.Date(), nullable=False),
+        sa.Column("location_of_incident", sa.String(length=100), nullable=False),
+        sa.Column("documents_path", sa.String(length=1000), nullable=True),
+        sa.Column("fir_no", sa.String(length=100), nullable=True),
+        sa.Column("claim_date", sa.Date(), nullable=True),
+        sa.Column("remarks", sa.String(length=3000), nullable=True),
+        sa.Column("approvable_reason", sa.String(length=3000), nullable=True),
+        sa.Column("requested_amount", sa.Float(), nullable=False),
+        sa.Column("approvable_amount", sa.Float(), nullable=True),
+        sa.Column("approved_amount", sa.Float(), nullable=True),
+        sa.Column("claim_status", sa.String(length=20), nullable=False),
+        sa.CheckConstraint("claim_status IN ('in-review', 'accepted', 'rejected')", name="claim_status_check"),
+        sa.CheckConstraint("severity_level IN ('Low', 'Moderate', 'High', 'Critical')", name="severity_level_check"),
+        sa.ForeignKeyConstraint(["policy_id"], ["policies.policy_id"]),
+        sa.ForeignKeyConstraint(["subject_id"], ["insurable.id"]),
+        sa.PrimaryKeyConstraint("claim_id"),
+        sa.UniqueConstraint("claim_number"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("claims")
+    op.drop_table("vehicles")
+    op.drop_table("insurable")
+    op.drop_table("policies")
+    op.drop_table("users")
@@ -0,0 +1,40 @@
+"""hot path indexes
+
+Indexes for the per-user and per-policy lookups done by the list
+endpoints. ``(user_id, status)`` also serves plain ``user_id`` lookups.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2025-10-18 09:05:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, Sequence[str], None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index("ix_policies_user_id_status", "policies", ["user_id", "status"])
+    op.create_index("ix_policies_status", "policies", ["status"])
+    op.create_index("ix_claims_policy_id", "claims", ["policy_id"])
+    op.create_index("ix_claims_subject_id", "claims", ["subject_id"])
+    op.create_index("ix_insurable_policy_id", "insurable", ["policy_id"])
+    op.create_index("ix_vehicles_vehicle_no", "vehicles", ["vehicle_no"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_vehicles_vehicle_no", table_name="vehicles")
+    op.drop_index("ix_insurable_policy_id", table_name="insurable")
+    op.drop_index("ix_claims_subject_id", table_name="claims")
+    op.drop_index("ix_claims_policy_id", table_name="claims")
+    op.drop_index("ix_policies_status", table_name="policies")
+    op.drop_index("ix_policies_user_id_status", table_name="policies")
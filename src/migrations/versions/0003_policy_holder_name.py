@@ -0,0 +1,59 @@
+"""policy holder name
+
+Denormalized copy of the policy holder's full name so policy listings
+don't have to load the owning user per row.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2025-10-18 09:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, Sequence[str], None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+users = sa.table(
+    "users",
+    sa.column("user_id", sa.Integer),
+    sa.column("firstname", sa.String),
+    sa.column("middlename", sa.String),
+    sa.column("lastname", sa.String),
+)
+policies = sa.table(
+    "policies",
+    sa.column("user_id", sa.Integer),
+    sa.column("holder_name", sa.String),
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table("policies") as batch_op:
+        batch_op.add_column(sa.Column("holder_name", sa.String(length=152), nullable=True))
+
+    # name concatenation differs per dialect, so build the names here
+    conn = op.get_bind()
+    rows = conn.execute(sa.select(users.c.user_id, users.c.firstname, users.c.middlename, users.c.lastname))
+    names = [
+        {"uid": user_id, "name": " ".join(filter(None, [first, middle, last]))}
+        for user_id, first, middle, last in rows
+    ]
+    if names:
+        conn.execute(
+            policies.update().where(policies.c.user_id == sa.bindparam("uid")).values(holder_name=sa.bindparam("name")),
+            names,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("policies") as batch_op:
+        batch_op.drop_column("holder_name")
@@ -0,0 +1,30 @@
+"""claim status index
+
+Lets the paginated claim listing filtered by status seek straight to a
+page instead of scanning every claim in that status.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2025-10-18 09:15:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, Sequence[str], None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index("ix_claims_claim_status_claim_id", "claims", ["claim_status", "claim_id"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_claims_claim_status_claim_id", table_name="claims")
@@ -0,0 +1,74 @@
+"""json path columns
+
+Vehicle image paths and claim image/document paths become JSON columns.
+Older rows were written with str(dict) (single quotes) rather than JSON,
+so every row is rewritten as JSON text before the type changes.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2025-10-18 09:20:00.000000
+
+"""
+import ast
+import json
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0005"
+down_revision: Union[str, Sequence[str], None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# table -> (primary key, path columns and their old length and nullability)
+PATH_COLUMNS = {
+    "vehicles": ("vehicle_id", [("image_path", 500, True)]),
+    "claims": ("claim_id", [("damage_image_path", 500, False), ("documents_path", 1000, True)]),
+}
+
+
+def to_json(raw):
+    if raw is None or raw in ("", "null"):
+        return None
+    try:
+        value = json.loads(raw)
+    except ValueError:
+        try:
+            value = ast.literal_eval(raw)
+        except (ValueError, SyntaxError):
+            # a bare path, keep it rather than drop it
+            value = {"0": raw}
+    return json.dumps(value)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    conn = op.get_bind()
+    for table_name, (pk, columns) in PATH_COLUMNS.items():
+        names = [name for name, _, _ in columns]
+        table = sa.table(table_name, sa.column(pk, sa.Integer), *(sa.column(name, sa.String) for name in names))
+        rows = conn.execute(sa.select(table.c[pk], *(table.c[name] for name in names)))
+        updates = []
+        for row in rows:
+            converted = {name: to_json(row[i + 1]) for i, name in enumerate(names)}
+            if any(converted[name] != row[i + 1] for i, name in enumerate(names)):
+                updates.append({"pk_": row[0], **converted})
+        if updates:
+            conn.execute(table.update().where(table.c[pk] == sa.bindparam("pk_")), updates)
+
+        with op.batch_alter_table(table_name) as batch_op:
+            for name, length, nullable in columns:
+                batch_op.alter_column(name, existing_type=sa.String(length=length), type_=sa.JSON(),
+                                      existing_nullable=nullable, postgresql_using=f"{name}::json")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table_name, (_, columns) in PATH_COLUMNS.items():
+        with op.batch_alter_table(table_name) as batch_op:
+            for name, length, nullable in columns:
+                batch_op.alter_column(name, existing_type=sa.JSON(), type_=sa.String(length=length),
+                                      existing_nullable=nullable)
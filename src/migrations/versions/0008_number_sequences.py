@@ -0,0 +1,42 @@
+"""number sequences
+
+Per-day counters behind policy and claim numbers. A counter row is created
+on first use and seeded from the highest number already issued that day,
+so this revision copies no data.
+
+Earlier builds created the table in 0001; databases migrated by them
+already have it and keep it as is.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2025-10-19 10:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0008"
+down_revision: Union[str, Sequence[str], None] = "0007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if sa.inspect(op.get_bind()).has_table("number_sequences"):
+        return
+    op.create_table(
+        "number_sequences",
+        sa.Column("name", sa.String(length=30), nullable=False),
+        sa.Column("last_value", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("name"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("number_sequences")
@@ -0,0 +1,37 @@
+"""user updated at
+
+When each user was last inserted or updated. The username/email/phone
+availability filters of every worker pick up users changed elsewhere by it.
+Existing rows get the time of the migration.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2025-10-19 10:15:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0009"
+down_revision: Union[str, Sequence[str], None] = "0008"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.add_column(sa.Column("updated_at", sa.DateTime(), nullable=False,
+                                      server_default=sa.func.current_timestamp()))
+        batch_op.create_index("ix_users_updated_at", ["updated_at"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("users") as batch_op:
+        batch_op.drop_index("ix_users_updated_at")
+        batch_op.drop_column("updated_at")
@@ -2,7 +2,8 @@ from typing import Annotated
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 from starlette import status
-from database.database import db_dependency
+from sqlalchemy import select
+from database.database import async_db_dependency
 from database.model import Vehicle, Policy
 from routers.auth import get_current_user
 
@@ -15,12 +16,14 @@ class AssetResponse(BaseModel):
     policy_number: str
 
 @router.get("/assets", response_model=list[AssetResponse])
-async def get_assets(user: user_dependency, db: db_dependency):
+async def get_assets(user: user_dependency, db: async_db_dependency):
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
     
     # Join Vehicle and Policy tables to get assets with policy numbers
-    assets = db.query(Vehicle, Policy).join(Policy, Vehicle.policy_id == Policy.policy_id).all()
+    assets = (await db.execute(
+        select(Vehicle, Policy).join(Policy, Vehicle.policy_id == Policy.policy_id)
+    )).all()
     
     return [
         AssetResponse(
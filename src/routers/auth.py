@@ -2,7 +2,9 @@ from datetime import timedelta, datetime, timezone
 from fastapi import APIRouter, Depends, HTTPException, status, Response, Request # type: ignore
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer #type: ignore
 from pydantic import BaseModel# type: ignore
-from database.database import db_dependency
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool #type: ignore
+from database.database import async_db_dependency
 from database.model import User
 
 from typing import Annotated
@@ -11,22 +13,28 @@ from json import load
 from passlib.context import CryptContext #type: ignore
 from jose import jwt #type: ignore
 from jose.exceptions import JWTError #type: ignore
-from helpers.config import secret_key, algorithm
+from helpers.cache import cache
+from helpers.config import secret_key, algorithm, token_cache_ttl
+from helpers.token_cache import TokenCache
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
 
 bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl = 'auth/token')
+# the dashboard sends the same cookie on every call of a page load, verify it once
+token_cache = TokenCache(cache, max_ttl=token_cache_ttl)
 
 class Token(BaseModel):
     access_token:str
     token_type:str
 
-def authenticate_user(db, username: str, password: str):
-    user= db.query(User).filter((User.username == username) | (User.email == username)).first()
+async def authenticate_user(db, username: str, password: str):
+    result = await db.execute(select(User).where((User.username == username) | (User.email == username)))
+    user = result.scalars().first()
     if not user:
         return False
-    if not bcrypt_context.verify(password, user.hashed_password):
+    # bcrypt is deliberately slow, keep it off the event loop
+    if not await run_in_threadpool(bcrypt_context.verify, password, user.hashed_password):
         return False
     return user
 
@@ -44,6 +52,13 @@ async def get_current_user(request: Request):
         raise HTTPException(status_code=401, detail="Not authenticated")
     # print("Decoded token source:", "Authorization header" if token else "Cookie")
     # print("Raw token:", raw_token)
+    claims, revoked = await token_cache.alookup(raw_token)
+    # before the cached claims too: a logout on any worker ends the token now, not when its entry expires
+    if revoked:
+        raise HTTPException(status_code = status.HTTP_401_UNAUTHORIZED,
+                            detail='Could not validete user')
+    if claims is not None:
+        return dict(claims)
     try:
         payload = jwt.decode(raw_token, secret_key, algorithms=[algorithm])
         username = payload.get('sub')
@@ -52,7 +67,9 @@ async def get_current_user(request: Request):
         if username is None or user_id is None or role is None:
             raise HTTPException(status_code = status.HTTP_401_UNAUTHORIZED,
                                 detail='Could not validete user')
-        return {'username': username, 'user_id': user_id, 'role': role }
+        claims = {'username': username, 'user_id': user_id, 'role': role }
+        await token_cache.aput(raw_token, claims, payload['exp'])
+        return dict(claims)
     except JWTError:
         raise HTTPException(status_code = status.HTTP_401_UNAUTHORIZED,
                                 detail='Could not validete user')
@@ -60,11 +77,11 @@ async def get_current_user(request: Request):
 @router.post("/token")
 async def auth(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-    db: db_dependency,
+    db: async_db_dependency,
     response: Response,
     remember: bool = False
 ):
-    user = authenticate_user(db , form_data.username, form_data.password)
+    user = await authenticate_user(db , form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -107,7 +124,13 @@ async def read_users_me(current_user: dict = Depends(get_current_user)):
     return current_user
 
 @router.post("/logout")
-async def logout(response: Response):
-
+async def logout(request: Request, response: Response):
+    raw_token = request.cookies.get("access_token_fnol")
+    if raw_token:
+        # the JWT stays valid until exp, refuse it from now on
+        try:
+            await token_cache.arevoke(raw_token, jwt.get_unverified_claims(raw_token).get('exp', 0))
+        except JWTError:
+            pass
     response.delete_cookie("access_token_fnol")
     return {"message": "Logged out successfully"}
\ No newline at end of file
@@ -1,18 +1,22 @@
 from pathlib import Path
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File # type: ignore
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Query, Request, Response # type: ignore
 from pydantic import BaseModel
 from starlette import status# type: ignore
 
 from typing import Annotated, List, Optional, Literal
 from datetime import date
 
-from database.database import db_dependency
+from sqlalchemy import select, inspect
+from sqlalchemy.orm import undefer_group
+from database.database import async_db_dependency
 from database.model import Claims
 from helpers.config import basic_user, privilaged_user, administrator
-from helpers.file_handlers import Load
+from helpers.file_handlers import Load, PathMap
+from helpers.pagination import KeysetPager, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from helpers.fields import FieldSet
+from helpers.response_cache import response_cache, conditional_response, make_etag
 from fastapi.responses import FileResponse #type: ignore
 from routers.auth import get_current_user
-import json
 
 router = APIRouter(prefix="/claims", tags=["claims"])
 user_dependency = Annotated[dict, Depends(get_current_user)]
@@ -25,10 +29,10 @@ class ClaimsRequest(BaseModel):
     damage_description_llm: str
     severity_level: Literal["Low", "Moderate", "High", "Critical"]
     damage_percentage: float
-    damage_image_path: Optional[str] = None
+    damage_image_path: Optional[PathMap] = None
     date_of_incident: date
     location_of_incident: Optional[str] = None
-    documents_path: Optional[str] = None
+    documents_path: Optional[PathMap] = None
     fir_no: Optional[str] = None
     claim_date: Optional[date] = None
     remarks: Optional[str] = None
@@ -44,34 +48,15 @@ class ClaimsRequest(BaseModel):
 class ClaimsResponse(ClaimsRequest):
     claim_number: str
     claim_id:int
-    damage_image_path: Optional[dict] = None       # ✅ parsed dict in response #type:ignore
-    documents_path: Optional[dict] = None #type:ignore
-
-    @classmethod
-    def from_orm(cls, obj):
-        data = obj.__dict__.copy()
-
-        # Convert string -> dict safely
-        for field in ["damage_image_path", "documents_path"]:
-            raw_value = data.get(field)
-            if raw_value:
-                try:
-                    data[field] = json.loads(raw_value)
-                except Exception:
-                    data[field] = None
-            else:
-                data[field] = None
-
-        return super().model_validate(data)
 
 class ClaimUpdateRequest(BaseModel):
     damage_description_user: Optional[str] = None
     severity_level: Optional[Literal["Low", "Moderate", "High", "Critical"]] = None
     damage_percentage: Optional[float] = None
-    damage_image_path: Optional[str] = None
+    damage_image_path: Optional[PathMap] = None
     date_of_incident: Optional[date]=None
     location_of_incident: Optional[str] = None
-    documents_path: Optional[str] = None
+    documents_path: Optional[PathMap] = None
     fir_no: Optional[str] = None
     claim_date: Optional[date] = None
     remarks: Optional[str] = None
@@ -79,41 +64,97 @@ class ClaimUpdateRequest(BaseModel):
     requested_amount: Optional[float] = None
     approvable_amount: Optional[float] = None
     claim_status: Optional[Literal['in-review', 'accepted', 'rejected']] = None
+
+CLAIM_SORTS = {
+    "claim_id": Claims.claim_id,
+    "date_of_incident": Claims.date_of_incident,
+    "requested_amount": Claims.requested_amount,
+}
+CLAIM_FIELDS = {attr.key: getattr(Claims, attr.key) for attr in inspect(Claims).column_attrs}
 # ------------------------------------------- RBAC Implemented ------------------------------------------------------
 @router.get("/claim_details")
-async def read_all_claims(user: user_dependency, db: db_dependency):
+async def read_all_claims(
+    user: user_dependency,
+    db: async_db_dependency,
+    response: Response,
+    claim_status: Optional[Literal['in-review', 'accepted', 'rejected']] = Query(None, alias="status"),
+    severity: Optional[Literal["Low", "Moderate", "High", "Critical"]] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    user_id: Optional[int] = None,
+    policy_id: Optional[int] = None,
+    sort: str = "claim_id",
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    """
+    One page of claims, the cursor for the next page is returned in the X-Next-Cursor header.
+    date_from/date_to bound date_of_incident, user_id is only honoured for agents and admins.
+    The long free-text columns are left out unless named in fields=.
+    """
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid credentials"
         )
+    stmt = select(Claims)
     role = user.get('role')
-    if role in privilaged_user:        
-        claims = db.query(Claims).all()
-        if not claims:
-            raise HTTPException(status_code=404, detail="No claims found")   
-        return claims
-            
+    if role in privilaged_user:
+        if user_id is not None:
+            stmt = stmt.where(Claims.policy.has(user_id=user_id))
     elif role in basic_user:
-        user_id = user.get("user_id")
-        claims = db.query(Claims).filter(Claims.policy.has(user_id=user_id)).all()
-        if not claims:
-            raise HTTPException(status_code=404, detail="No claims found")   
-        return claims
+        stmt = stmt.where(Claims.policy.has(user_id=user.get("user_id")))
+    else:
+        return None
+
+    if claim_status is not None:
+        stmt = stmt.where(Claims.claim_status == claim_status)
+    if severity is not None:
+        stmt = stmt.where(Claims.severity_level == severity)
+    if date_from is not None:
+        stmt = stmt.where(Claims.date_of_incident >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(Claims.date_of_incident <= date_to)
+    if policy_id is not None:
+        stmt = stmt.where(Claims.policy_id == policy_id)
+
+    pager = KeysetPager(sort, CLAIM_SORTS, Claims.claim_id)
+    fieldset = FieldSet(fields, CLAIM_FIELDS)
+    stmt = fieldset.apply(pager.apply(stmt, cursor, limit), *pager.columns)
+    claims = pager.page((await db.execute(stmt)).scalars().all(), limit, response)
+    if not claims:
+        raise HTTPException(status_code=404, detail="No claims found")
+    return fieldset.render(claims, response)
 
 # ---------------------------------------------------------------------------------------------------------------
 @router.get("/claim_details/{claim_id}")
-async def read_claim(db: db_dependency, claim_id: int):
-    claim = db.query(Claims).filter(Claims.claim_id == claim_id).first()
-    if claim is not None:
-        return claim
-    raise HTTPException(status_code=404, detail="Claim not found")
+async def read_claim(db: async_db_dependency, request: Request, response: Response, claim_id: int,
+                     fields: Optional[str] = None):
+    """The whole claim is served from the response cache and honours If-None-Match."""
+    fieldset = FieldSet(fields, CLAIM_FIELDS)
+    if fields:
+        claim = (await db.execute(fieldset.apply(select(Claims).where(Claims.claim_id == claim_id)))).scalars().first()
+        if claim is None:
+            raise HTTPException(status_code=404, detail="Claim not found")
+        return fieldset.render(claim, response)
+
+    cached = await response_cache.aget(("claim", claim_id))
+    if cached is not None:
+        return conditional_response(request, cached)
+    claim = (await db.execute(
+        select(Claims).options(undefer_group("claim_text")).where(Claims.claim_id == claim_id)
+    )).scalars().first()
+    if claim is None:
+        raise HTTPException(status_code=404, detail="Claim not found")
+    return await response_cache.arespond(request, ("claim", claim_id), make_etag(("claim", claim_id, claim.version)),
+                                         lambda: claim, tags={f"claim:{claim_id}"})
 
 @router.post("/claim_details", status_code=status.HTTP_201_CREATED)
-async def create_claim(db: db_dependency, claim_request: ClaimsRequest):
+async def create_claim(db: async_db_dependency, claim_request: ClaimsRequest):
     claim_model = Claims(**claim_request.model_dump())
     db.add(claim_model)
-    db.commit()
+    await db.commit()
     return {"message": "Claim created successfully"}
 
 @router.post("/upload_claim_images")
@@ -138,11 +179,13 @@ async def upload_documents(folder_name: str, documents: List[UploadFile] = File(
         res[str(idx)] = url
     return {
         "message": f"{len(saved_paths)} documents uploaded successfully",
-        "paths": str(res)
+        "paths": res
     }
 @router.put("/claim_details/{claim_id}", status_code=status.HTTP_200_OK)
-async def update_claim(db: db_dependency, claim_id: int, claim_request: ClaimUpdateRequest):
-    claim = db.query(Claims).filter(Claims.claim_id == claim_id).first()
+async def update_claim(db: async_db_dependency, claim_id: int, claim_request: ClaimUpdateRequest):
+    claim = (await db.execute(
+        select(Claims).options(undefer_group("claim_text")).where(Claims.claim_id == claim_id)
+    )).scalars().first()
     if not claim:
         raise HTTPException(status_code=404, detail="Claim not found")
 
@@ -151,23 +194,23 @@ async def update_claim(db: db_dependency, claim_id: int, claim_request: ClaimUpd
     for key, value in update_data.items():
         setattr(claim, key, value)
 
-    db.commit()
-    db.refresh(claim)  # ✅ optional: return updated object
+    await db.commit()
+    await db.refresh(claim, attribute_names=list(CLAIM_FIELDS))  # ✅ optional: return updated object, deferred text included
 
     return {"message": "Claim updated successfully", "claim": claim}
 
 @router.delete("/claim_details/{claim_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_claim(db: db_dependency, claim_id: int):
-    claim = db.query(Claims).filter(Claims.claim_id == claim_id).first()
+async def delete_claim(db: async_db_dependency, claim_id: int):
+    claim = (await db.execute(select(Claims).where(Claims.claim_id == claim_id))).scalars().first()
     if not claim:
         raise HTTPException(status_code=404, detail="Claim not found")
     
-    db.delete(claim)
-    db.commit()
+    await db.delete(claim)
+    await db.commit()
     return {"message": "Claim deleted successfully"}
 
 @router.get("/files")
-async def get_damage_images(db: db_dependency, path):
+async def get_damage_images(db: async_db_dependency, path):
     return FileResponse(Path(path))  
 
 
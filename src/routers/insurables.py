@@ -1,12 +1,15 @@
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File # type: ignore
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Query, Response # type: ignore
 from pydantic import BaseModel
 from datetime import date
 from starlette import status # type: ignore
 from typing import Annotated, Optional, Literal, Union
-from database.model import Insurable
+from sqlalchemy import select
+from sqlalchemy.orm import contains_eager
+from database.model import Insurable, Policy
 from routers.auth import get_current_user
-from database.database import db_dependency
+from database.database import async_db_dependency
 from helpers.config import basic_user, privilaged_user, administrator
+from helpers.pagination import KeysetPager, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 
 
 router = APIRouter(prefix="/insurables", tags=["insurables"])
@@ -21,31 +24,53 @@ class InsurableResponse(BaseModel):
         "from_attributes": True
     }
 @router.get("/get_id")
-async def get_asset_id(user: user_dependency, db:db_dependency, policy_id: int):
+async def get_asset_id(user: user_dependency, db:async_db_dependency, policy_id: int):
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
-    asset_ids_query = db.query(Insurable.id).filter(Insurable.policy_id == policy_id).all()
+    asset_ids_query = (await db.execute(select(Insurable.id).where(Insurable.policy_id == policy_id))).all()
     # Convert list of tuples [(1,), (2,)] to [1, 2]
     asset_ids = [aid[0] for aid in asset_ids_query]
     if asset_ids == []:
         raise HTTPException(status_code=404, detail="No assets found")
     return asset_ids
 
+ASSET_SORTS = {
+    "id": Insurable.id,
+}
+
 @router.get("/assets", response_model=list[InsurableResponse])
-async def read_assets(user: user_dependency, db: db_dependency):
+async def read_assets(
+    user: user_dependency,
+    db: async_db_dependency,
+    response: Response,
+    type: Optional[str] = None,
+    policy_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    sort: str = "id",
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+):
+    """One page of assets, the cursor for the next page is returned in the X-Next-Cursor header."""
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
 
+    # policy_number comes from the same joined row, not one policy lookup per asset
+    stmt = select(Insurable).join(Insurable.policy).options(contains_eager(Insurable.policy))
+
     # Privileged users: see all assets
     if user.get("role") in privilaged_user:
-        assets = db.query(Insurable).all()
+        if user_id is not None:
+            stmt = stmt.where(Policy.user_id == user_id)
     else:
         # Basic user: see only their own assets
-        assets = (
-            db.query(Insurable)
-            .filter(Insurable.policy.has(user_id=user.get("user_id")))
-            .all()
-        )
+        stmt = stmt.where(Policy.user_id == user.get("user_id"))
+    if type is not None:
+        stmt = stmt.where(Insurable.type == type)
+    if policy_id is not None:
+        stmt = stmt.where(Insurable.policy_id == policy_id)
+
+    pager = KeysetPager(sort, ASSET_SORTS, Insurable.id)
+    assets = pager.page((await db.execute(pager.apply(stmt, cursor, limit))).scalars().all(), limit, response)
 
     if not assets:
         raise HTTPException(status_code=404, detail="No assets found")
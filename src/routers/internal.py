@@ -0,0 +1,112 @@
+from typing import Annotated
+from fastapi import APIRouter, HTTPException, Depends # type: ignore
+from starlette import status # type: ignore
+
+from database.database import engine, async_engine, async_db_dependency
+from database.pool import pool_status
+from AI_ML.agents import resilience_snapshot
+from AI_ML.assessor import assessor_snapshot
+from AI_ML.damage_predictor import damage_batcher, damage_classifier
+from AI_ML.gemini import gemini
+from AI_ML.llm_cache import llm_cache, single_flight_snapshot
+from AI_ML.preprocess import image_snapshot
+from AI_ML.quality import quality_snapshot
+from helpers.availability import user_availability
+from helpers.cache import cache
+from helpers.config import administrator
+from helpers.jobs import job_worker, queue_status
+from helpers.response_cache import response_cache
+from routers.auth import get_current_user, token_cache
+
+router = APIRouter(prefix="/internal", tags=["internal"])
+user_dependency = Annotated[dict, Depends(get_current_user)]
+
+
+def require_admin(user: dict):
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail="Invalid credentials")
+    if user.get("role") not in administrator:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="You do not have permission to perform this action")
+
+
+@router.get("/db/pool")
+async def db_pool(user: user_dependency):
+    require_admin(user)
+    return {
+        "sync": pool_status(engine.pool),
+        "async": pool_status(async_engine.sync_engine.pool),
+    }
+
+
+@router.get("/cache")
+async def cache_stats(user: user_dependency):
+    require_admin(user)
+    return cache.snapshot()
+
+
+@router.get("/auth/token_cache")
+async def auth_token_cache(user: user_dependency):
+    require_admin(user)
+    return token_cache.snapshot()
+
+
+@router.get("/response_cache")
+async def response_cache_stats(user: user_dependency):
+    require_admin(user)
+    return response_cache.snapshot()
+
+
+@router.get("/users/availability")
+async def user_availability_stats(user: user_dependency):
+    require_admin(user)
+    return user_availability.snapshot()
+
+
+@router.get("/llm/cache")
+async def llm_cache_stats(user: user_dependency):
+    require_admin(user)
+    return llm_cache.snapshot()
+
+
+@router.get("/llm/single_flight")
+async def llm_single_flight_stats(user: user_dependency):
+    require_admin(user)
+    return single_flight_snapshot()
+
+
+@router.get("/llm/damage_classifier")
+async def damage_classifier_stats(user: user_dependency):
+    require_admin(user)
+    return {**damage_classifier.snapshot(), "batching": damage_batcher.snapshot()}
+
+
+@router.get("/llm/assessor")
+async def assessor_stats(user: user_dependency):
+    require_admin(user)
+    return assessor_snapshot()
+
+
+@router.get("/llm/images")
+async def image_stats(user: user_dependency):
+    require_admin(user)
+    return {**image_snapshot(), "quality_gate": quality_snapshot()}
+
+
+@router.get("/llm/gemini")
+async def gemini_stats(user: user_dependency):
+    require_admin(user)
+    return gemini.snapshot()
+
+
+@router.get("/llm/resilience")
+async def llm_resilience_stats(user: user_dependency):
+    require_admin(user)
+    return resilience_snapshot()
+
+
+@router.get("/jobs")
+async def job_stats(user: user_dependency, db: async_db_dependency):
+    require_admin(user)
+    return {"queue": await queue_status(db), "worker": job_worker.snapshot()}
@@ -0,0 +1,47 @@
+import os
+from fastapi import APIRouter, HTTPException, Response, UploadFile, File #type: ignore
+from fastapi.responses import JSONResponse #type: ignore
+from starlette import status # type: ignore
+
+from database.database import async_db_dependency
+from database.model import Job
+from helpers.file_handlers import TEXT_SOURCE_TYPES
+from helpers.jobs import describe, submit
+from AI_ML.tasks import DOCUMENT_TEXT
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+# seconds clients are asked to wait between polls of a pending job
+POLL_AFTER = "2"
+
+
+def accepted(job: Job) -> JSONResponse:
+    """202 pointing at the job's status URL."""
+    location = f"/jobs/{job.job_id}"
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={"job_id": job.job_id, "status": job.status, "status_url": location},
+        headers={"Location": location, "Retry-After": POLL_AFTER},
+    )
+
+
+@router.get("/{job_id}")
+async def job_status(job_id: str, db: async_db_dependency, response: Response):
+    """Status of a queued job, with its result once it succeeded or its error once it failed."""
+    job = await db.get(Job, job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    if job.status not in ("succeeded", "failed"):
+        response.headers["Retry-After"] = POLL_AFTER
+    return describe(job)
+
+
+@router.post("/document_text", status_code=status.HTTP_202_ACCEPTED)
+async def document_text(db: async_db_dependency, file: UploadFile = File(...)):
+    """Queue text extraction from a PDF, Word document, Outlook message or scanned image."""
+    ext = os.path.splitext(file.filename or "")[1].lower()
+    if ext not in TEXT_SOURCE_TYPES:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                            detail=f"Unsupported file type '{ext}', expected one of {', '.join(TEXT_SOURCE_TYPES)}")
+    job = await submit(db, DOCUMENT_TEXT, {"filename": file.filename}, [file])
+    return accepted(job)
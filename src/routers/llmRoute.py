@@ -1,11 +1,27 @@
 import io
+import json
 from typing import List
-from fastapi import APIRouter, UploadFile, File, Depends #type: ignore
+from fastapi import APIRouter, UploadFile, File, Depends, HTTPException #type: ignore
+from fastapi.encoders import jsonable_encoder #type: ignore
+from fastapi.responses import StreamingResponse #type: ignore
+from PIL import Image, UnidentifiedImageError
 from pydantic import BaseModel
-from AI_ML.agents import verify_vehicle_images, claims_damage_report
+from starlette import status # type: ignore
+from database.database import async_db_dependency
+from helpers.jobs import JobError, submit
+from AI_ML.assessor import stream_assess_claim
+from AI_ML.batching import BatcherFull
+from AI_ML.damage_predictor import ClassifierUnavailable, damage_batcher, damage_classifier
+from AI_ML.preprocess import normalize_images
+from AI_ML.quality import photo_quality_problems
+from AI_ML.tasks import EXTRACT_VEHICLE_DETAILS, CLAIM_VALIDATION, job_errors
+from routers.jobs import accepted
 
 router = APIRouter(prefix="/llm", tags=["LLM"])
 
+MAX_CLASSIFY_IMAGES = 32
+
+
 class VehicleReportRequest(BaseModel):
     front_img: UploadFile 
     back_img: UploadFile 
@@ -20,37 +36,119 @@ class VehicleReportRequest(BaseModel):
         "from_attributes": True
     }
 
-@router.post("/extract_vehicle_details")
-async def extract_vehicle_details(Vehicle: VehicleReportRequest = Depends()):
-    result = verify_vehicle_images(
-        Vehicle.front_img,
-        Vehicle.back_img,
-        Vehicle.left_img,
-        Vehicle.right_img,
-        Vehicle.make,
-        Vehicle.model,
-        Vehicle.type,
-        Vehicle.year
-    )
-    return {"valid": result[0], "details": result[1]}
-
-from PIL import Image
-@router.post("/claim_validation")
+@router.post("/extract_vehicle_details", status_code=status.HTTP_202_ACCEPTED)
+async def extract_vehicle_details(db: async_db_dependency, Vehicle: VehicleReportRequest = Depends(),
+                                  use_cache: bool = True):
+    """
+    Queue the check of the photos against the stated make, model, type and year.
+    Poll ``GET /jobs/{job_id}`` for ``{"valid", "details", "cached"}``.
+    Blurry, badly exposed, tiny or repeated photos are turned away with a
+    422 listing what to retake, before anything is queued.
+    """
+    problems = await photo_quality_problems({"front": Vehicle.front_img, "back": Vehicle.back_img,
+                                             "left": Vehicle.left_img, "right": Vehicle.right_img})
+    if problems:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail={"message": "Some photos can't be used, please retake them", "problems": problems})
+    # use_cache=false asks Gemini again and replaces the cached answer
+    job = await submit(db, EXTRACT_VEHICLE_DETAILS,
+                       {"make": Vehicle.make, "model": Vehicle.model, "type": Vehicle.type, "year": Vehicle.year,
+                        "use_cache": use_cache},
+                       [Vehicle.front_img, Vehicle.back_img, Vehicle.left_img, Vehicle.right_img])
+    return accepted(job)
+
+
+@router.post("/claim_validation", status_code=status.HTTP_202_ACCEPTED)
 async def claim_validation(
+    db: async_db_dependency,
+    damage_description: str,
+    requested_amount: float,
+    claimable_amount: float,
+    images: List[UploadFile] = File(...),
+    use_cache: bool = True
+):
+    """
+    Queue the validation of a claim based on damage description and associated images.
+    Poll ``GET /jobs/{job_id}`` for the damage report; ``tier`` in it says
+    whether the local classifier settled the claim or Gemini analysed it,
+    and ``escalation`` why the claim went to Gemini.
+    """
+    job = await submit(db, CLAIM_VALIDATION,
+                       {"damage_description": damage_description, "requested_amount": requested_amount,
+                        "claimable_amount": claimable_amount, "use_cache": use_cache},
+                       images)
+    return accepted(job)
+
+
+async def decode_images(images: List[UploadFile]) -> list:
+    try:
+        # upright, scaled down and re-encoded on the thread pool, the uploads are already spooled
+        return await normalize_images(images)
+    # not an image, a decompression bomb, or a truncated or corrupt file
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Not a readable image: {e}")
+
+
+def sse(event: str, data) -> str:
+    if event == "keepalive":
+        # a comment line, EventSource ignores it but proxies see traffic
+        return ": keepalive\n\n"
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
+@router.post("/claim_validation/stream")
+async def claim_validation_stream(
     damage_description: str,
     requested_amount: float,
     claimable_amount: float,
-    images: List[UploadFile] = File(...)
+    images: List[UploadFile] = File(...),
+    use_cache: bool = True
 ):
     """
-    Validate a claim based on damage description and associated images.
+    Claim validation as server-sent events: ``chunk`` events carry Gemini's
+    analysis as it is written, ``reset`` discards the chunks so far (a retry
+    or the fallback model starts over), and a final ``result`` holds the
+    validated report in the shape ``/claim_validation`` returns. A claim the
+    local tier settles gets the ``result`` alone. Failures
+    end the stream with an ``error`` event carrying the HTTP status.
     """
+    pil_images = await decode_images(images)
+
+    async def events():
+        try:
+            with job_errors():
+                async for event, data in stream_assess_claim(damage_description, requested_amount,
+                                                             claimable_amount, pil_images, use_cache):
+                    yield sse(event, data)
+        except JobError as e:
+            yield sse("error", {"status_code": e.status_code, "detail": e.detail})
+        except Exception as e:
+            # the 200 is already sent, the error can only go in the stream
+            yield sse("error", {"status_code": status.HTTP_500_INTERNAL_SERVER_ERROR, "detail": f"{type(e).__name__}: {e}"})
 
-    pil_images: List[Image.Image] = []
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-    for file in images:
-        contents = await file.read()  # Read file bytes
-        pil_images.append(Image.open(io.BytesIO(contents)))  # Convert to PIL Image
 
-    result = claims_damage_report(damage_description, requested_amount, claimable_amount, pil_images)
-    return result
\ No newline at end of file
+@router.post("/damage_classify")
+async def damage_classify(images: List[UploadFile] = File(...)):
+    """
+    Damage type of each photo from the local classifier, in tens of milliseconds
+    per photo on the CPU once the model is loaded (the first call loads it).
+    """
+    if len(images) > MAX_CLASSIFY_IMAGES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"At most {MAX_CLASSIFY_IMAGES} images per request")
+    pil_images = await decode_images(images)
+    try:
+        # batched with the photos of concurrent requests
+        predictions = await damage_batcher.submit(pil_images)
+    except ClassifierUnavailable as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    except BatcherFull as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=f"Classifier busy: {e}",
+                            headers={"Retry-After": "1"})
+    return {
+        "model": damage_classifier.model_name,
+        "predictions": [{"filename": file.filename, **prediction} for file, prediction in zip(images, predictions)],
+    }
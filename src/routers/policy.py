@@ -1,12 +1,17 @@
 from datetime import datetime, date
-from fastapi import APIRouter, HTTPException, Depends # type: ignore
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response # type: ignore
 from pydantic import BaseModel
 from starlette import status# type: ignore
 
 from typing import Annotated, Literal, Optional
-from database.database import db_dependency
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload, selectinload
+from database.database import async_db_dependency
 from database.model import Policy
 from helpers.config import basic_user, privilaged_user, administrator
+from helpers.pagination import KeysetPager, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from helpers.fields import FieldSet
+from helpers.response_cache import response_cache, conditional_response, make_etag
 
 from routers.auth import get_current_user
 from json import load
@@ -77,48 +82,131 @@ class PolicyUpdateRequest(BaseModel):
         "from_attributes": True
     }
 
+# policy detail responses embed the holder, insurables and claims: the user is joined
+# in the same statement, each collection costs one extra SELECT ... IN regardless of size
+policy_detail_loaders = (
+    joinedload(Policy.user),
+    selectinload(Policy.insurables),
+    selectinload(Policy.claims).undefer_group("claim_text"),
+)
+
+def policy_detail(policy) -> dict:
+    return {
+        "policy_id": policy.policy_id,
+        "policy_number": policy.policy_number,
+        "policy_holder": policy.policy_holder,
+        "start_date": policy.start_date,
+        "end_date": policy.end_date,
+        "premium": policy.premium,
+        "coverage_amount": policy.coverage_amount,
+        "status": policy.status,
+        "insurable_details": [insurableResponse.model_validate(ins) for ins in policy.insurables],
+        "filed_claims": [ClaimsResponse.model_validate(claim) for claim in policy.claims],
+        "user": UserResponse.model_validate(policy.user),
+    }
+
+def policy_etag(policy) -> str:
+    # every row the detail embeds, a claim added or removed changes it as well
+    return make_etag(
+        ("policy", policy.policy_id, policy.version),
+        ("user", policy.user_id, policy.user.version if policy.user else None),
+        *(("insurable", ins.id, ins.version) for ins in policy.insurables),
+        *(("claim", claim.claim_id, claim.version) for claim in policy.claims),
+    )
+
+async def respond_with_policy(request: Request, policy, content):
+    return await response_cache.arespond(request, ("policy", policy.policy_id), policy_etag(policy), content,
+                                         tags={f"policy:{policy.policy_id}", f"user:{policy.user_id}"},
+                                         owner_id=policy.user_id)
+
+async def cached_policy(request: Request, user: dict, policy_id: int):
+    """The cached detail response for policy_id if there is one and user may see it."""
+    cached = await response_cache.aget(("policy", policy_id))
+    if cached is None:
+        return None
+    if user.get('role') not in privilaged_user and cached.owner_id != user.get('user_id'):
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return conditional_response(request, cached)
+
+POLICY_FIELDS = {
+    "policy_id": Policy.policy_id,
+    "policy_number": Policy.policy_number,
+    "policy_holder": Policy.holder_name,
+    "start_date": Policy.start_date,
+    "end_date": Policy.end_date,
+    "premium": Policy.premium,
+    "coverage_amount": Policy.coverage_amount,
+    "status": Policy.status,
+}
+
+POLICY_SORTS = {
+    "policy_id": Policy.policy_id,
+    "start_date": Policy.start_date,
+    "end_date": Policy.end_date,
+}
+
 
 # ----------------------------------------Applied RBAC ----------------------------------------------------
 @router.get("/policy_details_all", response_model = list[PolicyListResponse])
-async def read_all_policies(user: user_dependency, db: db_dependency):
+async def read_all_policies(
+    user: user_dependency,
+    db: async_db_dependency,
+    response: Response,
+    policy_status: Optional[Literal["active", "inactive", "expired", "under-review"]] = Query(None, alias="status"),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    user_id: Optional[int] = None,
+    sort: str = "policy_id",
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    """
+    One page of policies, the cursor for the next page is returned in the X-Next-Cursor header.
+    date_from/date_to bound start_date, user_id is only honoured for agents and admins.
+    """
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid credentials"
         )
     try:
+        stmt = select(Policy)
         role = user.get('role')
         if role in privilaged_user:
-            policies = db.query(Policy).all()
-            if not policies:
-                raise HTTPException(status_code=404, detail="No policies found")
-            return [{
-                "policy_id": policy.policy_id,
-                "policy_number": policy.policy_number,
-                "policy_holder": policy.policy_holder,
-                "start_date": policy.start_date,
-                "end_date": policy.end_date,
-                "premium": policy.premium,
-                "coverage_amount": policy.coverage_amount,
-                "status": policy.status,
-            } for policy in policies]
-
+            if user_id is not None:
+                stmt = stmt.where(Policy.user_id == user_id)
         elif role in basic_user:
-            policies = db.query(Policy).filter(Policy.user_id == user.get('user_id')).all()
-            # print(**policies[0].vehicles)
-            if not policies:
-                raise HTTPException(status_code=404, detail="No policies found")
-            return [{
-                "policy_id": policy.policy_id,
-                "policy_number": policy.policy_number,
-                "policy_holder": policy.policy_holder,  # <-- Use the property
-                "start_date": policy.start_date,
-                "end_date": policy.end_date,
-                "premium": policy.premium,
-                "coverage_amount": policy.coverage_amount,
-                "status": policy.status,
-                
-            } for policy in policies]
+            stmt = stmt.where(Policy.user_id == user.get('user_id'))
+        else:
+            return None
+
+        if policy_status is not None:
+            stmt = stmt.where(Policy.status == policy_status)
+        if date_from is not None:
+            stmt = stmt.where(Policy.start_date >= date_from)
+        if date_to is not None:
+            stmt = stmt.where(Policy.start_date <= date_to)
+
+        pager = KeysetPager(sort, POLICY_SORTS, Policy.policy_id)
+        fieldset = FieldSet(fields, POLICY_FIELDS)
+        stmt = fieldset.apply(pager.apply(stmt, cursor, limit), *pager.columns)
+        # policy_holder reads the stored holder_name, no User rows are loaded
+        policies = pager.page((await db.execute(stmt)).scalars().all(), limit, response)
+        if not policies:
+            raise HTTPException(status_code=404, detail="No policies found")
+        if fields:
+            return fieldset.render(policies, response)
+        return [{
+            "policy_id": policy.policy_id,
+            "policy_number": policy.policy_number,
+            "policy_holder": policy.policy_holder,
+            "start_date": policy.start_date,
+            "end_date": policy.end_date,
+            "premium": policy.premium,
+            "coverage_amount": policy.coverage_amount,
+            "status": policy.status,
+        } for policy in policies]
     except HTTPException:
         raise
     except Exception as e:
@@ -128,7 +216,7 @@ async def read_all_policies(user: user_dependency, db: db_dependency):
         )
     
 @router.post("/policy_details", status_code=status.HTTP_201_CREATED)
-async def create_policy(user: user_dependency,db: db_dependency, policy_request: PolicyRequest):
+async def create_policy(user: user_dependency,db: async_db_dependency, policy_request: PolicyRequest):
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -138,7 +226,7 @@ async def create_policy(user: user_dependency,db: db_dependency, policy_request:
         policy_model = Policy(**policy_request.model_dump())
         # policy_model.user_id = int(user.get("user_id")) #type: ignore
         db.add(policy_model)
-        db.commit()
+        await db.commit()
         return {"message": "Policy created successfully",
                 "policy_id": policy_model.policy_id,
                 "policy_number": policy_model.policy_number}
@@ -147,7 +235,7 @@ async def create_policy(user: user_dependency,db: db_dependency, policy_request:
 @router.get("/policy_numbers/{user_id}")
 async def get_policy_numbers(
     user: user_dependency,
-    db: db_dependency,
+    db: async_db_dependency,
     user_id: int
 ):
     if user is None:
@@ -162,7 +250,7 @@ async def get_policy_numbers(
         # Privileged user requesting all policies
         if user_id == 0:
             if role in privilaged_user:
-                policies = db.query(Policy).where(Policy.status == "active")
+                policies = (await db.execute(select(Policy).where(Policy.status == "active"))).scalars()
             else:
                 raise HTTPException(
                     status_code=status.HTTP_403_FORBIDDEN,
@@ -170,7 +258,9 @@ async def get_policy_numbers(
                 )
         # Basic user requesting own policies
         elif role in basic_user or privilaged_user:
-            policies = db.query(Policy).filter(Policy.user_id == user_id).where(Policy.status == "active")
+            policies = (await db.execute(
+                select(Policy).where(Policy.user_id == user_id).where(Policy.status == "active")
+            )).scalars()
         else:
             # Non-basic, non-privileged user
             raise HTTPException(
@@ -194,9 +284,11 @@ async def get_policy_numbers(
 @router.get("/policy_details/{policy_id}")
 async def get_policy_details(
     user: user_dependency,
-    db: db_dependency,
+    db: async_db_dependency,
+    request: Request,
     policy_id: int
 ):
+    """Served from the response cache and honours If-None-Match."""
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -204,26 +296,19 @@ async def get_policy_details(
         )
 
     try:
-        policy = db.query(Policy).filter(Policy.policy_id == policy_id).first()
+        cached = await cached_policy(request, user, policy_id)
+        if cached is not None:
+            return cached
+        policy = (await db.execute(
+            select(Policy).options(*policy_detail_loaders).where(Policy.policy_id == policy_id)
+        )).scalars().first()
         if policy is None:
             raise HTTPException(status_code=404, detail="Policy not found")
 
         if user.get('role') not in privilaged_user and policy.user_id != user.get('user_id'):
             raise HTTPException(status_code=403, detail="Not authorized")
 
-        return {
-            "policy_id": policy.policy_id,
-            "policy_number": policy.policy_number,
-            "policy_holder": policy.policy_holder,
-            "start_date": policy.start_date,
-            "end_date": policy.end_date,
-            "premium": policy.premium,
-            "coverage_amount": policy.coverage_amount,
-            "status": policy.status,
-            "insurable_details": [insurableResponse.model_validate(ins) for ins in policy.insurables],
-            "filed_claims": [ClaimsResponse.model_validate(claim) for claim in policy.claims],
-            "user": UserResponse.model_validate(policy.user),
-        }
+        return await respond_with_policy(request, policy, lambda: policy_detail(policy))
 
     except HTTPException:
         raise
@@ -235,38 +320,35 @@ async def get_policy_details(
 @router.get("/policy_details", response_model=PolicyResponse)
 async def read_policy(
     user: user_dependency,
-    db: db_dependency,
+    db: async_db_dependency,
+    request: Request,
     policy_id: Optional[int] = None,
     policy_number: Optional[str] = None
 ):
+    """Served from the response cache when looked up by policy_id, honours If-None-Match."""
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid credentials"
         )
     if policy_id is not None:
-        policy = db.query(Policy).filter(Policy.policy_id == policy_id).first()
+        cached = await cached_policy(request, user, policy_id)
+        if cached is not None:
+            return cached
+        policy = (await db.execute(
+            select(Policy).options(*policy_detail_loaders).where(Policy.policy_id == policy_id)
+        )).scalars().first()
     elif policy_number is not None:
-        policy = db.query(Policy).filter(Policy.policy_number == policy_number).first()
+        policy = (await db.execute(
+            select(Policy).options(*policy_detail_loaders).where(Policy.policy_number == policy_number)
+        )).scalars().first()
     else:
         raise HTTPException(status_code=400, detail="Provide either policy_id or policy_number")
     if policy is None:
         raise HTTPException(status_code=404, detail="Policy not found")
     if user.get('role') not in privilaged_user and policy.user_id != user.get('user_id'):
         raise HTTPException(status_code=403, detail="Not authorized")
-    return {
-        "policy_id": policy.policy_id,
-        "policy_number": policy.policy_number,
-        "policy_holder": policy.policy_holder,
-        "start_date": policy.start_date,
-        "end_date": policy.end_date,
-        "premium": policy.premium,
-        "coverage_amount": policy.coverage_amount,
-        "status": policy.status,
-        "insurable_details": [insurableResponse.model_validate(ins) for ins in policy.insurables],
-        "filed_claims": [ClaimsResponse.model_validate(claim) for claim in policy.claims],
-        "user": UserResponse.model_validate(policy.user),
-    }
+    return await respond_with_policy(request, policy, lambda: PolicyResponse.model_validate(policy_detail(policy)))
     
 # @router.get("/policy_details/{policy_id}", response_model = PolicyResponse)
 # async def read_policy(user1: user_dependency, db: db_dependency, policy_id:int):
@@ -325,13 +407,13 @@ async def read_policy(
 #         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
     
 @router.delete("/policy_details/{policy_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_policy(user: user_dependency, db: db_dependency, policy_id: int):
-    policy = db.query(Policy).filter(Policy.policy_id == policy_id).first()
+async def delete_policy(user: user_dependency, db: async_db_dependency, policy_id: int):
+    policy = (await db.execute(select(Policy).where(Policy.policy_id == policy_id))).scalars().first()
     if not policy:
         raise HTTPException(status_code=404, detail="Policy not found")
     if user.get('role') in privilaged_user:
-        db.delete(policy)
-        db.commit()
+        await db.delete(policy)
+        await db.commit()
         return {"message": "Policy deleted successfully"}
     else:
         raise HTTPException(status_code=403, detail="Operation not permitted")
@@ -343,8 +425,8 @@ async def delete_policy(user: user_dependency, db: db_dependency, policy_id: int
 
 
 @router.put("/policy_details/{policy_id}", status_code=status.HTTP_200_OK)
-async def update_policy(db: db_dependency, policy_id: int, policy_request: PolicyUpdateRequest):
-    policy = db.query(Policy).filter(Policy.policy_id == policy_id).first()
+async def update_policy(db: async_db_dependency, policy_id: int, policy_request: PolicyUpdateRequest):
+    policy = (await db.execute(select(Policy).where(Policy.policy_id == policy_id))).scalars().first()
     if not policy:
         raise HTTPException(status_code=404, detail="Policy not found")
     
@@ -352,6 +434,6 @@ async def update_policy(db: db_dependency, policy_id: int, policy_request: Polic
         if value is not None:
             setattr(policy, key, value)
     
-    db.commit()
+    await db.commit()
     return {"message": "Policy updated successfully"}
 
@@ -1,12 +1,19 @@
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File # type: ignore
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Query, Request, Response # type: ignore
 from pydantic import BaseModel, EmailStr
 from datetime import date
 from starlette import status # type: ignore
 from typing import Annotated, Optional, Literal, Union
 
-from database.database import db_dependency
+from sqlalchemy import select, inspect
+from starlette.concurrency import run_in_threadpool # type: ignore
+
+from database.database import async_db_dependency
 from database.model import User
 from helpers.config import basic_user, privilaged_user, administrator, PROFILE_UPLOAD_DIR
+from helpers.pagination import KeysetPager, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from helpers.fields import FieldSet
+from helpers.availability import user_availability
+from helpers.response_cache import response_cache, conditional_response, make_etag
 
 from passlib.context import CryptContext # type: ignore
 
@@ -85,9 +92,30 @@ class UserResponse(BaseModel):
         "arbitrary_types_allowed": True
     }
         
+USER_FIELDS = {attr.key: getattr(User, attr.key) for attr in inspect(User).column_attrs if attr.key != "hashed_password"}
+
+USER_SORTS = {
+    "user_id": User.user_id,
+    "username": User.username,
+}
+
 # --------------- Applied RBAC -----------------
 @router.get("/user_details", response_model= Union[list[UserResponse],UserResponse])
-async def read_all(user: user_dependency, db: db_dependency):
+async def read_all(
+    user: user_dependency,
+    db: async_db_dependency,
+    response: Response,
+    user_status: Optional[Literal['active', 'inactive']] = Query(None, alias="status"),
+    usertype: Optional[Literal['user', 'agent', 'admin']] = None,
+    sort: str = "user_id",
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    """
+    Agents and admins get one page of users (next cursor in the X-Next-Cursor header),
+    basic users get their own record.
+    """
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -95,10 +123,21 @@ async def read_all(user: user_dependency, db: db_dependency):
         )
     try:
         role = user.get('role')
+        fieldset = FieldSet(fields, USER_FIELDS)
         if role in privilaged_user:
-            return db.query(User).all()
+            stmt = select(User)
+            if user_status is not None:
+                stmt = stmt.where(User.status == user_status)
+            if usertype is not None:
+                stmt = stmt.where(User.usertype == usertype)
+            pager = KeysetPager(sort, USER_SORTS, User.user_id)
+            result = await db.execute(fieldset.apply(pager.apply(stmt, cursor, limit), *pager.columns))
+            return fieldset.render(pager.page(result.scalars().all(), limit, response), response)
         elif role in basic_user:
-            return db.query(User).filter(User.user_id == user.get('user_id')).first()
+            result = await db.execute(fieldset.apply(select(User).where(User.user_id == user.get('user_id'))))
+            return fieldset.render(result.scalars().first(), response)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -106,7 +145,7 @@ async def read_all(user: user_dependency, db: db_dependency):
         )
     
 @router.get("/user_names")
-async def get_usernames(user: user_dependency, db: db_dependency):
+async def get_usernames(user: user_dependency, db: async_db_dependency):
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -115,7 +154,7 @@ async def get_usernames(user: user_dependency, db: db_dependency):
     try:
         role = user.get('role')
         if role in privilaged_user:
-            users = db.query(User.user_id, User.username).all()
+            users = (await db.execute(select(User.user_id, User.username))).all()
             usernames = [{ "username":u.username,
                            "user_id":u.user_id} for u in users]  # Extract usernames from tuples
             return usernames
@@ -129,23 +168,34 @@ async def get_usernames(user: user_dependency, db: db_dependency):
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"An error occurred: {str(e)}",
         )
+@router.get("/availability")
+async def check_availability(db: async_db_dependency, username: str | None = None,
+                             email: str | None = None, phone: str | None = None):
+    values = {field: value for field, value in (("username", username), ("email", email), ("phone", phone))
+              if value is not None}
+    if not values:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Pass at least one of username, email or phone")
+    taken = await user_availability.exists(db, **values)
+    return {field: {"exists": exists, "available": not exists} for field, exists in taken.items()}
+
 @router.get("/check_username/{username}")
-async def get_user_names( username:str, db: db_dependency):
-    exists = db.query(User).filter(User.username == username).first()
-    return {"exists": exists is not None}  
+async def get_user_names( username:str, db: async_db_dependency):
+    taken = await user_availability.exists(db, username=username)
+    return {"exists": taken["username"]}
 
 @router.get("/check_email/{email}")
-async def get_user_email( email:str, db: db_dependency):
-    exists = db.query(User).filter(User.email == email).first()
-    return {"exists": exists is not None} 
+async def get_user_email( email:str, db: async_db_dependency):
+    taken = await user_availability.exists(db, email=email)
+    return {"exists": taken["email"]}
 
 @router.get("/check_phone/{phone}")
-async def get_user_phone( phone:str, db: db_dependency):
-    exists = db.query(User).filter(User.phone == phone).first()
-    return {"exists": exists is not None} 
+async def get_user_phone( phone:str, db: async_db_dependency):
+    taken = await user_availability.exists(db, phone=phone)
+    return {"exists": taken["phone"]}
 
 @router.post("/input_user_details", status_code=status.HTTP_201_CREATED)
-async def create_user( db: db_dependency, user_request: UserRequest):
+async def create_user( db: async_db_dependency, user_request: UserRequest):
     # if user is None:
     #     raise HTTPException(status_code = status.HTTP_401_UNAUTHORIZED,
     #                         detail = "Invalid credentials"
@@ -156,7 +206,7 @@ async def create_user( db: db_dependency, user_request: UserRequest):
             firstname=user_request.firstname,
             middlename=user_request.middlename,
             lastname=user_request.lastname,
-            hashed_password=bcrypt_context.hash(user_request.password),
+            hashed_password=await run_in_threadpool(bcrypt_context.hash, user_request.password),
             dateofbirth=user_request.dateofbirth,
             profile_pic = user_request.profile_pic,
             phone=user_request.phone,
@@ -169,35 +219,35 @@ async def create_user( db: db_dependency, user_request: UserRequest):
         
 
         db.add(user_model)
-        db.commit()
+        await db.commit()
         return {"message": "User created successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/user_details/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_user(user: user_dependency,db: db_dependency, user_id: int):
+async def delete_user(user: user_dependency,db: async_db_dependency, user_id: int):
     if user is None:
         raise HTTPException(status_code = status.HTTP_401_UNAUTHORIZED,
                             detail = "Invalid Credentials")
     if user.get('role') not in administrator and user.get('user_id') != user_id:
         raise HTTPException(status_code = status.HTTP_403_FORBIDDEN,
                             detail = "You do not have permission to perform this action")
-    insuree = db.query(User).filter(User.user_id == user_id).first()
+    insuree = (await db.execute(select(User).where(User.user_id == user_id))).scalars().first()
     if not insuree:
         raise HTTPException(status_code=404, detail="User not found")
     
-    db.delete(insuree)
-    db.commit()
+    await db.delete(insuree)
+    await db.commit()
     return {"message": "User deleted successfully"}
 
 @router.put("/update_details", status_code=status.HTTP_200_OK)
-async def update_user_details(user: user_dependency, db: db_dependency, user_request: UserUpdateRequest):
+async def update_user_details(user: user_dependency, db: async_db_dependency, user_request: UserUpdateRequest):
     if user is None:
         raise HTTPException(status_code = status.HTTP_401_UNAUTHORIZED,
                             detail="Invalid credentials")
     try:
         role = user.get('role')
-        insuree = db.query(User).filter(User.user_id == user.get('user_id')).first()
+        insuree = (await db.execute(select(User).where(User.user_id == user.get('user_id')))).scalars().first()
         if not insuree:
             raise HTTPException(status_code=404, detail="User not found")
         update_data = UserUpdateRequest(**user_request.model_dump(exclude_unset=True))
@@ -207,14 +257,14 @@ async def update_user_details(user: user_dependency, db: db_dependency, user_req
                 setattr(insuree, key, value)
 
         
-        db.commit()
+        await db.commit()
         return {"message": "User updated successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
          
 
 @router.put("/update_user_details/{user_id}", status_code=status.HTTP_200_OK)
-async def update_user(user : user_dependency,db: db_dependency, user_id: int, user_request: UserUpdateRequest):
+async def update_user(user : user_dependency,db: async_db_dependency, user_id: int, user_request: UserUpdateRequest):
     if user is None:
         raise HTTPException(status_code = status.HTTP_401_UNAUTHORIZED,
                             detail = 'Invalid credentials')
@@ -222,7 +272,7 @@ async def update_user(user : user_dependency,db: db_dependency, user_id: int, us
     if role not in privilaged_user:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You do not have permission to perform this action")
     try:
-        insuree = db.query(User).filter(User.user_id == user_id).first()
+        insuree = (await db.execute(select(User).where(User.user_id == user_id))).scalars().first()
         if not insuree:
             raise HTTPException(status_code=404, detail="User not found")
         update_data = UserUpdateRequest(**user_request.model_dump(exclude_unset=True))
@@ -232,7 +282,7 @@ async def update_user(user : user_dependency,db: db_dependency, user_id: int, us
                 setattr(insuree, key, value)
 
         
-        db.commit()
+        await db.commit()
         return {"message": "User updated successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -240,7 +290,7 @@ async def update_user(user : user_dependency,db: db_dependency, user_id: int, us
 @router.put("/update_user_admin", status_code=status.HTTP_200_OK)
 async def update_user_admin(
     user: user_dependency,
-    db: db_dependency,
+    db: async_db_dependency,
     user_id: int,
     user_request: AdminUpdateRequest
 ):
@@ -256,7 +306,7 @@ async def update_user_admin(
             detail="You do not have permission to perform this action"
         )
     try:
-        insuree = db.query(User).filter(User.user_id == user_id).first()
+        insuree = (await db.execute(select(User).where(User.user_id == user_id))).scalars().first()
         if not insuree:
             raise HTTPException(status_code=404, detail="User not found")
 
@@ -265,7 +315,7 @@ async def update_user_admin(
         for key, value in update_data.items():
             setattr(insuree, key, value)
 
-        db.commit()
+        await db.commit()
         return {"message": "User updated successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -289,13 +339,13 @@ async def upload_profile_pic(file: UploadFile = File(...)):
 
 from fastapi.responses import FileResponse #type:ignore
 @router.get("/get_profile_pic/{user_id}")
-def get_profile_pic(user_id: int, db: db_dependency, user: user_dependency):
+async def get_profile_pic(user_id: int, db: async_db_dependency, user: user_dependency):
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Invalid credentials")
 
     try:
-        insuree = db.query(User).filter(User.user_id == user_id).first()
+        insuree = (await db.execute(select(User).where(User.user_id == user_id))).scalars().first()
         
         if not insuree:
             raise HTTPException(status_code=404, detail="User not found")
@@ -318,18 +368,26 @@ def get_profile_pic(user_id: int, db: db_dependency, user: user_dependency):
     
 
 @router.get("/user_details/{user_id}")
-async def read_user(user: user_dependency, db: db_dependency, user_id: int):
+async def read_user(user: user_dependency, db: async_db_dependency, request: Request, user_id: int):
+    """Served from the response cache and honours If-None-Match."""
     if user is None:
         raise HTTPException(status_code = status.HTTP_401_UNAUTHORIZED,
                             detail = "Invalid credentials")
     try:
         if user.get('role') in privilaged_user or user.get('user_id') == user_id:
-            user = db.query(User).filter(User.user_id == user_id).first() #type: ignore
+            cached = await response_cache.aget(("user", user_id))
+            if cached is not None:
+                return conditional_response(request, cached)
+            user = (await db.execute(select(User).where(User.user_id == user_id))).scalars().first() #type: ignore
             if user:
-                return user
+                return await response_cache.arespond(request, ("user", user_id),
+                                                     make_etag(("user", user_id, user.version)),
+                                                     lambda: user, tags={f"user:{user_id}"})
             raise HTTPException(status_code=404, detail="User not found")
         
         raise HTTPException(status_code=404, detail="User not found")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
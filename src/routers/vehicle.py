@@ -1,13 +1,17 @@
-import json
 from pathlib import Path
-from typing import Annotated
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File # type: ignore
+from typing import Annotated, Optional
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Query, Request, Response # type: ignore
 from pydantic import BaseModel
 from starlette import status # type: ignore
-from helpers.file_handlers import Load
+from AI_ML.quality import photo_quality_problems
+from helpers.file_handlers import Load, PathMap
 from helpers.config import basic_user, privilaged_user, administrator
+from helpers.pagination import KeysetPager, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from helpers.fields import FieldSet
+from helpers.response_cache import response_cache, conditional_response, make_etag
 
-from database.database import db_dependency
+from sqlalchemy import select, inspect
+from database.database import async_db_dependency
 from database.model import Vehicle
 
 from routers.auth import get_current_user
@@ -37,7 +41,7 @@ class ImageRequest(BaseModel):
 class VehicleRequest(BaseModel):
     policy_id: int
     typeofvehicle: str
-    image_path: str
+    image_path: Optional[PathMap] = None
     make: str
     model: str
     year_of_purchase: int
@@ -51,87 +55,133 @@ class VehicleRequest(BaseModel):
 class VehicleResponse(VehicleRequest):
     vehicle_id: int
 
+VEHICLE_FIELDS = {attr.key: getattr(Vehicle, attr.key) for attr in inspect(Vehicle).column_attrs}
+
+VEHICLE_SORTS = {
+    "vehicle_id": Vehicle.vehicle_id,
+    "year_of_purchase": Vehicle.year_of_purchase,
+}
+
 @router.get("/vehicle_details")
-async def read_all_vehicles(user: user_dependency, db: db_dependency):
+async def read_all_vehicles(
+    user: user_dependency,
+    db: async_db_dependency,
+    response: Response,
+    typeofvehicle: Optional[str] = None,
+    policy_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    sort: str = "vehicle_id",
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    """One page of vehicles, the cursor for the next page is returned in the X-Next-Cursor header."""
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
+    stmt = select(Vehicle)
     if user.get("role") in privilaged_user:
-        return db.query(Vehicle).all()
+        if user_id is not None:
+            stmt = stmt.where(Vehicle.policy.has(user_id=user_id))
     else:
-        return db.query(Vehicle).filter(Vehicle.policy_id == user.get("user_id")).all()
+        stmt = stmt.where(Vehicle.policy.has(user_id=user.get("user_id")))
+    if typeofvehicle is not None:
+        stmt = stmt.where(Vehicle.typeofvehicle == typeofvehicle)
+    if policy_id is not None:
+        stmt = stmt.where(Vehicle.policy_id == policy_id)
+
+    pager = KeysetPager(sort, VEHICLE_SORTS, Vehicle.vehicle_id)
+    fieldset = FieldSet(fields, VEHICLE_FIELDS)
+    stmt = fieldset.apply(pager.apply(stmt, cursor, limit), *pager.columns)
+    return fieldset.render(pager.page((await db.execute(stmt)).scalars().all(), limit, response), response)
 
 @router.get("/vehicle_details/{vehicle_id}")
-async def read_vehicle(user: user_dependency, db: db_dependency, vehicle_id:int):
+async def read_vehicle(user: user_dependency, db: async_db_dependency, request: Request, response: Response,
+                       vehicle_id:int, fields: Optional[str] = None):
+    """The whole vehicle is served from the response cache and honours If-None-Match."""
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
-    vehicle = db.query(Vehicle).filter(Vehicle.vehicle_id == vehicle_id).first()
+    privileged = user.get("role") in privilaged_user
+    if not fields:
+        cached = await response_cache.aget(("vehicle", vehicle_id))
+        if cached is not None:
+            if privileged or cached.owner_id == user.get("user_id"):
+                return conditional_response(request, cached)
+            raise HTTPException(status_code=404, detail="Vehicle not found")
+    fieldset = FieldSet(fields, VEHICLE_FIELDS)
+    # policy_id is needed for the ownership check below
+    stmt = fieldset.apply(select(Vehicle).where(Vehicle.vehicle_id == vehicle_id), Vehicle.policy_id)
+    vehicle = (await db.execute(stmt)).scalars().first()
     if vehicle is None:
         raise HTTPException(status_code=404, detail="Vehicle not found")
-    if user.get("role") in privilaged_user or user.get("user_id") == vehicle.policy.user_id:
-        return vehicle
-    raise HTTPException(status_code=404, detail="Vehicle not found")
+    owner_id = (await vehicle.awaitable_attrs.policy).user_id
+    if not privileged and user.get("user_id") != owner_id:
+        raise HTTPException(status_code=404, detail="Vehicle not found")
+    if fields:
+        return fieldset.render(vehicle, response)
+    return await response_cache.arespond(request, ("vehicle", vehicle_id),
+                                         make_etag(("insurable", vehicle_id, vehicle.version)), lambda: vehicle,
+                                         tags={f"insurable:{vehicle_id}", f"policy:{vehicle.policy_id}"},
+                                         owner_id=owner_id)
 
 @router.post("/vehicle_details", status_code=status.HTTP_201_CREATED)
-async def create_vehicle(db: db_dependency, vehicle_request: VehicleRequest):
+async def create_vehicle(db: async_db_dependency, vehicle_request: VehicleRequest):
     vehicle_model = Vehicle(**vehicle_request.model_dump())
     db.add(vehicle_model)
-    db.commit()
+    await db.commit()
     return {"message": "Vehicle created successfully"}
 
 @router.put("/vehicle_details/{vehicle_id}", status_code=status.HTTP_200_OK)
-async def update_vehicle(db: db_dependency, vehicle_id: int, vehicle_request: VehicleRequest):
-    vehicle = db.query(Vehicle).filter(Vehicle.vehicle_id == vehicle_id).first()
+async def update_vehicle(db: async_db_dependency, vehicle_id: int, vehicle_request: VehicleRequest):
+    vehicle = (await db.execute(select(Vehicle).where(Vehicle.vehicle_id == vehicle_id))).scalars().first()
     if not vehicle:
         raise HTTPException(status_code=404, detail="Vehicle not found")
     
     for key, value in vehicle_request.model_dump().items():
         setattr(vehicle, key, value)
     
-    db.commit()
+    await db.commit()
     return {"message": "Vehicle updated successfully"}
 
 @router.delete("/vehicle_details/{vehicle_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_vehicle(db: db_dependency, vehicle_id: int):
-    vehicle = db.query(Vehicle).filter(Vehicle.vehicle_id == vehicle_id).first()
+async def delete_vehicle(db: async_db_dependency, vehicle_id: int):
+    vehicle = (await db.execute(select(Vehicle).where(Vehicle.vehicle_id == vehicle_id))).scalars().first()
     if not vehicle:
         raise HTTPException(status_code=404, detail="Vehicle not found")
     
-    db.delete(vehicle)
-    db.commit()
+    await db.delete(vehicle)
+    await db.commit()
     return {"message": "Vehicle deleted successfully"}
 
 @router.post("/upload_vehicle_images", status_code=status.HTTP_201_CREATED)
 async def upload_vehicle_images(
     imagerequest: ImageRequest = Depends(),
 ):
+    problems = await photo_quality_problems({
+        "front": imagerequest.front_img, "back": imagerequest.back_img,
+        "left": imagerequest.left_img, "right": imagerequest.right_img,
+    })
+    if problems:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail={"message": "Some photos can't be used, please retake them", "problems": problems})
     try:
         loader = Load()
         paths = await loader.save_vehicle_images(
             imagerequest.front_img, imagerequest.back_img, imagerequest.left_img, imagerequest.right_img, imagerequest.folder_name, imagerequest.typeofvehicle
         )
-        return {"message": "Images uploaded successfully", "paths": str(paths)}
+        return {"message": "Images uploaded successfully", "paths": paths}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
-import ast
-from fastapi import HTTPException #type:ignore
 from fastapi.responses import FileResponse #type:ignore
-from pathlib import Path
-import json
 
 @router.get("/get_vehicle_image/{idx}/{side}")
-async def get_vehicle_image(user: user_dependency, db: db_dependency, idx: int, side: str):
-    vehicle = db.query(Vehicle).filter(Vehicle.vehicle_id == idx).first()
-    if not vehicle or vehicle.image_path in (None, "null", "{}", ""):
+async def get_vehicle_image(user: user_dependency, db: async_db_dependency, idx: int, side: str):
+    vehicle = (await db.execute(select(Vehicle).where(Vehicle.vehicle_id == idx))).scalars().first()
+    if not vehicle or not vehicle.image_path:
         raise HTTPException(status_code=404, detail="No image paths found")
 
-    # Try parsing as JSON, fallback to dict
-    try:
-        temp = json.loads(vehicle.image_path) #type:ignore
-    except json.JSONDecodeError:
-        temp = ast.literal_eval(vehicle.image_path) #type:ignore
-
-    if side not in temp or side == "main_folder" or not temp[side]:
+    paths = vehicle.image_path
+    if side == "main_folder" or not paths.get(side):
         raise HTTPException(status_code=404, detail="Requested image not found")
 
-    return FileResponse(Path(temp[side]))
+    return FileResponse(Path(paths[side]))
@@ -1,4 +1,5 @@
 import streamlit as st
+import asyncio
 import datetime
 import os
 import base64
@@ -146,7 +147,7 @@ def vehicle_info_tab():
                     folder_name = f"{make}_{model}_{year_of_purchase}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"
                     image_paths = Load().save_vehicle_images(image_front, image_back, image_left, image_right, folder_name, typeofvehicle=typeofvehicle)
                     
-                    verification_result = verify_vehicle_images(
+                    verification_result = asyncio.run(verify_vehicle_images(
                         image_paths.get("front", ""),
                         image_paths.get("back", ""),
                         image_paths.get("left", ""),
@@ -155,7 +156,7 @@ def vehicle_info_tab():
                         model,
                         typeofvehicle,
                         int(year_of_purchase)
-                    )
+                    ))
                     if verification_result[0]:
                         st.session_state.vehicle_info = {
                           "make": make,
@@ -1,9 +1,78 @@
 """
 Pytest configuration and shared fixtures
 """
+import os
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
 import pytest
 from unittest.mock import MagicMock
 
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+
+
+@pytest.fixture(scope="session")
+def app_modules(tmp_path_factory):
+    """Import the application packages against a throwaway SQLite database"""
+    data_dir = tmp_path_factory.mktemp("fnol")
+    os.environ.update({
+        "cloud_db": f"sqlite:///{(data_dir / 'app.db').as_posix()}",
+        "cloud_db_async": f"sqlite+aiosqlite:///{(data_dir / 'app.db').as_posix()}",
+        "db_path": str(data_dir / "lite.db"),
+        "images_path": str(data_dir / "images"),
+        "UPLOAD_DIR": str(data_dir / "uploads"),
+        "DB_SLOW_QUERY_LOG": str(data_dir / "slow_queries.jsonl"),
+        "LLM_CACHE_PATH": str(data_dir / "llm_results.sqlite3"),
+        "JOBS_SPOOL_PATH": str(data_dir / "jobs"),
+    })
+    for key, value in {
+        "gemini_API": "test-key",
+        "wkhtml_tool_box": "wkhtmltopdf",
+        "SECRET_KEY": "test-secret",
+        "ALGORITHM": "HS256",
+    }.items():
+        os.environ.setdefault(key, value)
+    if str(SRC_DIR) not in sys.path:
+        sys.path.insert(0, str(SRC_DIR))
+
+    from alembic import command
+    import database.database as database
+    import database.model as model
+    from database.schema import alembic_config
+    command.upgrade(alembic_config(), "head")
+    return SimpleNamespace(database=database, model=model, data_dir=data_dir)
+
+
+@pytest.fixture
+def api_client(app_modules):
+    """
+    Factory of httpx clients for the app under test: ``api_client(*routers)``
+    mounts the routers on a fresh FastAPI app, ``api_client(app=app)`` takes an
+    app the test set up itself. Other keyword arguments go to the client. Open
+    it with ``async with`` inside the test's event loop.
+    """
+    import httpx
+    from fastapi import FastAPI
+
+    def make(*routers, app=None, **kwargs):
+        if app is None:
+            app = FastAPI()
+            for router in routers:
+                app.include_router(router)
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test", **kwargs)
+    return make
+
+
+@pytest.fixture
+def admin_headers(app_modules):
+    """Session cookie of an admin, for routes behind get_current_user"""
+    from datetime import timedelta
+    from routers.auth import create_access_token
+
+    token = create_access_token("admin", 1, "admin", timedelta(minutes=5))
+    return {"Cookie": f"access_token_fnol={token}"}
+
 
 @pytest.fixture
 def mock_database():
@@ -46,5 +46,234 @@ class TestDatabaseTables:
             assert True  # Module imports successfully
 
 
+
+class TestConnectionPool:
+    """Test cases for the instrumented connection pool"""
+
+    def test_checkout_timeouts_are_counted(self, tmp_path):
+        """Test that an exhausted pool records the timeout and the wait"""
+        from sqlalchemy import create_engine, exc
+        from src.database.pool import InstrumentedQueuePool, pool_status
+
+        engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=InstrumentedQueuePool,
+                               pool_size=1, max_overflow=0, pool_timeout=0.05)
+        held = engine.connect()
+        with pytest.raises(exc.TimeoutError):
+            engine.connect()
+        stats = pool_status(engine.pool)
+        assert stats["checked_out"] == 1
+        assert stats["checkouts"] == 1
+        assert stats["checkout_timeouts"] == 1
+        assert stats["wait_ms_max"] >= 50
+        held.close()
+
+    def test_metrics_survive_dispose(self, tmp_path):
+        """Test that recreating the pool keeps the accumulated counters"""
+        from sqlalchemy import create_engine
+        from src.database.pool import InstrumentedQueuePool, pool_status
+
+        engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=InstrumentedQueuePool)
+        engine.connect().close()
+        engine.dispose()
+        assert pool_status(engine.pool)["checkouts"] == 1
+
+
+class TestSchemaMigrations:
+    """Test cases for the alembic migrations"""
+
+    def test_migrations_match_models(self, app_modules):
+        """Test that upgrading to head yields exactly the schema declared in database.model"""
+        from alembic.autogenerate import compare_metadata
+        from alembic.runtime.migration import MigrationContext
+
+        with app_modules.database.engine.connect() as conn:
+            diff = compare_metadata(MigrationContext.configure(conn), app_modules.model.Base.metadata)
+        assert diff == []
+
+    def test_schema_version_check_passes_at_head(self, app_modules):
+        """Test that the startup check accepts a migrated database"""
+        from database.schema import check_schema_version, current_revision, head_revision
+
+        check_schema_version(app_modules.database.engine)
+        assert current_revision(app_modules.database.engine) == head_revision()
+
+    def test_schema_version_check_rejects_unmigrated_database(self, tmp_path):
+        """Test that the startup check refuses a database without alembic_version"""
+        from sqlalchemy import create_engine
+        from src.database.schema import check_schema_version
+
+        with pytest.raises(RuntimeError, match="alembic upgrade head"):
+            check_schema_version(create_engine(f"sqlite:///{tmp_path / 'empty.db'}"))
+
+    def test_path_columns_backfilled_to_json(self, app_modules, tmp_path):
+        """Test that str(dict) path maps written before the JSON columns read back as dicts"""
+        from alembic import command
+        from sqlalchemy import create_engine, select, text
+        from database.schema import alembic_config
+        model = app_modules.model
+
+        engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+        config = alembic_config()
+        with engine.begin() as conn:
+            config.attributes["connection"] = conn
+            command.upgrade(config, "0004")
+            conn.execute(text(
+                "INSERT INTO claims (claim_id, policy_id, subject_id, claim_number, damage_description_user, "
+                "damage_description_llm, severity_level, damage_percentage, damage_image_path, date_of_incident, "
+                "location_of_incident, documents_path, requested_amount, claim_status) VALUES "
+                "(:id, 1, 1, :number, 'dent', 'dent', 'Low', 5, :images, '2025-01-01', 'Pune', :docs, 10, 'in-review')"
+            ), [
+                {"id": 1, "number": "CLAIM-1", "images": str({"0": "a.jpg", "1": None}), "docs": "claims/report.pdf"},
+                {"id": 2, "number": "CLAIM-2", "images": '{"0": "b.jpg"}', "docs": None},
+            ])
+            command.upgrade(config, "head")
+            rows = conn.execute(select(model.Claims.damage_image_path, model.Claims.documents_path)
+                                .order_by(model.Claims.claim_id)).all()
+
+        assert rows == [({"0": "a.jpg", "1": None}, {"0": "claims/report.pdf"}), ({"0": "b.jpg"}, None)]
+
+    def test_stamped_baseline_upgrades_and_numbers_continue(self, app_modules, tmp_path):
+        """Test that a pre-migration database stamped at 0001 gets the number counters and continues its numbering"""
+        from datetime import date, datetime
+        from alembic import command
+        from sqlalchemy import create_engine, inspect, text
+        from sqlalchemy.orm import Session
+        from database.schema import alembic_config
+        model = app_modules.model
+
+        engine = create_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+        config = alembic_config()
+        prefix = f"POL-{datetime.now().strftime('%Y%m%d')}"
+        with engine.begin() as conn:
+            config.attributes["connection"] = conn
+            command.upgrade(config, "0001")
+            assert not inspect(conn).has_table("number_sequences")
+            conn.execute(text(
+                "INSERT INTO users (user_id, usertype, username, firstname, lastname, hashed_password, dateofbirth, "
+                "email, status) VALUES (1, 'user', 'legacy', 'Old', 'Timer', 'x', '1980-01-01', 'old@example.com', "
+                "'active')"))
+            conn.execute(text(
+                "INSERT INTO policies (policy_number, user_id, start_date, end_date, premium, coverage_amount, status) "
+                "VALUES (:number, 1, '2025-01-01', '2026-01-01', 1, 1, 'active')"), {"number": f"{prefix}005"})
+            command.upgrade(config, "head")
+        with Session(engine) as db:
+            policy = model.Policy(user_id=1, start_date=date(2025, 1, 1), end_date=date(2026, 1, 1),
+                                  premium=1.0, coverage_amount=1.0)
+            db.add(policy)
+            db.commit()
+            assert policy.policy_number == f"{prefix}006"
+
+
+class TestSlowQueryLog:
+    """Test cases for the slow-query log and its aggregation CLI"""
+
+    def test_sync_statement_logged_with_plan(self, app_modules, tmp_path):
+        """Test that a statement over the threshold is written with its shape, fingerprint and plan"""
+        import json
+        from sqlalchemy import create_engine, text
+        from database.slow_query import SlowQueryLog
+
+        engine = create_engine(f"sqlite:///{tmp_path / 'slow.db'}")
+        log = SlowQueryLog(tmp_path / "slow.jsonl", threshold_ms=0)
+        with engine.begin() as conn:
+            conn.execute(text("CREATE TABLE t (id INTEGER PRIMARY KEY, name TEXT)"))
+        log.attach(engine)
+        with engine.connect() as conn:
+            conn.execute(text("SELECT name FROM t WHERE id = :id"), {"id": 7})
+        log.close()
+
+        entries = [json.loads(line) for line in (tmp_path / "slow.jsonl").read_text().splitlines()]
+        select = next(e for e in entries if e["sql"].startswith("SELECT"))
+        assert select["params"] == ["int"]
+        assert select["dialect"] == "sqlite"
+        assert isinstance(select["plan"], list) and select["plan"]
+        assert not any("EXPLAIN" in e["sql"] for e in entries)
+
+    def test_async_statement_logged_with_plan(self, app_modules, tmp_path):
+        """Test that statements on an AsyncEngine are explained in a background task"""
+        import asyncio
+        import json
+        from sqlalchemy import text
+        from sqlalchemy.ext.asyncio import create_async_engine
+        from database.slow_query import SlowQueryLog
+
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'slow.db'}")
+        log = SlowQueryLog(tmp_path / "slow.jsonl", threshold_ms=0)
+        log.attach_async(engine)
+
+        async def run():
+            async with engine.connect() as conn:
+                await conn.execute(text("SELECT 1 WHERE 2 > :n"), {"n": 1})
+            await asyncio.gather(*log._tasks)
+            await engine.dispose()
+        asyncio.run(run())
+        log.close()
+
+        entries = [json.loads(line) for line in (tmp_path / "slow.jsonl").read_text().splitlines()]
+        select = next(e for e in entries if e["sql"].startswith("SELECT"))
+        assert select["sql"] == "SELECT ? WHERE ? > ?"
+        assert select["plan"] is not None and "error" not in select["plan"]
+
+    def test_cli_aggregates_by_fingerprint(self, app_modules, tmp_path, capsys):
+        """Test that the CLI groups entries by fingerprint and ranks them by total time"""
+        import json
+        from database.slow_query import main
+
+        log = tmp_path / "slow.jsonl"
+        rows = [("aaa", "SELECT a", 10.0), ("bbb", "SELECT b", 300.0), ("aaa", "SELECT a", 30.0)]
+        log.write_text("\n".join(json.dumps({"fingerprint": f, "sql": sql, "duration_ms": ms, "route": "GET /x",
+                                              "plan": None}) for f, sql, ms in rows))
+        main([str(log), "--json"])
+        summary = json.loads(capsys.readouterr().out)
+        assert [(g["fingerprint"], g["count"], g["total_ms"]) for g in summary] == [("bbb", 1, 300.0), ("aaa", 2, 40.0)]
+
+
+class TestPolicyHolderName:
+    """Test cases for the denormalized policy holder name"""
+
+
+    def test_holder_name_follows_user_renames(self, app_modules):
+        """Test that the stored name is set on insert and kept in sync with the user"""
+        from datetime import date
+        model = app_modules.model
+
+        with app_modules.database.sessionlocal() as db:
+            owner = model.User(username="holder1", firstname="Asha", middlename="K", lastname="Rao",
+                               hashed_password="x", dateofbirth=date(1990, 1, 1), email="holder1@example.com")
+            db.add(owner)
+            db.flush()
+            policy = model.Policy(user_id=owner.user_id, start_date=date(2025, 1, 1), end_date=date(2026, 1, 1),
+                                  premium=1.0, coverage_amount=1.0)
+            db.add(policy)
+            db.commit()
+            assert policy.holder_name == "Asha K Rao"
+
+            owner.middlename = None
+            owner.lastname = "Iyer"
+            db.commit()
+            db.refresh(policy)
+            assert policy.policy_holder == "Asha Iyer"
+
+    def test_listing_does_not_load_users(self, app_modules):
+        """Test that reading policy_holder for a list of policies issues no per-row queries"""
+        from sqlalchemy import event, select
+        model = app_modules.model
+        engine = app_modules.database.engine
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with app_modules.database.sessionlocal() as db:
+            event.listen(engine, "before_cursor_execute", record)
+            try:
+                policies = db.execute(select(model.Policy)).scalars().all()
+                holders = [p.policy_holder for p in policies]
+            finally:
+                event.remove(engine, "before_cursor_execute", record)
+        assert len(holders) == len(policies) > 0
+        assert len(statements) == 1
+
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
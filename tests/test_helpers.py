@@ -51,5 +51,217 @@ class TestPromptsHelper:
         assert len(prompts) > 0
 
 
+class TestSharedCache:
+    """Test cases for the shared cache and its backends"""
+
+    def test_memory_backend_evicts_lru_expired_and_over_budget(self, app_modules):
+        """Test that the in-process backend drops expired entries and evicts by count and size"""
+        import time
+        from helpers.cache import MemoryBackend
+
+        backend = MemoryBackend(max_entries=2, max_bytes=100)
+        backend.set("short", b"x", ttl=0.01)
+        time.sleep(0.02)
+        assert backend.get_many(["short"]) == [None]
+        backend.set("a", b"1")
+        backend.set("b", b"2")
+        backend.get_many(["a"])
+        backend.set("c", b"3")
+        assert backend.get_many(["a", "b", "c"]) == [b"1", None, b"3"]
+        backend.set("big", b"x" * 97)
+        assert backend.get_many(["a", "c", "big"]) == [None, None, b"x" * 97]
+        assert backend.describe()["evictions"] == 3
+
+    def test_namespace_and_tag_invalidation(self, app_modules):
+        """Test that invalidating a namespace or a tag drops only the entries it covers"""
+        from helpers.cache import Cache, MemoryBackend
+
+        cache = Cache(MemoryBackend())
+        claims, users = cache.namespace("claims"), cache.namespace("users")
+        claims.set(1, "claim 1", tags=["policy:7"])
+        claims.set(2, "claim 2", tags=["policy:8"])
+        users.set(1, "user 1")
+        claims.invalidate(["policy:7"])
+        assert claims.get(1) is None and claims.get(2) == "claim 2"
+        claims.invalidate()
+        assert claims.get(2) is None and users.get(1) == "user 1"
+        assert claims.snapshot()["invalidations"] == 2
+
+    def test_get_or_compute_runs_once_under_concurrency(self, app_modules):
+        """Test that concurrent misses for one key compute it once and the others wait for the result"""
+        import asyncio
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        from helpers.cache import Cache, MemoryBackend
+
+        namespace = Cache(MemoryBackend()).namespace("llm")
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.05)
+            return {"valid": True}
+
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(lambda _: namespace.get_or_compute("report", compute), range(8)))
+        assert calls == [1] and all(result == {"valid": True} for result in results)
+
+        async def acompute():
+            calls.append(2)
+            await asyncio.sleep(0.05)
+            return "async"
+
+        async def many():
+            return await asyncio.gather(*(namespace.aget_or_compute("other", acompute) for _ in range(8)))
+        assert asyncio.run(many()) == ["async"] * 8
+        assert calls == [1, 2]
+        assert namespace.snapshot()["computes"] == 2
+
+    def test_redis_backend_shares_entries_between_workers(self, app_modules):
+        """Test that two caches on the Redis-protocol stand-in see each other's entries and invalidations"""
+        import threading
+        from helpers.cache import Cache, RedisBackend, StandInServer
+
+        with StandInServer(("127.0.0.1", 0)) as server:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            url = f"redis://127.0.0.1:{server.server_address[1]}/0"
+            first, second = (Cache(RedisBackend(url)).namespace("responses") for _ in range(2))
+            first.set(("claim", 1), {"claim_id": 1}, tags=["claim:1"])
+            assert second.get(("claim", 1)) == {"claim_id": 1}
+            assert second.get_or_compute(("claim", 1), lambda: {"claim_id": -1}) == {"claim_id": 1}
+            second.invalidate(["claim:1"])
+            assert first.get(("claim", 1)) is None
+            server.shutdown()
+
+    def test_disk_backend_persists_and_evicts_least_recently_read(self, app_modules, tmp_path):
+        """Test that the SQLite backend survives reopening and drops the least recently read entries over budget"""
+        from helpers.cache import DiskBackend
+
+        backend = DiskBackend(tmp_path / "cache.sqlite3", max_bytes=350)
+        backend.set("a", b"x" * 100)
+        backend.set("b", b"x" * 100)
+        backend.get_many(["a"])
+        backend.set("c", b"x" * 100)
+        backend.set("d", b"x" * 100)
+        reopened = DiskBackend(tmp_path / "cache.sqlite3", max_bytes=350)
+        assert reopened.get_many(["a", "b", "c", "d"]) == [b"x" * 100, None, b"x" * 100, b"x" * 100]
+        assert not reopened.set("e", b"x" * 351)
+        assert reopened.set("lock", b"1", ttl=30, only_if_absent=True)
+        assert not reopened.set("lock", b"1", ttl=30, only_if_absent=True)
+
+    def test_unreachable_backend_serves_uncached(self, app_modules):
+        """Test that a cache server that is down turns lookups into misses instead of errors"""
+        import socket
+        from helpers.cache import Cache, RedisBackend
+
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        namespace = Cache(RedisBackend(f"redis://127.0.0.1:{port}/0", timeout=0.1)).namespace("llm")
+        assert namespace.get_or_compute("key", lambda: "computed") == "computed"
+        assert namespace.get("key") is None
+        assert namespace.snapshot()["errors"] > 0
+
+    def test_entries_are_json_and_pickles_are_never_loaded(self, app_modules, tmp_path):
+        """Test that values are stored as JSON and a pickle planted in a shared backend is a miss"""
+        import json
+        import pickle
+        from helpers.cache import Cache, DiskBackend
+
+        backend = DiskBackend(tmp_path / "cache.sqlite3")
+        namespace = Cache(backend).namespace("llm")
+        namespace.set("report", {"valid": True, "labels": ("dent",)}, tags=["claim:1"])
+        generation, tags, value = json.loads(backend.get_many([namespace._key("report")])[0])
+        assert value == {"valid": True, "labels": ["dent"]} and list(tags) == ["claim:1"]
+        assert namespace.get("report") == {"valid": True, "labels": ["dent"]}
+        backend.set(namespace._key("planted"), pickle.dumps((generation.encode(), {}, "unpickled")))
+        assert namespace.get("planted") is None
+
+    def test_async_methods_keep_blocking_backends_off_the_loop(self, app_modules, tmp_path):
+        """Test that the async namespace methods run a blocking backend's round trips on worker threads"""
+        import asyncio
+        import threading
+        from helpers.cache import Cache, DiskBackend
+
+        threads = []
+
+        class RecordingBackend(DiskBackend):
+            def get_many(self, keys):
+                threads.append(threading.get_ident())
+                return super().get_many(keys)
+
+        namespace = Cache(RecordingBackend(tmp_path / "cache.sqlite3")).namespace("responses")
+
+        async def compute():
+            return "computed"
+
+        async def scenario():
+            await namespace.aset("a", [1, 2], tags=["user:1"])
+            found = await namespace.aget("a")
+            computed = await namespace.aget_or_compute("b", compute)
+            await namespace.ainvalidate(["user:1"])
+            return threading.get_ident(), found, computed, await namespace.aget("a")
+
+        loop_thread, found, computed, invalidated = asyncio.run(scenario())
+        assert (found, computed, invalidated) == ([1, 2], "computed", None)
+        assert threads and loop_thread not in threads
+
+
+class TestSingleFlight:
+    """Test cases for single-flight coalescing of coroutines"""
+
+    def test_concurrent_duplicates_share_one_call(self, app_modules):
+        """Test that callers of a key in flight get its result and errors without calling again"""
+        import asyncio
+        from helpers.singleflight import SingleFlight
+
+        flights = SingleFlight()
+        calls = []
+
+        async def compute(value):
+            calls.append(value)
+            await asyncio.sleep(0.05)
+            if value == "boom":
+                raise RuntimeError("model down")
+            return value
+
+        async def scenario():
+            shared = await asyncio.gather(*(flights.do("a", lambda: compute("answer")) for _ in range(5)))
+            failed = await asyncio.gather(*(flights.do("b", lambda: compute("boom")) for _ in range(3)),
+                                          return_exceptions=True)
+            again = await flights.do("a", lambda: compute("fresh"))
+            return shared, failed, again
+        shared, failed, again = asyncio.run(scenario())
+        assert shared == [("answer", False)] + [("answer", True)] * 4
+        assert all(isinstance(error, RuntimeError) for error in failed)
+        # nothing is kept once the flight lands
+        assert again == ("fresh", False)
+        assert calls == ["answer", "boom", "fresh"]
+        assert flights.snapshot() == {"in_flight": 0, "flights": 3, "shared": 4, "shared_failures": 2}
+
+    def test_cancelled_leader_hands_over_to_a_waiter(self, app_modules):
+        """Test that a waiter runs the call itself when the caller it waited on is cancelled"""
+        import asyncio
+        from helpers.singleflight import SingleFlight
+
+        flights = SingleFlight()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return len(calls)
+
+        async def scenario():
+            leader = asyncio.create_task(flights.do("k", compute))
+            await asyncio.sleep(0.01)
+            waiter = asyncio.create_task(flights.do("k", compute))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            return await waiter
+        assert asyncio.run(scenario()) == (2, False)
+        assert len(calls) == 2
+
+
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
@@ -2,6 +2,8 @@
 Unit tests for API routers
 Tests cover endpoint definitions and router initialization
 """
+import asyncio
+
 import pytest
 from unittest.mock import patch, MagicMock
 
@@ -75,5 +77,1318 @@ class TestLLMRouter:
             assert mock_router is not None
 
 
+
+class TestDocumentNumberConcurrency:
+    """Test cases for policy and claim number allocation under load"""
+
+    REQUESTS = 200
+
+    async def _fire(self, api_client, admin_headers):
+        from routers import policy, claims
+
+        policy_body = {"user_id": 1, "start_date": "2025-01-01", "end_date": "2026-01-01",
+                       "premium": 100.0, "coverage_amount": 10000.0, "status": "active"}
+        claim_body = {"policy_id": 1, "subject_id": 1, "damage_description_user": "dent",
+                      "damage_description_llm": "dent", "severity_level": "Low", "damage_percentage": 5.0,
+                      "damage_image_path": "{}", "date_of_incident": "2025-02-01",
+                      "location_of_incident": "Pune", "requested_amount": 500.0, "claim_status": "in-review"}
+        async with api_client(policy.router, claims.router, headers=admin_headers) as client:
+            # create today's counter rows before the burst
+            await client.post("/policies/policy_details", json=policy_body)
+            await client.post("/claims/claim_details", json=claim_body)
+            return await asyncio.gather(*(
+                client.post(path, json=body)
+                for path, body in [("/policies/policy_details", policy_body),
+                                   ("/claims/claim_details", claim_body)] * self.REQUESTS
+            ))
+
+    def test_parallel_inserts_get_unique_numbers(self, app_modules, api_client, admin_headers):
+        """Test that hundreds of parallel creates all succeed with distinct, gapless numbers"""
+        from sqlalchemy import select
+        model = app_modules.model
+        columns = (model.Policy.policy_number, model.Claims.claim_number)
+
+        def issued():
+            with app_modules.database.sessionlocal() as db:
+                return [db.execute(select(column)).scalars().all() for column in columns]
+
+        before = issued()
+        responses = asyncio.run(self._fire(api_client, admin_headers))
+        assert [r.status_code for r in responses] == [201] * len(responses)
+
+        for old, numbers in zip(before, issued()):
+            assert len(numbers) == len(set(numbers))
+            new = sorted(int(n[-3:]) for n in set(numbers) - set(old))
+            assert new == list(range(new[0], new[0] + self.REQUESTS + 1))
+
+    def test_block_reservation_numbers_a_whole_flush(self, app_modules):
+        """Test that one flush of many policies reserves a single contiguous block"""
+        from datetime import date
+        model = app_modules.model
+
+        with app_modules.database.sessionlocal() as db:
+            policies = [model.Policy(user_id=1, start_date=date(2025, 1, 1), end_date=date(2026, 1, 1),
+                                     premium=1.0, coverage_amount=1.0) for _ in range(25)]
+            db.add_all(policies)
+            db.commit()
+            suffixes = [int(p.policy_number[-3:]) for p in policies]
+        assert sorted(suffixes) == list(range(min(suffixes), min(suffixes) + 25))
+
+
+class TestKeysetPagination:
+    """Test cases for cursor pagination on list endpoints"""
+
+    async def _walk(self, api_client, admin_headers, query):
+        from routers import policy
+
+        pages = []
+        async with api_client(policy.router, headers=admin_headers) as client:
+            cursor = None
+            while True:
+                response = await client.get("/policies/policy_details_all", params={**query, "cursor": cursor} if cursor else query)
+                assert response.status_code == 200
+                pages.append([p["policy_id"] for p in response.json()])
+                cursor = response.headers.get("X-Next-Cursor")
+                if not cursor:
+                    return pages
+
+    def _seed(self, app_modules):
+        from datetime import date
+        model = app_modules.model
+        with app_modules.database.sessionlocal() as db:
+            db.add_all(model.Policy(user_id=1, start_date=date(2024, 1, 1 + i % 3), end_date=date(2025, 1, 1),
+                                    premium=1.0, coverage_amount=1.0, status="inactive" if i % 2 else "active")
+                       for i in range(7))
+            db.commit()
+
+    def test_pages_cover_every_row_once(self, app_modules, api_client, admin_headers):
+        """Test that walking the cursor visits each policy exactly once, in order"""
+        self._seed(app_modules)
+        pages = asyncio.run(self._walk(api_client, admin_headers, {"limit": 3}))
+        ids = [i for page in pages for i in page]
+        assert all(len(page) <= 3 for page in pages)
+        assert ids == sorted(set(ids))
+
+    def test_descending_sort_with_ties_and_filter(self, app_modules, api_client, admin_headers):
+        """Test that a non-unique sort key breaks ties on the primary key and honours filters"""
+        from sqlalchemy import select
+        model = app_modules.model
+        self._seed(app_modules)
+        pages = asyncio.run(self._walk(api_client, admin_headers, {"limit": 2, "sort": "-start_date",
+                                                                   "status": "inactive"}))
+        with app_modules.database.sessionlocal() as db:
+            expected = db.execute(select(model.Policy.policy_id).where(model.Policy.status == "inactive")
+                                  .order_by(model.Policy.start_date.desc(), model.Policy.policy_id.desc())).scalars().all()
+        assert [i for page in pages for i in page] == expected
+
+    def test_rejects_bad_cursor_and_sort(self, app_modules, api_client, admin_headers):
+        """Test that tampered cursors and unknown sort keys are a 400"""
+        from routers import policy
+
+        async def probe():
+            async with api_client(policy.router, headers=admin_headers) as client:
+                return (await client.get("/policies/policy_details_all", params={"cursor": "bm90LWpzb24"}),
+                        await client.get("/policies/policy_details_all", params={"sort": "premium"}))
+        for response in asyncio.run(probe()):
+            assert response.status_code == 400
+
+
+class TestQueryStatsMiddleware:
+    """Test cases for the per-request SQL statement counter"""
+
+    def _get(self, app_modules, api_client, admin_headers, threshold):
+        from fastapi import FastAPI
+        from database import query_stats
+        from routers import policy
+
+        app = FastAPI()
+        app.include_router(policy.router)
+        query_stats.install(app_modules.database.engine, app_modules.database.async_engine.sync_engine)
+        app.add_middleware(query_stats.QueryStatsMiddleware, n_plus_one_threshold=threshold)
+
+        async def get():
+            async with api_client(app=app, headers=admin_headers) as client:
+                return await client.get("/policies/policy_details_all", params={"limit": 5})
+        return asyncio.run(get())
+
+    def test_headers_report_statement_count(self, app_modules, api_client, admin_headers):
+        """Test that a request reports its statements in X-DB-Queries and Server-Timing"""
+        response = self._get(app_modules, api_client, admin_headers, threshold=10)
+        assert int(response.headers["X-DB-Queries"]) >= 1
+        assert response.headers["Server-Timing"].startswith("db;dur=")
+
+    def test_repeated_statement_logs_warning(self, app_modules, api_client, admin_headers, caplog):
+        """Test that a statement shape over the threshold is reported as a possible N+1"""
+        import logging
+        with caplog.at_level(logging.WARNING, logger="database.query_stats"):
+            self._get(app_modules, api_client, admin_headers, threshold=0)
+        assert "Possible N+1" in caplog.text
+
+    def test_placeholder_lists_share_a_shape(self):
+        """Test that IN lists of different lengths count as the same statement"""
+        from src.database.query_stats import statement_shape
+        assert statement_shape("SELECT * FROM t WHERE id IN (?, ?, ?)") == statement_shape("SELECT *  FROM t WHERE id IN (?, ?)")
+
+
+class TestSparseFieldsets:
+    """Test cases for fields= projections and the deferred claim text columns"""
+
+    def _get(self, app_modules, api_client, admin_headers, path, params):
+        from sqlalchemy import event
+        from routers import claims
+
+        statements = []
+        engine = app_modules.database.async_engine.sync_engine
+        capture = lambda conn, cursor, statement, *args: statements.append(statement)
+
+        async def get():
+            async with api_client(claims.router, headers=admin_headers) as client:
+                return await client.get(path, params=params)
+        event.listen(engine, "before_cursor_execute", capture)
+        try:
+            response = asyncio.run(get())
+        finally:
+            event.remove(engine, "before_cursor_execute", capture)
+        return response, [s for s in statements if "FROM claims" in s]
+
+    def _seed(self, app_modules):
+        from datetime import date
+        model = app_modules.model
+        with app_modules.database.sessionlocal() as db:
+            claim = model.Claims(policy_id=1, subject_id=1, damage_description_user="x" * 3000,
+                                 damage_description_llm="y" * 3000, severity_level="Low", damage_percentage=1.0,
+                                 damage_image_path={}, date_of_incident=date(2025, 1, 1),
+                                 location_of_incident="Pune", requested_amount=1.0, claim_status="in-review")
+            db.add(claim)
+            db.commit()
+            return claim.claim_id
+
+    def test_list_skips_large_text_columns(self, app_modules, api_client, admin_headers):
+        """Test that the claim list neither selects nor returns the deferred free-text columns"""
+        self._seed(app_modules)
+        response, statements = self._get(app_modules, api_client, admin_headers, "/claims/claim_details",
+                                         {"limit": 5})
+        assert response.status_code == 200
+        assert "damage_description_user" not in response.json()[0]
+        assert not any("damage_description_user" in s for s in statements)
+
+    def test_fields_project_in_sql(self, app_modules, api_client, admin_headers):
+        """Test that fields= selects only the named columns and returns only those keys"""
+        claim_id = self._seed(app_modules)
+        response, statements = self._get(app_modules, api_client, admin_headers,
+                                         f"/claims/claim_details/{claim_id}",
+                                         {"fields": "claim_number,damage_description_llm"})
+        assert response.status_code == 200
+        assert set(response.json()) == {"claim_number", "damage_description_llm"}
+        assert "requested_amount" not in statements[0] and "damage_description_llm" in statements[0]
+
+    def test_detail_loads_large_text_columns(self, app_modules, api_client, admin_headers):
+        """Test that a single claim still comes back whole"""
+        claim_id = self._seed(app_modules)
+        response, _ = self._get(app_modules, api_client, admin_headers, f"/claims/claim_details/{claim_id}", {})
+        assert response.json()["damage_description_user"] == "x" * 3000
+
+    def test_unknown_field_rejected(self, app_modules, api_client, admin_headers):
+        """Test that an unknown field name is a 400"""
+        response, _ = self._get(app_modules, api_client, admin_headers, "/claims/claim_details",
+                                {"fields": "claim_id,bogus"})
+        assert response.status_code == 400
+
+
+class TestTokenCache:
+    """Test cases for the verified-token cache behind get_current_user"""
+
+    def test_repeat_calls_hit_the_cache(self, app_modules, api_client):
+        """Test that a token is decoded once and served from the cache afterwards"""
+        from datetime import timedelta
+        from unittest.mock import patch
+        from routers import auth
+
+        token = auth.create_access_token("cached", 7, "user", timedelta(minutes=5))
+
+        async def calls():
+            async with api_client(auth.router, cookies={"access_token_fnol": token}) as client:
+                return [await client.get("/auth/me") for _ in range(5)]
+        with patch.object(auth.jwt, "decode", wraps=auth.jwt.decode) as decode:
+            responses = asyncio.run(calls())
+        assert [r.json()["user_id"] for r in responses] == [7] * 5
+        assert decode.call_count == 1
+
+    def test_logout_revokes_token(self, app_modules, api_client):
+        """Test that a token presented after logout is refused although its JWT is still valid"""
+        from datetime import timedelta
+        from routers import auth
+
+        token = auth.create_access_token("leaving", 8, "user", timedelta(minutes=5))
+
+        async def calls():
+            async with api_client(auth.router, cookies={"access_token_fnol": token}) as client:
+                before = await client.get("/auth/me")
+                await client.post("/auth/logout")
+            async with api_client(auth.router, cookies={"access_token_fnol": token}) as client:
+                return before, await client.get("/auth/me")
+        before, after = asyncio.run(calls())
+        assert before.status_code == 200
+        assert after.status_code == 401
+
+    def test_revoked_token_is_refused_although_its_claims_are_cached(self, app_modules, api_client):
+        """Test that a revocation wins over claims cached before it or written back by a request racing it"""
+        import time
+        from datetime import timedelta
+        from routers import auth
+
+        token = auth.create_access_token("racing", 9, "user", timedelta(minutes=5))
+
+        async def calls():
+            async with api_client(auth.router, cookies={"access_token_fnol": token}) as client:
+                before = await client.get("/auth/me")
+                # logout on another worker, then a request that decoded the token before it caches it again
+                await auth.token_cache.arevoke(token, time.time() + 300)
+                await auth.token_cache.aput(token, before.json(), time.time() + 300)
+                return before, await client.get("/auth/me")
+        before, after = asyncio.run(calls())
+        assert before.status_code == 200
+        assert after.status_code == 401
+
+    def test_entries_expire_with_the_token_and_revocations_are_kept(self, app_modules):
+        """Test that an entry is never served past its exp and a revoked token stays revoked"""
+        import time
+        from helpers.cache import Cache, MemoryBackend
+        from helpers.token_cache import TokenCache
+
+        cache = TokenCache(Cache(MemoryBackend()), max_ttl=60)
+        cache.put("expired", {"user_id": 1}, time.time() - 1)
+        assert cache.get("expired") is None
+        cache.put("a", {"user_id": 1}, time.time() + 60)
+        assert cache.get("a") == {"user_id": 1}
+        cache.revoke("a", time.time() + 60)
+        assert cache.get("a") is None and cache.is_revoked("a")
+        assert cache.snapshot()["claims"]["hits"] == 1
+
+        async def handler_calls():
+            await cache.aput("b", {"user_id": 2}, time.time() + 60)
+            cached = await cache.aget("b")
+            await cache.arevoke("b", time.time() + 60)
+            return cached, await cache.aget("b"), await cache.ais_revoked("b")
+        assert asyncio.run(handler_calls()) == ({"user_id": 2}, None, True)
+
+
+class TestConditionalGet:
+    """Test cases for ETags and the commit-invalidated response cache"""
+
+    def _seed(self, app_modules):
+        from datetime import date
+        model = app_modules.model
+        with app_modules.database.sessionlocal() as db:
+            claim = model.Claims(policy_id=1, subject_id=1, damage_description_user="dent",
+                                 damage_description_llm="dent", severity_level="Low", damage_percentage=1.0,
+                                 damage_image_path={}, date_of_incident=date(2025, 1, 1),
+                                 location_of_incident="Pune", requested_amount=1.0, claim_status="in-review")
+            db.add(claim)
+            db.commit()
+            return claim.claim_id
+
+    async def _poll(self, app_modules, api_client, claim_id):
+        from sqlalchemy import event
+        from routers import claims
+
+        statements = []
+        engine = app_modules.database.async_engine.sync_engine
+        capture = lambda conn, cursor, statement, *args: statements.append(statement)
+        path = f"/claims/claim_details/{claim_id}"
+        async with api_client(claims.router) as client:
+            first = await client.get(path)
+            event.listen(engine, "before_cursor_execute", capture)
+            try:
+                revalidated = await client.get(path, headers={"If-None-Match": first.headers["ETag"]})
+            finally:
+                event.remove(engine, "before_cursor_execute", capture)
+            await client.put(path, json={"claim_status": "accepted"})
+            changed = await client.get(path, headers={"If-None-Match": first.headers["ETag"]})
+        return first, revalidated, changed, statements
+
+    def test_unchanged_claim_is_304_without_queries(self, app_modules, api_client):
+        """Test that polling an unchanged claim answers 304 from the cache without touching the database"""
+        first, revalidated, _, statements = asyncio.run(self._poll(app_modules, api_client, self._seed(app_modules)))
+        assert first.status_code == 200 and first.headers["ETag"]
+        assert revalidated.status_code == 304 and revalidated.content == b""
+        assert statements == []
+
+    def test_commit_invalidates_and_changes_etag(self, app_modules, api_client):
+        """Test that an update drops the cached response and the next poll gets the new version"""
+        first, _, changed, _ = asyncio.run(self._poll(app_modules, api_client, self._seed(app_modules)))
+        assert changed.status_code == 200
+        assert changed.json()["claim_status"] == "accepted"
+        assert changed.headers["ETag"] != first.headers["ETag"]
+
+    def test_overlapping_writes_both_commit_and_bump_the_version(self, app_modules):
+        """Test that two writers of the same claim both succeed, the last write wins and each gets a new version"""
+        from database.model import Claims
+
+        claim_id = self._seed(app_modules)
+
+        async def scenario():
+            sessions = app_modules.database.async_sessionlocal
+            async with sessions() as first, sessions() as second:
+                mine, theirs = await first.get(Claims, claim_id), await second.get(Claims, claim_id)
+                start = mine.version
+                mine.location_of_incident, theirs.location_of_incident = "Nashik", "Nagpur"
+                await first.commit()
+                await second.commit()
+                versions = (start, mine.version, theirs.version)
+            async with sessions() as db:
+                saved = await db.get(Claims, claim_id)
+                return versions, saved.version, saved.location_of_incident
+        (start, after_first, after_second), version, location = asyncio.run(scenario())
+        assert (after_first, after_second, version) == (start + 1, start + 2, start + 2)
+        assert location == "Nagpur"
+
+    def test_rolled_back_changes_keep_cache(self, app_modules):
+        """Test that only committed rows invalidate cached responses"""
+        from database.model import Claims
+        from helpers.response_cache import ResponseCache, install
+        from sqlalchemy.orm import sessionmaker
+
+        claim_id = self._seed(app_modules)
+        cache = ResponseCache()
+        factory = sessionmaker(bind=app_modules.database.engine)
+        install(factory, cache)
+        cache.put(("claim", claim_id), b"{}", '"v1"', {f"claim:{claim_id}"})
+        with factory() as db:
+            db.get(Claims, claim_id).remarks = "draft"
+            db.flush()
+            db.rollback()
+        assert cache.get(("claim", claim_id)) is not None
+        with factory() as db:
+            db.get(Claims, claim_id).remarks = "final"
+            db.commit()
+        assert cache.get(("claim", claim_id)) is None
+
+
+class TestUserAvailability:
+    """Test cases for the Bloom-filter backed availability checks"""
+
+    async def _check(self, app_modules, api_client, params_list):
+        from sqlalchemy import event
+        from routers import user
+
+        engine = app_modules.database.async_engine.sync_engine
+        results = []
+        async with api_client(user.router) as client:
+            await client.get("/users/availability", params={"username": "warm-up"})
+            for params in params_list:
+                statements = []
+                capture = lambda conn, cursor, statement, *args: statements.append(statement)
+                event.listen(engine, "before_cursor_execute", capture)
+                try:
+                    response = await client.get("/users/availability", params=params)
+                finally:
+                    event.remove(engine, "before_cursor_execute", capture)
+                results.append((response, statements))
+        return results
+
+    def test_free_values_need_no_query_and_taken_ones_one_exists(self, app_modules, api_client):
+        """Test that unseen values are free without SQL and possible hits are settled by one EXISTS"""
+        from datetime import date
+        model = app_modules.model
+        with app_modules.database.sessionlocal() as db:
+            db.add(model.User(username="taken_name", firstname="T", lastname="N", hashed_password="x",
+                              dateofbirth=date(1990, 1, 1), email="taken@example.com", phone="5550001"))
+            db.commit()
+
+        (free, free_sql), (taken, taken_sql), (empty, _) = asyncio.run(self._check(app_modules, api_client, [
+            {"username": "brand_new_name", "email": "brand_new@example.com"},
+            {"username": "taken_name", "email": "free@example.com", "phone": "5550001"},
+            {},
+        ]))
+        assert free.json() == {"username": {"exists": False, "available": True},
+                               "email": {"exists": False, "available": True}}
+        assert free_sql == []
+        assert taken.json()["username"]["exists"] and taken.json()["phone"]["exists"]
+        assert not taken.json()["email"]["exists"]
+        assert len(taken_sql) == 1 and "EXISTS" in taken_sql[0].upper()
+        assert empty.status_code == 400
+
+    def test_users_renamed_by_another_worker_are_synced(self, app_modules):
+        """Test that a username changed outside this worker's sessions is reported taken after the next sync"""
+        from datetime import date
+        from sqlalchemy import update
+        from helpers.availability import user_availability
+        model = app_modules.model
+        with app_modules.database.sessionlocal() as db:
+            renamed = model.User(username="before_rename", firstname="R", lastname="N", hashed_password="x",
+                                 dateofbirth=date(1990, 1, 1), email="rename@example.com")
+            db.add(renamed)
+            db.commit()
+            user_id = renamed.user_id
+
+        async def check():
+            async with app_modules.database.async_sessionlocal() as db:
+                await user_availability.exists(db, username="after_rename")
+                # another worker's commit, which this worker's session events never see
+                with app_modules.database.engine.begin() as conn:
+                    conn.execute(update(model.User).where(model.User.user_id == user_id)
+                                 .values(username="after_rename"))
+                user_availability._synced_at = 0.0
+                return await user_availability.exists(db, username="after_rename")
+        assert asyncio.run(check()) == {"username": True}
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        """Test that every added value is reported present and the false positive rate stays near the target"""
+        from src.helpers.bloom import BloomFilter
+
+        bloom = BloomFilter(capacity=5000, error_rate=0.01)
+        for i in range(5000):
+            bloom.add(f"user{i}")
+        assert all(f"user{i}" in bloom for i in range(5000))
+        false_positives = sum(f"other{i}" in bloom for i in range(10000))
+        assert false_positives < 300
+
+
+class TestLLMCache:
+    """Test cases for the content-addressed LLM answer cache"""
+
+    def _photo(self, fmt):
+        import io
+        from PIL import Image
+
+        buffer = io.BytesIO()
+        Image.new("RGB", (32, 24), (200, 30, 30)).save(buffer, format=fmt)
+        return ("door." + fmt.lower(), buffer.getvalue(), "image/" + fmt.lower())
+
+    async def _validate(self, app_modules, api_client, submissions):
+        from helpers.jobs import JobWorker
+        from routers import jobs, llmRoute
+
+        worker = JobWorker(app_modules.database.async_sessionlocal, retry_base=0)
+        results = []
+        async with api_client(llmRoute.router, jobs.router) as client:
+            for params, fmt in submissions:
+                submitted = await client.post("/llm/claim_validation", params=params,
+                                              files=[("images", self._photo(fmt))])
+                assert submitted.status_code == 202
+                await worker.drain()
+                results.append((await client.get(submitted.headers["location"])).json()["result"])
+        return results
+
+    def test_resubmission_is_answered_from_cache(self, app_modules, api_client, monkeypatch):
+        """Test that the same photos and parameters hit the cache, re-encoded or not, unless bypassed"""
+        from AI_ML import agents
+
+        calls = []
+
+        async def gemini_ai(prompt, *images):
+            calls.append(len(images))
+            return '```json\n{"severity": "minor"}\n```'
+        monkeypatch.setattr(agents, "gemini_ai", gemini_ai)
+        claim = {"damage_description": "scratch on door", "requested_amount": 5000, "claimable_amount": 4000}
+        first, again, other, bypassed = asyncio.run(self._validate(app_modules, api_client, [
+            (claim, "PNG"),
+            (claim, "BMP"),
+            ({**claim, "requested_amount": 9000}, "PNG"),
+            ({**claim, "use_cache": "false"}, "PNG"),
+        ]))
+        assert first == {"valid": True, "details": {"severity": "minor"}, "cached": False, "tier": "gemini",
+                         "escalation": ["exceeds_policy"], "local_predictions": None}
+        assert again["cached"] and again["details"] == {"severity": "minor"}
+        assert not other["cached"] and not bypassed["cached"]
+        assert calls == [1, 1, 1]
+
+    def test_unparseable_answers_are_not_cached(self, app_modules, monkeypatch):
+        """Test that an answer that could not be parsed is asked for again next time"""
+        from AI_ML import agents
+
+        answers = iter(["not json", '{"severity": "major"}'])
+
+        async def gemini_ai(prompt, *images):
+            return next(answers)
+        monkeypatch.setattr(agents, "gemini_ai", gemini_ai)
+        report = lambda: asyncio.run(agents.claims_damage_report("bumper torn off", 1.0, 1.0, [self._open("PNG")]))
+        with pytest.raises(ValueError):
+            report()
+        assert report()["cached"] is False
+
+    def _open(self, fmt):
+        import io
+        from PIL import Image
+        return Image.open(io.BytesIO(self._photo(fmt)[1]))
+
+
+class TestLLMSingleFlight:
+    """Test cases for coalescing identical LLM calls in flight"""
+
+    def test_double_submit_makes_one_model_call(self, app_modules, monkeypatch):
+        """Test that concurrent identical claim analyses share one call, with or without the cache"""
+        from PIL import Image
+        from AI_ML import agents, llm_cache
+
+        calls = []
+
+        async def gemini_ai(prompt, *images):
+            calls.append(prompt)
+            await asyncio.sleep(0.1)
+            return '{"severity": "minor"}'
+        monkeypatch.setattr(agents, "gemini_ai", gemini_ai)
+        image = Image.new("RGB", (8, 8), (1, 2, 3))
+
+        async def submit_twice(description, use_cache):
+            return await asyncio.gather(*(agents.claims_damage_report(description, 1.0, 1.0, [image], use_cache)
+                                          for _ in range(3)))
+        before = llm_cache.single_flight_snapshot()["saved_calls"]
+        bypassed = asyncio.run(submit_twice("mirror knocked off", use_cache=False))
+        cached = asyncio.run(submit_twice("tail light cracked", use_cache=True))
+        assert len(calls) == 2
+        assert all(r["details"] == {"severity": "minor"} for r in bypassed + cached)
+        assert llm_cache.single_flight_snapshot()["saved_calls"] - before == 4
+
+
+class TestGeminiClient:
+    """Test cases for the shared async Gemini client"""
+
+    class _Model:
+        def __init__(self, delay):
+            self.delay = delay
+            self.in_flight = self.peak = 0
+
+        async def generate_content_async(self, contents, **kwargs):
+            from types import SimpleNamespace
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            try:
+                await asyncio.sleep(self.delay)
+            finally:
+                self.in_flight -= 1
+            return SimpleNamespace(text=f"{len(contents)} parts")
+
+    def test_calls_are_limited_and_leave_the_loop_free(self, app_modules):
+        """Test that at most max_concurrency calls run at once while other coroutines keep running"""
+        from PIL import Image
+        from AI_ML.gemini import GeminiClient
+
+        client = GeminiClient("key", "gemini-test", max_concurrency=2, timeout=5)
+        client._model = model = self._Model(0.05)
+        ticks = []
+
+        async def heartbeat():
+            for _ in range(10):
+                ticks.append(1)
+                await asyncio.sleep(0.01)
+
+        async def run():
+            calls = [client.generate([Image.new("RGB", (8, 8)), {"text": "hi"}]) for _ in range(6)]
+            return await asyncio.gather(*calls, heartbeat())
+        results = asyncio.run(run())
+        assert [r.text for r in results[:6]] == ["2 parts"] * 6
+        assert model.peak == 2 and len(ticks) == 10
+        assert client.snapshot()["calls"] == 6 and client.snapshot()["in_flight"] == 0
+
+    def test_slow_call_times_out(self, app_modules):
+        """Test that a call exceeding the timeout raises instead of holding the request"""
+        from AI_ML.gemini import GeminiClient
+
+        client = GeminiClient("key", "gemini-test", max_concurrency=1, timeout=0.05)
+        client._model = self._Model(1)
+        with pytest.raises(TimeoutError):
+            asyncio.run(client.generate([{"text": "hi"}]))
+        assert client.snapshot()["timeouts"] == 1
+
+
+class TestLLMResilience:
+    """Test cases for retries, rate limiting, the circuit breaker and the local fallback"""
+
+    def _setup(self, app_modules, monkeypatch, gemini_errors, fallback=None):
+        from AI_ML import agents
+        from AI_ML.resilience import CircuitBreaker
+
+        calls = {"gemini": 0, "fallback": 0}
+        errors = iter(gemini_errors)
+
+        async def gemini_ai(prompt, *images):
+            calls["gemini"] += 1
+            error = next(errors, None)
+            if error is not None:
+                raise error
+            return '{"source": "gemini"}'
+
+        def llava_ai(prompt, *images):
+            calls["fallback"] += 1
+            if fallback is not None:
+                raise fallback
+            return '{"source": "local"}'
+
+        monkeypatch.setattr(agents, "gemini_ai", gemini_ai)
+        monkeypatch.setattr(agents, "llava_ai", llava_ai)
+        monkeypatch.setattr(agents, "gemini_breaker", CircuitBreaker(failure_threshold=2, reset_timeout=60))
+        monkeypatch.setattr(agents, "gemini_retries", 1)
+        monkeypatch.setattr(agents, "gemini_retry_base", 0.001)
+        return agents, calls
+
+    def _report(self, agents, text):
+        from PIL import Image
+        return asyncio.run(agents.claims_damage_report(text, 1.0, 1.0, [Image.new("RGB", (8, 8))]))
+
+    def test_transient_error_is_retried(self, app_modules, monkeypatch):
+        """Test that one transient Gemini error is retried and answered by Gemini"""
+        from google.api_core.exceptions import ServiceUnavailable
+
+        agents, calls = self._setup(app_modules, monkeypatch, [ServiceUnavailable("busy")])
+        assert self._report(agents, "retried once")["details"] == {"source": "gemini"}
+        assert calls == {"gemini": 2, "fallback": 0}
+
+    def test_open_breaker_fails_over_without_calling_gemini(self, app_modules, monkeypatch):
+        """Test that repeated failures open the breaker and later calls go to the local model, uncached"""
+        from google.api_core.exceptions import ServiceUnavailable
+
+        agents, calls = self._setup(app_modules, monkeypatch, [ServiceUnavailable("down")] * 4)
+        first = self._report(agents, "brownout one")
+        second = self._report(agents, "brownout two")
+        assert calls == {"gemini": 4, "fallback": 2}
+        assert agents.gemini_breaker.state == "open"
+        third = self._report(agents, "brownout two")
+        assert calls == {"gemini": 4, "fallback": 3}
+        assert [r["details"]["source"] for r in (first, second, third)] == ["local"] * 3
+        assert not third["cached"]
+        assert agents.resilience_snapshot()["breaker"]["refused"] == 1
+
+    def test_no_answer_at_all_fails_the_job_with_503(self, app_modules, api_client, monkeypatch):
+        """Test that the job is retried, then fails with a 503 when Gemini and the local model both fail"""
+        import io
+        from google.api_core.exceptions import ServiceUnavailable
+        from PIL import Image
+        from helpers.jobs import JobWorker
+        from routers import jobs, llmRoute
+
+        _, calls = self._setup(app_modules, monkeypatch, [ServiceUnavailable("down")] * 10,
+                               fallback=ConnectionError("no ollama"))
+        photo = io.BytesIO()
+        Image.new("RGB", (8, 8)).save(photo, format="PNG")
+
+        async def post():
+            async with api_client(llmRoute.router, jobs.router) as client:
+                submitted = await client.post("/llm/claim_validation", files=[("images", ("a.png", photo.getvalue()))],
+                                              params={"damage_description": "nothing answers", "requested_amount": 1,
+                                                      "claimable_amount": 1})
+                await JobWorker(app_modules.database.async_sessionlocal, retry_base=0).drain()
+                return (await client.get(submitted.headers["location"])).json()
+        job = asyncio.run(post())
+        assert job["status"] == "failed" and job["attempts"] == 3
+        assert job["error"]["status_code"] == 503
+        assert "local model failed" in job["error"]["detail"]
+        # two attempts open the breaker, the third goes straight to the fallback
+        assert calls == {"gemini": 4, "fallback": 3}
+
+    def test_token_bucket_rejects_beyond_max_wait(self):
+        """Test that the bucket allows a burst, then refuses calls that would wait too long"""
+        from src.AI_ML.resilience import RateLimited, TokenBucket
+
+        bucket = TokenBucket(rate=1.0, burst=2)
+
+        async def take(n, max_wait):
+            for _ in range(n):
+                await bucket.acquire(max_wait)
+        asyncio.run(take(2, 0))
+        with pytest.raises(RateLimited):
+            asyncio.run(take(1, 0.1))
+        assert bucket.snapshot()["rejected"] == 1
+
+
+class TestJobQueue:
+    """Test cases for the database-backed background job queue"""
+
+    async def _get(self, api_client, path):
+        from routers import jobs
+
+        async with api_client(jobs.router) as client:
+            return await client.get(path)
+
+    async def _submit(self, app_modules, kind, payload, max_attempts=3):
+        from helpers.jobs import submit
+
+        async with app_modules.database.async_sessionlocal() as db:
+            return (await submit(db, kind, payload, max_attempts=max_attempts)).job_id
+
+    def test_submitted_job_is_polled_until_it_has_a_result(self, app_modules, api_client, monkeypatch):
+        """Test that a job is reported queued, then succeeded with its handler's result"""
+        from helpers import jobs
+
+        async def echo(payload):
+            return {"echo": payload["value"]}
+        monkeypatch.setitem(jobs.HANDLERS, "test.echo", echo)
+
+        async def scenario():
+            job_id = await self._submit(app_modules, "test.echo", {"value": 7})
+            pending = await self._get(api_client, f"/jobs/{job_id}")
+            await jobs.JobWorker(app_modules.database.async_sessionlocal).drain()
+            return pending, await self._get(api_client, f"/jobs/{job_id}"), await self._get(api_client, "/jobs/unknown")
+        pending, done, missing = asyncio.run(scenario())
+        assert pending.json()["status"] == "queued" and pending.headers["retry-after"]
+        assert done.json()["status"] == "succeeded" and done.json()["result"] == {"echo": 7}
+        assert "retry-after" not in done.headers
+        assert missing.status_code == 404
+
+    def test_expired_lease_is_taken_over_and_the_late_result_dropped(self, app_modules, api_client, monkeypatch):
+        """Test that a job whose worker stopped renewing its lease runs again elsewhere, once"""
+        from datetime import timedelta
+        from sqlalchemy import update
+        from helpers import jobs
+
+        async def slow(payload):
+            return {"by": payload["worker"]}
+        monkeypatch.setitem(jobs.HANDLERS, "test.lease", slow)
+        first = jobs.JobWorker(app_modules.database.async_sessionlocal, lease=30, worker_id="first")
+        second = jobs.JobWorker(app_modules.database.async_sessionlocal, lease=30, worker_id="second")
+
+        async def scenario():
+            job_id = await self._submit(app_modules, "test.lease", {"worker": "second"})
+            [stuck] = await first.claim(1)
+            assert await second.claim(1) == []
+            async with app_modules.database.async_sessionlocal() as db:
+                await db.execute(update(app_modules.model.Job).where(app_modules.model.Job.job_id == job_id)
+                                 .values(lease_expires_at=jobs.utcnow() - timedelta(seconds=1)))
+                await db.commit()
+            [taken_over] = await second.claim(1)
+            await second.run_job(taken_over)
+            stuck.payload = {"worker": "first"}
+            await first.run_job(stuck)
+            return (await self._get(api_client, f"/jobs/{job_id}")).json()
+        job = asyncio.run(scenario())
+        assert job["status"] == "succeeded" and job["result"] == {"by": "second"} and job["attempts"] == 2
+        assert second.metrics["reclaimed"] == 1 and first.metrics["lease_lost"] == 1
+
+    def test_job_outliving_its_last_lease_fails_and_drops_its_uploads(self, app_modules, api_client, monkeypatch):
+        """Test that the sweep fails a job whose every attempt lost its worker and deletes its spooled uploads"""
+        import io
+        from datetime import timedelta
+        from sqlalchemy import update
+        from starlette.datastructures import UploadFile
+        from helpers import jobs
+
+        Job = app_modules.model.Job
+        monkeypatch.setitem(jobs.HANDLERS, "test.crashing", lambda payload: None)
+
+        async def scenario():
+            async with app_modules.database.async_sessionlocal() as db:
+                job = await jobs.submit(db, "test.crashing", {}, [UploadFile(io.BytesIO(b"photo"), filename="a.jpg")],
+                                        max_attempts=1)
+                job_id = job.job_id
+            spooled = jobs.spool_dir(job_id).exists()
+            async with app_modules.database.async_sessionlocal() as db:
+                await db.execute(update(Job).where(Job.job_id == job_id)
+                                 .values(status="running", attempts=1,
+                                         lease_expires_at=jobs.utcnow() - timedelta(seconds=1)))
+                await db.commit()
+            await jobs.JobWorker(app_modules.database.async_sessionlocal).claim(1)
+            return spooled, jobs.spool_dir(job_id).exists(), (await self._get(api_client, f"/jobs/{job_id}")).json()
+        spooled, still_spooled, job = asyncio.run(scenario())
+        assert spooled and not still_spooled
+        assert job["status"] == "failed" and job["error"]["status_code"] == 500
+
+    def test_retryable_errors_are_retried_until_attempts_run_out(self, app_modules, api_client, monkeypatch):
+        """Test that retryable failures are attempted again and the last error is reported"""
+        from helpers import jobs
+
+        attempts = []
+
+        async def flaky(payload):
+            attempts.append(1)
+            raise jobs.JobError("upstream busy", status_code=503, retryable=True)
+
+        def invalid(payload):
+            attempts.append(1)
+            raise jobs.JobError("bad input", status_code=422)
+        monkeypatch.setitem(jobs.HANDLERS, "test.flaky", flaky)
+        monkeypatch.setitem(jobs.HANDLERS, "test.invalid", invalid)
+
+        async def scenario():
+            flaky_id = await self._submit(app_modules, "test.flaky", {}, max_attempts=2)
+            invalid_id = await self._submit(app_modules, "test.invalid", {})
+            await jobs.JobWorker(app_modules.database.async_sessionlocal, retry_base=0).drain()
+            flaky_job = (await self._get(api_client, f"/jobs/{flaky_id}")).json()
+            return flaky_job, (await self._get(api_client, f"/jobs/{invalid_id}")).json()
+        flaky_job, invalid_job = asyncio.run(scenario())
+        assert len(attempts) == 3
+        assert flaky_job["attempts"] == 2 and flaky_job["error"] == {"status_code": 503, "detail": "upstream busy"}
+        assert invalid_job["attempts"] == 1 and invalid_job["error"]["status_code"] == 422
+
+    def test_unsupported_documents_are_refused_up_front(self, app_modules, api_client):
+        """Test that text extraction is only queued for file types Transform can read"""
+        from routers import jobs
+
+        async def post(name):
+            async with api_client(jobs.router) as client:
+                return await client.post("/jobs/document_text", files=[("file", (name, b"%PDF-1.4"))])
+        refused, queued = asyncio.run(post("tool.exe")), asyncio.run(post("report.pdf"))
+        assert refused.status_code == 415
+        assert queued.status_code == 202 and queued.headers["location"] == f"/jobs/{queued.json()['job_id']}"
+
+    def test_standalone_worker_runs_registered_handlers(self, app_modules, api_client):
+        """Test that `python -m helpers.job_worker work --once` finds the handlers and completes a queued job"""
+        import io
+        import os
+        import subprocess
+        import sys
+        from pathlib import Path
+        from docx import Document
+        from starlette.datastructures import UploadFile
+        from helpers.jobs import submit
+
+        document = io.BytesIO()
+        statement = Document()
+        statement.add_paragraph("Left mirror knocked off by a bus")
+        statement.save(document)
+        document.seek(0)
+
+        async def queue():
+            async with app_modules.database.async_sessionlocal() as db:
+                upload = UploadFile(document, filename="statement.docx")
+                return (await submit(db, "documents.file_to_text", {"filename": "statement.docx"}, [upload])).job_id
+        job_id = asyncio.run(queue())
+        worker = subprocess.run([sys.executable, "-m", "helpers.job_worker", "work", "--once"],
+                                cwd=Path(__file__).resolve().parent.parent / "src", env=os.environ,
+                                capture_output=True, text=True, timeout=120)
+        assert worker.returncode == 0, worker.stderr
+        job = asyncio.run(self._get(api_client, f"/jobs/{job_id}")).json()
+        assert job["status"] == "succeeded", job["error"]
+        assert job["result"]["text"].strip() == "Left mirror knocked off by a bus"
+
+
+class TestClaimValidationStream:
+    """Test cases for the server-sent events variant of claim validation"""
+
+    REPORT = ('```json\n{"damage_analysis": "Dented rear door", "damage_percentage": "35%", '
+              '"severity_level": "moderate", "approvable_amount": 12000, '
+              '"reason_for_approval": "Typical panel repair", "remarks": "None"}\n```')
+
+    def _setup(self, monkeypatch, streams):
+        from AI_ML import agents
+        from AI_ML.resilience import CircuitBreaker
+
+        calls = iter(streams)
+
+        async def stream(contents, **kwargs):
+            for piece in next(calls):
+                if isinstance(piece, Exception):
+                    raise piece
+                yield piece
+        monkeypatch.setattr(agents.gemini, "stream", stream)
+        monkeypatch.setattr(agents, "gemini_breaker", CircuitBreaker())
+        monkeypatch.setattr(agents, "gemini_retry_base", 0.001)
+
+    def _events(self, api_client, description):
+        import io
+        import json
+        from PIL import Image
+        from routers import llmRoute
+
+        photo = io.BytesIO()
+        Image.new("RGB", (16, 16), (10, 120, 10)).save(photo, format="PNG")
+
+        async def post():
+            async with api_client(llmRoute.router) as client:
+                return await client.post("/llm/claim_validation/stream", files=[("images", ("a.png", photo.getvalue()))],
+                                         params={"damage_description": description, "requested_amount": 15000,
+                                                 "claimable_amount": 20000})
+        response = asyncio.run(post())
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = []
+        for block in response.text.strip().split("\n\n"):
+            event, data = block.split("\n")
+            events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+        return events
+
+    def test_chunks_arrive_before_the_validated_result(self, app_modules, api_client, monkeypatch):
+        """Test that the answer streams in pieces, ends with a validated report and is cached for next time"""
+        pieces = [self.REPORT[:20], self.REPORT[20:70], self.REPORT[70:]]
+        self._setup(monkeypatch, [pieces])
+        events = self._events(api_client, "rear door dented by a trolley")
+        assert [name for name, _ in events] == ["chunk", "chunk", "chunk", "result"]
+        assert "".join(data["text"] for _, data in events[:-1]) == self.REPORT
+        result = events[-1][1]
+        assert result["valid"] and not result["cached"]
+        assert result["details"]["damage_percentage"] == 35.0 and result["details"]["severity_level"] == "Moderate"
+        again = self._events(api_client, "rear door dented by a trolley")
+        assert [name for name, _ in again] == ["result"] and again[0][1]["cached"]
+
+    def test_retry_after_partial_output_resets_the_stream(self, app_modules, api_client, monkeypatch):
+        """Test that chunks sent before a transient failure are discarded with a reset event"""
+        from google.api_core.exceptions import ServiceUnavailable
+
+        self._setup(monkeypatch, [[self.REPORT[:30], ServiceUnavailable("dropped")], [self.REPORT]])
+        events = self._events(api_client, "bonnet crumpled in a rear-end collision")
+        assert [name for name, _ in events] == ["chunk", "reset", "chunk", "result"]
+        assert events[2][1]["text"] == self.REPORT
+
+    def test_answer_outside_the_schema_ends_with_an_error_and_is_not_cached(self, app_modules, api_client, monkeypatch):
+        """Test that a report missing required fields ends the stream with a 502 error event and is asked again"""
+        self._setup(monkeypatch, [['{"damage_analysis": "unclear", "severity_level": "Extreme"}'], [self.REPORT]])
+        events = self._events(api_client, "windscreen shattered by hail")
+        assert events[-1][0] == "error" and events[-1][1]["status_code"] == 502
+        again = self._events(api_client, "windscreen shattered by hail")
+        assert again[-1][0] == "result" and not again[-1][1]["cached"]
+
+
+class TestPhotoQualityGate:
+    """Test cases for the blur, exposure, resolution and duplicate checks before any model call"""
+
+    def _photo(self, seed, size=(800, 600), blur=0, scale=1.0):
+        import io
+        import numpy as np
+        from PIL import Image, ImageFilter
+
+        pixels = np.random.default_rng(seed).integers(0, 255, (size[1], size[0], 3)) * scale
+        image = Image.fromarray(pixels.astype(np.uint8))
+        if blur:
+            image = image.filter(ImageFilter.GaussianBlur(blur))
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=90)
+        return buffer
+
+    def test_usable_photos_pass(self, app_modules):
+        """Test that four sharp, well exposed, distinct photos have no problems and are rewound"""
+        from AI_ML.quality import check_photos
+
+        photos = {name: self._photo(seed) for seed, name in enumerate(["front", "back", "left", "right"])}
+        assert check_photos(photos) == []
+        assert all(photo.tell() == 0 for photo in photos.values())
+
+    def test_each_problem_is_reported_with_how_to_fix_it(self, app_modules):
+        """Test that blurry, dark, tiny, unreadable and repeated photos each get an actionable reason"""
+        import io
+        from AI_ML.quality import check_photos
+
+        front = self._photo(1)
+        problems = check_photos({"front": front, "back": self._photo(2, blur=6), "left": self._photo(3, scale=0.1),
+                                 "right": io.BytesIO(b"not a photo"), "spare": self._photo(4, size=(200, 150)),
+                                 "again": io.BytesIO(front.getvalue())})
+        found = {(problem["check"], tuple(problem["photos"])) for problem in problems}
+        assert {("blur", ("back",)), ("underexposed", ("left",)), ("unreadable", ("right",)),
+                ("resolution", ("spare",)), ("duplicate", ("front", "again"))} <= found
+        assert not any(problem["photos"] == ["front"] for problem in problems)
+        blur = next(problem for problem in problems if problem["check"] == "blur")
+        assert blur["detail"].startswith("The back photo is blurry") and "retake" in blur["detail"]
+
+    def test_oversized_photo_is_reported_unreadable(self, app_modules, monkeypatch):
+        """Test that a photo past PIL's decompression bomb limit is a problem to report, not an error"""
+        from PIL import Image
+        from AI_ML.quality import check_photos
+
+        monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 100_000)
+        problems = check_photos({"front": self._photo(1), "back": self._photo(2, size=(400, 200))})
+        assert [problem["photos"] for problem in problems if problem["check"] == "unreadable"] == [["front"]]
+
+    def test_endpoints_reject_bad_photos_before_saving_or_queueing(self, app_modules, api_client):
+        """Test that the upload and the vehicle check answer 422 with the problems and keep good uploads intact"""
+        from sqlalchemy import func, select
+        from routers import jobs, llmRoute, vehicle
+
+        good = {name: self._photo(seed).getvalue() for seed, name in enumerate(["front", "back", "left", "right"])}
+        blurry = {**good, "left": self._photo(9, blur=6).getvalue()}
+
+        def files(photos):
+            return [(f"{name}_img", (f"{name}.jpg", data, "image/jpeg")) for name, data in photos.items()]
+
+        async def scenario():
+            async with api_client(vehicle.router, llmRoute.router, jobs.router) as client:
+                checked = await client.post("/llm/extract_vehicle_details", files=files(blurry),
+                                            params={"make": "Maruti", "model": "Swift", "type": "fourwheeler",
+                                                    "year": 2019})
+                rejected = await client.post("/vehicles/upload_vehicle_images", files=files(blurry),
+                                             params={"folder_name": "KA01", "typeofvehicle": "car"})
+                uploaded = await client.post("/vehicles/upload_vehicle_images", files=files(good),
+                                             params={"folder_name": "KA02", "typeofvehicle": "car"})
+            async with app_modules.database.async_sessionlocal() as db:
+                queued = await db.scalar(select(func.count()).select_from(app_modules.model.Job)
+                                         .where(app_modules.model.Job.kind == "llm.extract_vehicle_details"))
+            return checked, rejected, uploaded, queued
+        checked, rejected, uploaded, queued = asyncio.run(scenario())
+        for response in (checked, rejected):
+            assert response.status_code == 422
+            assert [problem["check"] for problem in response.json()["detail"]["problems"]] == ["blur"]
+        assert queued == 0
+        assert uploaded.status_code == 201
+        with open(uploaded.json()["paths"]["front"], "rb") as saved:
+            assert saved.read() == good["front"]
+
+
+class TestImageNormalization:
+    """Test cases for the scale-down and re-encode stage in front of the models"""
+
+    def _jpeg(self, size, orientation=None):
+        import io
+        import numpy as np
+        from PIL import Image
+
+        pixels = np.random.default_rng(0).integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+        image = Image.fromarray(pixels)
+        exif = Image.Exif()
+        if orientation:
+            exif[0x0112] = orientation
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=95, exif=exif.tobytes())
+        return buffer
+
+    def test_large_photo_is_upright_scaled_and_smaller(self, app_modules):
+        """Test that a rotated phone photo comes out upright, within max_side and as far fewer bytes"""
+        from AI_ML.preprocess import jpeg_bytes, normalize_image
+
+        source = self._jpeg((3000, 2000), orientation=6)
+        normalized = normalize_image(source, max_side=800, quality=80)
+        assert normalized.size == (533, 800) and normalized.mode == "RGB"
+        assert jpeg_bytes(normalized) is not None and len(jpeg_bytes(normalized)) * 5 < len(source.getvalue())
+        assert jpeg_bytes(normalized.copy()) is None
+
+    def test_small_and_non_jpeg_images_are_not_enlarged(self, app_modules):
+        """Test that a small transparent PNG keeps its size and becomes an RGB JPEG"""
+        import io
+        from PIL import Image
+        from AI_ML.preprocess import normalize_images
+
+        buffer = io.BytesIO()
+        Image.new("RGBA", (40, 30), (200, 10, 10, 128)).save(buffer, format="PNG")
+        (normalized,) = asyncio.run(normalize_images([buffer], max_side=800))
+        assert normalized.size == (40, 30) and normalized.format == "JPEG" and normalized.mode == "RGB"
+
+    def test_gemini_gets_the_normalized_jpeg_as_is(self, app_modules):
+        """Test that a normalized image is sent as its JPEG bytes and any other image as the SDK encodes it"""
+        from PIL import Image
+        from AI_ML.gemini import GeminiClient
+        from AI_ML.preprocess import jpeg_bytes, normalize_image
+
+        normalized = normalize_image(self._jpeg((1200, 900)), max_side=600)
+        blob, other, text = GeminiClient._encode([normalized, Image.new("RGB", (8, 8)), {"text": "prompt"}])
+        assert blob.mime_type == "image/jpeg" and blob.data == jpeg_bytes(normalized)
+        assert other.mime_type == "image/webp" and text == {"text": "prompt"}
+
+    def test_unreadable_uploads_are_422_and_not_retried(self, app_modules, api_client, monkeypatch):
+        """Test that truncated photos and decompression bombs answer 422, and a job with one fails without retries"""
+        from PIL import Image
+        from helpers.jobs import JobWorker
+        from routers import jobs, llmRoute
+
+        truncated = self._jpeg((400, 300)).getvalue()[:2000]
+        large = self._jpeg((600, 600)).getvalue()
+        monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 100_000)
+        claim = {"damage_description": "dent", "requested_amount": 1, "claimable_amount": 1}
+
+        async def scenario():
+            async with api_client(llmRoute.router, jobs.router) as client:
+                classified = [await client.post("/llm/damage_classify", files=[("images", ("a.jpg", photo))])
+                              for photo in (truncated, large)]
+                streamed = await client.post("/llm/claim_validation/stream", params=claim,
+                                             files=[("images", ("a.jpg", truncated))])
+                submitted = await client.post("/llm/claim_validation", params=claim,
+                                              files=[("images", ("a.jpg", truncated))])
+                await JobWorker(app_modules.database.async_sessionlocal, retry_base=0).drain()
+                return classified, streamed, (await client.get(submitted.headers["location"])).json()
+        classified, streamed, job = asyncio.run(scenario())
+        assert [response.status_code for response in classified] == [422, 422]
+        assert streamed.status_code == 422
+        assert job["status"] == "failed" and job["attempts"] == 1 and job["error"]["status_code"] == 422
+
+
+class TestTieredAssessor:
+    """Test cases for the local-first claim assessment that escalates to Gemini"""
+
+    REPORT = ('{"damage_analysis": "Shattered windscreen", "damage_percentage": 20, "severity_level": "High", '
+              '"approvable_amount": 30000, "reason_for_approval": "Glass replacement", "remarks": "None"}')
+
+    def _setup(self, monkeypatch, predict):
+        from AI_ML import agents, assessor
+        from AI_ML.batching import MicroBatcher
+
+        calls = {"gemini": 0, "classifier": 0}
+
+        def classify(images):
+            calls["classifier"] += 1
+            return [{"label": label, "score": score, "scores": {label: score}} for label, score in predict(images)]
+
+        async def gemini_ai(prompt, *images):
+            calls["gemini"] += 1
+            return self.REPORT
+        monkeypatch.setattr(assessor, "damage_batcher", MicroBatcher(classify, max_wait=0.001))
+        monkeypatch.setattr(agents, "gemini_ai", gemini_ai)
+        return calls
+
+    def _photos(self, *colors):
+        from PIL import Image
+
+        return [Image.new("RGB", (16, 16), color) for color in colors]
+
+    def test_confident_minor_damage_is_settled_locally(self, app_modules, monkeypatch):
+        """Test that a small claim for a clear scratch is answered by the classifier alone"""
+        from AI_ML.assessor import assess_claim, assessor_snapshot
+
+        calls = self._setup(monkeypatch, lambda images: [("scratch", 0.97)] * len(images))
+        before = assessor_snapshot()
+        result = asyncio.run(assess_claim("scratch on the rear bumper", 3000, 20000,
+                                          self._photos((200, 0, 0), (0, 200, 0)), use_cache=False))
+        assert result["tier"] == "local" and result["escalation"] == [] and result["valid"]
+        assert result["details"]["severity_level"] == "Low" and result["details"]["approvable_amount"] == 3000
+        assert [prediction["label"] for prediction in result["local_predictions"]] == ["scratch", "scratch"]
+        assert calls == {"gemini": 0, "classifier": 1}
+        assert assessor_snapshot()["local"] == before["local"] + 1
+
+    def test_uncertain_unusual_or_large_claims_go_to_gemini(self, app_modules, monkeypatch):
+        """Test that low confidence, other damage types and large amounts escalate with their reasons"""
+        from AI_ML.assessor import assess_claim
+
+        answers = iter([[("scratch", 0.55)], [("glass shatter", 0.99)]])
+        calls = self._setup(monkeypatch, lambda images: next(answers))
+
+        def assess(description, amount):
+            return asyncio.run(assess_claim(description, amount, 40000, self._photos((90, 90, 90)), use_cache=False))
+        uncertain = assess("scratch near the handle", 2000)
+        assert uncertain["tier"] == "gemini" and uncertain["escalation"] == ["low_confidence"]
+        assert uncertain["details"]["damage_analysis"] == "Shattered windscreen"
+        assert assess("windscreen cracked", 2000)["escalation"] == ["damage_type"]
+        large = assess("scratch along both doors", 35000)
+        assert large["escalation"] == ["amount"] and large["local_predictions"] is None
+        assert calls == {"gemini": 3, "classifier": 2}
+
+    def test_suspicious_claims_skip_the_classifier(self, app_modules, monkeypatch):
+        """Test that duplicate photos, amounts over the policy and alarming descriptions go straight to Gemini"""
+        from AI_ML.assessor import assess_claim
+
+        calls = self._setup(monkeypatch, lambda images: [("dent", 0.99)] * len(images))
+        duplicate = asyncio.run(assess_claim("small dent", 1500, 20000, self._photos((5, 5, 5), (5, 5, 5)),
+                                             use_cache=False))
+        assert duplicate["escalation"] == ["duplicate_photos"]
+        flagged = asyncio.run(assess_claim("dent after the car was stolen", 1500, 1000, self._photos((5, 5, 5)),
+                                           use_cache=False))
+        assert flagged["escalation"] == ["exceeds_policy", "description"]
+        assert calls == {"gemini": 2, "classifier": 0}
+
+
+class TestMicroBatcher:
+    """Test cases for the asyncio micro-batcher in front of local models"""
+
+    def test_concurrent_requests_share_batches(self, app_modules):
+        """Test that concurrent callers are batched up to max_batch_size and each gets its own results"""
+        from AI_ML.batching import MicroBatcher
+
+        batches = []
+
+        def run_batch(items):
+            batches.append(list(items))
+            return [item * 10 for item in items]
+        batcher = MicroBatcher(run_batch, max_batch_size=4, max_wait=0.05)
+
+        async def scenario():
+            return await asyncio.gather(*(batcher.submit([n, n + 100]) for n in range(5)))
+        results = asyncio.run(scenario())
+        assert results == [[n * 10, (n + 100) * 10] for n in range(5)]
+        assert [len(batch) for batch in batches] == [4, 4, 2]
+        snapshot = batcher.snapshot()
+        assert snapshot["batches"] == 3 and snapshot["mean_batch_size"] == 3.33 and snapshot["queue_depth"] == 0
+
+    def test_lone_request_waits_at_most_max_wait(self, app_modules):
+        """Test that a request runs once max_wait passes even though the batch isn't full"""
+        import time
+        from AI_ML.batching import MicroBatcher
+
+        batcher = MicroBatcher(lambda items: items, max_batch_size=64, max_wait=0.02)
+
+        async def timed():
+            start = time.perf_counter()
+            result = await batcher.submit(["x"])
+            return result, time.perf_counter() - start
+        result, elapsed = asyncio.run(timed())
+        assert result == ["x"] and 0.015 < elapsed < 0.5
+
+    def test_full_queue_and_failures_reach_the_callers(self, app_modules):
+        """Test that submissions beyond max_queue are refused and a failing batch fails all its callers"""
+        from AI_ML.batching import BatcherFull, MicroBatcher
+
+        def run_batch(items):
+            raise RuntimeError("model crashed")
+        batcher = MicroBatcher(run_batch, max_batch_size=8, max_wait=0.01, max_queue=3)
+
+        async def scenario():
+            return await asyncio.gather(batcher.submit([1, 2]), batcher.submit([3, 4]), batcher.submit([5]),
+                                        return_exceptions=True)
+        first, refused, last = asyncio.run(scenario())
+        assert isinstance(refused, BatcherFull)
+        assert isinstance(first, RuntimeError) and isinstance(last, RuntimeError)
+        assert batcher.snapshot()["rejected"] == 1 and batcher.snapshot()["failed_batches"] == 1
+
+
+class TestDamageClassifier:
+    """Test cases for the local damage classifier and /llm/damage_classify"""
+
+    def _classifier(self, batch_size=2):
+        import numpy as np
+        from AI_ML.damage_predictor import DamageClassifier
+
+        classifier = DamageClassifier("test/model", batch_size=batch_size)
+        batches = []
+
+        def processor(images, return_tensors):
+            assert return_tensors == "np"
+            return {"pixel_values": np.stack([np.asarray(image.resize((4, 4)), dtype=np.float64).transpose(2, 0, 1)
+                                              for image in images])}
+
+        def runner(pixel_values):
+            batches.append(len(pixel_values))
+            # logit per label: mean of the red and the green channel
+            return pixel_values.mean(axis=(2, 3))[:, :2] / 10
+        classifier._processor, classifier._runner = processor, runner
+        classifier.labels = {0: "dent", 1: "scratch"}
+        return classifier, batches
+
+    def _post(self, api_client, images):
+        import io
+        from PIL import Image
+        from routers import llmRoute
+
+        files = []
+        for name, color in images:
+            buffer = io.BytesIO()
+            Image.new("RGB", (12, 12), color).save(buffer, format="PNG")
+            files.append(("images", (name, buffer.getvalue())))
+
+        async def post():
+            async with api_client(llmRoute.router) as client:
+                return await client.post("/llm/damage_classify", files=files)
+        return asyncio.run(post())
+
+    def test_images_are_classified_in_batches(self, app_modules):
+        """Test that images run in batches of batch_size and get normalized label probabilities"""
+        from PIL import Image
+
+        classifier, batches = self._classifier(batch_size=2)
+        images = [Image.new("RGB", (8, 8), (200, 10, 0))] * 3 + [Image.new("RGB", (8, 8), (0, 200, 10))] * 2
+        predictions = classifier.classify(images)
+        assert batches == [2, 2, 1]
+        assert [p["label"] for p in predictions] == ["dent"] * 3 + ["scratch"] * 2
+        assert all(abs(sum(p["scores"].values()) - 1) < 1e-3 for p in predictions)
+        assert classifier.snapshot()["images"] == 5 and classifier.snapshot()["batches"] == 3
+
+    def test_endpoint_labels_each_upload(self, app_modules, api_client, monkeypatch):
+        """Test that the endpoint answers with one prediction per uploaded photo"""
+        from routers import llmRoute
+
+        from AI_ML.batching import MicroBatcher
+
+        classifier, _ = self._classifier()
+        monkeypatch.setattr(llmRoute, "damage_batcher", MicroBatcher(classifier.classify))
+        response = self._post(api_client, [("front.png", (220, 0, 0)), ("side.png", (0, 220, 0))])
+        assert response.status_code == 200
+        assert [(p["filename"], p["label"]) for p in response.json()["predictions"]] == [
+            ("front.png", "dent"), ("side.png", "scratch")]
+
+    def test_missing_libraries_answer_503(self, app_modules, api_client, monkeypatch):
+        """Test that the endpoint answers 503 when transformers can't be imported"""
+        import sys
+        from AI_ML.batching import MicroBatcher
+        from AI_ML.damage_predictor import DamageClassifier
+        from routers import llmRoute
+
+        monkeypatch.setitem(sys.modules, "transformers", None)
+        monkeypatch.setattr(llmRoute, "damage_batcher", MicroBatcher(DamageClassifier("test/model").classify))
+        response = self._post(api_client, [("front.png", (220, 0, 0))])
+        assert response.status_code == 503
+        assert "transformers" in response.json()["detail"]
+
+
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])